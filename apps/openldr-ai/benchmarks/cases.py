@@ -0,0 +1,232 @@
+"""
+Benchmark definitions, one generator per group. Fixtures are built inside
+the generator, so the large payloads only exist while their group runs.
+"""
+from types import SimpleNamespace
+from typing import Any, Iterator, Optional
+
+from fixtures import (
+    PAYLOADS,
+    QUERIES,
+    ChunkedResponse,
+    StubLlama,
+    adversarial_outputs,
+    sse_tool_response,
+    token_stream,
+    tool_catalogue,
+)
+from harness import Case
+
+KB = 1024
+MB = 1024 * KB
+
+
+def _size_label(n_bytes: int) -> str:
+    return f"{n_bytes // MB}MB" if n_bytes >= MB else f"{n_bytes // KB}KB"
+
+
+def router_cases(quick: bool, **_: Any) -> Iterator[Case]:
+    """Deterministic tool selection over synthetic catalogues; one op = every query in QUERIES."""
+    from services.tool_router import select_tool_for_query
+
+    for n_tools in ([10, 100, 500] if quick else [10, 50, 100, 250, 500]):
+        tools = tool_catalogue(n_tools)
+
+        def run(tools: list[dict] = tools) -> None:
+            for query in QUERIES:
+                select_tool_for_query(query, tools)
+
+        yield Case(f"router/select/tools={n_tools}", run, items=len(QUERIES), params={"tools": n_tools})
+
+
+def _payload_sizes(quick: bool, max_bytes: int) -> list[int]:
+    sizes = [1 * KB, 64 * KB, 1 * MB] if quick else [1 * KB, 64 * KB, 1 * MB, 10 * MB, 50 * MB]
+    return [s for s in sizes if s <= max_bytes]
+
+
+def compactor_cases(quick: bool, max_bytes: int = 50 * MB, **_: Any) -> Iterator[Case]:
+    """Parsing into a ToolResult plus compact_tool_result, on JSON record arrays, nested objects and plain text."""
+    from services.result_compactor import compact_tool_result
+    from services.tool_result import ToolResult
+
+    for size in _payload_sizes(quick, max_bytes):
+        for shape, build in PAYLOADS.items():
+            payload = build(size)
+            yield Case(
+                f"compactor/{shape}/{_size_label(size)}",
+                lambda payload=payload: compact_tool_result(ToolResult.from_text("get_lab_results", payload)),
+                bytes=len(payload),
+                params={"shape": shape, "bytes": len(payload)},
+            )
+        # The statistical summary that replaces the rows for a counting question,
+        # on a list wrapped the way the MCP tools return it
+        payload = PAYLOADS["wrapped"](size)
+        yield Case(
+            f"compactor/summary/{_size_label(size)}",
+            lambda payload=payload: compact_tool_result(
+                ToolResult.from_text("get_lab_results", payload),
+                question="how many resistant results per organism",
+            ),
+            bytes=len(payload),
+            params={"shape": "summary", "bytes": len(payload)},
+        )
+
+
+def mcp_read_cases(quick: bool, max_bytes: int = 50 * MB, **_: Any) -> Iterator[Case]:
+    """The incremental tools/call reader on SSE responses carrying the same payloads, in 64KB chunks."""
+    from services.mcp_stream import ToolResponseReader
+
+    for size in _payload_sizes(quick, max_bytes):
+        for shape, build in PAYLOADS.items():
+            body = sse_tool_response(build(size))
+
+            async def run(body: bytes = body) -> None:
+                reader = ToolResponseReader(max_bytes=len(body), keep_records=200)
+                await reader.read(ChunkedResponse(body))
+
+            yield Case(
+                f"mcp_read/{shape}/{_size_label(size)}",
+                run,
+                bytes=len(body),
+                params={"shape": shape, "bytes": len(body)},
+            )
+
+
+def format_cases(quick: bool, max_bytes: int = 50 * MB, **_: Any) -> Iterator[Case]:
+    """Parsing into a ToolResult plus format_tool_result (prompt template and format hint) on the same payloads."""
+    from services.tool_prompt import format_tool_result
+    from services.tool_result import ToolResult
+
+    for size in _payload_sizes(quick, max_bytes):
+        for shape, build in PAYLOADS.items():
+            payload = build(size)
+            yield Case(
+                f"format/{shape}/{_size_label(size)}",
+                lambda payload=payload: format_tool_result(ToolResult.from_text("get_lab_results", payload)),
+                bytes=len(payload),
+                params={"shape": shape, "bytes": len(payload)},
+            )
+
+
+def extract_cases(quick: bool, **_: Any) -> Iterator[Case]:
+    """extract_tool_call on adversarial outputs, and the streaming detector fed token by token."""
+    from services.tool_prompt import ToolCallDetector, extract_tool_call
+
+    for size in ([10 * KB, 100 * KB] if quick else [10 * KB, 100 * KB, 1 * MB]):
+        for kind, text in adversarial_outputs(size).items():
+            yield Case(
+                f"extract/{kind}/{_size_label(size)}",
+                lambda text=text: extract_tool_call(text),
+                bytes=len(text),
+                params={"kind": kind, "bytes": len(text)},
+            )
+
+    for kind in ("prose_braces", "call_at_end"):
+        tokens = token_stream(adversarial_outputs(100 * KB)[kind])
+
+        def run(tokens: list[str] = tokens) -> None:
+            detector = ToolCallDetector()
+            for token in tokens:
+                detector.feed(token)
+                if detector.complete:
+                    break
+            detector.finish()
+
+        yield Case(f"detector/{kind}/100KB", run, items=len(tokens), params={"tokens": len(tokens)})
+
+
+def _register(model_id: str, llm: Any, n_ctx: int = 4096, budget: Any = None) -> None:
+    from services.inference_executor import InferenceExecutor
+    from services.model_pool import ResidentModel, model_pool
+
+    model_pool.add(
+        ResidentModel(
+            model_id=model_id,
+            filename=None,
+            llm=llm,
+            executor=InferenceExecutor(llm, name=model_id.replace("/", "-")),
+            prefix_cache=None,
+            n_ctx=n_ctx,
+            weights_bytes=0,
+            kv_bytes=0,
+            budget=budget,
+        ),
+        make_default=False,
+    )
+
+
+_MESSAGES = [
+    {"role": "system", "content": "You are a laboratory data assistant."},
+    {"role": "user", "content": "Summarise the latest susceptibility results."},
+]
+
+
+def sse_cases(quick: bool, **_: Any) -> Iterator[Case]:
+    """The /chat/stream SSE generator end to end over a stub model: executor thread, queue, json, framing."""
+    from routers.chat import _sse_generator
+
+    _register("bench/stub-sse", StubLlama())
+    ticket = SimpleNamespace(release=lambda: None)
+
+    for n_events in ([256] if quick else [256, 2048]):
+
+        async def run(n_events: int = n_events) -> None:
+            async for _ in _sse_generator(ticket, _MESSAGES, n_events, 0.0, model_id="bench/stub-sse"):
+                pass
+
+        yield Case(f"sse/chat_stream/events={n_events}", run, items=n_events, params={"events": n_events})
+
+
+def generation_cases(quick: bool, gguf: Optional[str] = None, **_: Any) -> Iterator[Case]:
+    """
+    Generation through services.inference: a stub Llama measures the
+    service's own per-token overhead; --gguf adds a real model.
+    """
+    from services.inference import complete_chat, stream_chat_tokens
+
+    _register("bench/stub", StubLlama())
+    n_tokens = 256
+
+    async def stream(model_id: str, max_tokens: int) -> None:
+        async for _ in stream_chat_tokens(_MESSAGES, max_tokens, 0.0, model_id=model_id):
+            pass
+
+    yield Case(
+        f"generation/stub/stream/tokens={n_tokens}",
+        lambda: stream("bench/stub", n_tokens),
+        items=n_tokens,
+        params={"tokens": n_tokens},
+    )
+    yield Case(
+        f"generation/stub/complete/tokens={n_tokens}",
+        lambda: complete_chat(_MESSAGES, n_tokens, 0.0, model_id="bench/stub"),
+        items=n_tokens,
+        params={"tokens": n_tokens},
+    )
+
+    if gguf:
+        from llama_cpp import Llama
+
+        from services.context_budget import ContextBudget
+
+        llm = Llama(model_path=gguf, n_ctx=2048, n_gpu_layers=0, verbose=False)
+        _register("bench/gguf", llm, n_ctx=2048, budget=ContextBudget(llm, 2048))
+        n_tokens = 32 if quick else 64
+        yield Case(
+            f"generation/gguf/stream/tokens={n_tokens}",
+            lambda: stream("bench/gguf", n_tokens),
+            items=n_tokens,
+            params={"tokens": n_tokens, "model": gguf.rsplit("/", 1)[-1]},
+        )
+
+
+# Group name -> case generator, in run order
+GROUPS = {
+    "router": router_cases,
+    "compactor": compactor_cases,
+    "mcp_read": mcp_read_cases,
+    "format": format_cases,
+    "extract": extract_cases,
+    "sse": sse_cases,
+    "generation": generation_cases,
+}
@@ -0,0 +1,198 @@
+"""
+Synthetic inputs for the benchmark suite. Everything is generated from a
+fixed seed, so two runs of the same code measure the same work.
+"""
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Iterator
+
+SEED = 20240611
+
+_DOMAIN_WORDS = [
+    "lab", "result", "results", "patient", "sample", "specimen", "facility", "culture", "isolate",
+    "organism", "antibiotic", "susceptibility", "resistance", "pipeline", "run", "upload", "batch",
+    "dashboard", "project", "report", "summary", "status", "health", "count", "trend", "district",
+    "province", "request", "test", "panel", "ward", "date", "quality", "control", "instrument",
+]
+
+_PARAMETERS = [
+    ("limit", {"type": "integer", "description": "Maximum number of records"}),
+    ("date_from", {"type": "string", "format": "date", "description": "Start date (YYYY-MM-DD)"}),
+    ("date_to", {"type": "string", "format": "date", "description": "End date (YYYY-MM-DD)"}),
+    ("facility_code", {"type": "string", "description": "Facility code"}),
+    ("status", {"type": "string", "enum": ["pending", "running", "completed", "failed"]}),
+    ("patient_id", {"type": "string", "description": "Patient identifier"}),
+    ("include_details", {"type": "boolean"}),
+    ("organism", {"type": "string", "description": "Organism name"}),
+]
+
+QUERIES = [
+    "show the status of the last 5 pipeline runs",
+    "how many lab results were uploaded yesterday",
+    "list failed runs for facility ABC123 since 2024-01-01",
+    "find patient 12345 culture results",
+    "count isolates by organism this month",
+    "what is the health of the dashboard service",
+    "show susceptibility summary for Klebsiella in the district",
+    "get recent uploads",
+    "explain what antimicrobial resistance means",
+    "latest quality control results for instrument 7",
+]
+
+
+def tool_catalogue(n_tools: int) -> list[dict[str, Any]]:
+    """MCP-style tool list: names, one-line descriptions and small inputSchemas."""
+    rng = random.Random(SEED + n_tools)
+    tools = []
+    for i in range(n_tools):
+        verb = rng.choice(["get", "list", "search", "count", "find"])
+        nouns = rng.sample(_DOMAIN_WORDS, 2)
+        params = dict(rng.sample(_PARAMETERS, rng.randint(0, 4)))
+        tools.append({
+            "name": f"{verb}_{nouns[0]}_{nouns[1]}_{i}",
+            "description": " ".join(rng.choices(_DOMAIN_WORDS, k=12)).capitalize() + ".",
+            "inputSchema": {
+                "type": "object",
+                "properties": params,
+                "required": [p for p in params if rng.random() < 0.2],
+            },
+        })
+    return tools
+
+
+def _record(rng: random.Random, i: int) -> dict[str, Any]:
+    return {
+        "id": f"{rng.getrandbits(32):08x}-{i:06d}",
+        "patient_id": f"P{rng.randint(10000, 99999)}",
+        "facility_code": rng.choice(["ABC123", "XYZ987", "KLM456", "QRS321"]),
+        "organism": rng.choice(["Escherichia coli", "Klebsiella pneumoniae", "Staphylococcus aureus"]),
+        "antibiotic": rng.choice(["ceftriaxone", "ciprofloxacin", "meropenem", "amikacin"]),
+        "interpretation": rng.choice(["S", "I", "R"]),
+        "mic": round(rng.uniform(0.1, 64), 2),
+        "collected_at": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "comment": " ".join(rng.choices(_DOMAIN_WORDS, k=rng.randint(2, 10))),
+    }
+
+
+def json_records(target_bytes: int) -> str:
+    """A JSON array of lab-result records, about target_bytes long."""
+    rng = random.Random(SEED + target_bytes)
+    sample = json.dumps(_record(rng, 0))
+    count = max(1, target_bytes // (len(sample) + 2))
+    return json.dumps([_record(rng, i) for i in range(count)])
+
+
+def wrapped_records(target_bytes: int) -> str:
+    """Lab-result records wrapped as the MCP tools return lists, {"count": n, "results": [...]}."""
+    records = json.loads(json_records(max(256, target_bytes - 32)))
+    return json.dumps({"count": len(records), "results": records})
+
+
+def json_object(target_bytes: int) -> str:
+    """A JSON object with a nested object and two record lists, about target_bytes long."""
+    records = json.loads(json_records(max(256, target_bytes - 200)))
+    half = len(records) // 2
+    return json.dumps({
+        "facility": {"code": "ABC123", "name": "Central Lab", "country": "TZ"},
+        "generated_at": "2024-06-11",
+        "recent": records[:half],
+        "flagged": records[half:],
+    })
+
+
+def plain_text(target_bytes: int) -> str:
+    """Log-style plain text lines, about target_bytes long."""
+    rng = random.Random(SEED + target_bytes + 1)
+    lines = []
+    size = 0
+    while size < target_bytes:
+        line = f"2024-06-11T10:{rng.randint(0, 59):02d}:00 INFO " + " ".join(rng.choices(_DOMAIN_WORDS, k=10))
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)
+
+
+PAYLOADS = {"records": json_records, "wrapped": wrapped_records, "object": json_object, "text": plain_text}
+
+
+def sse_tool_response(text: str) -> bytes:
+    """A tools/call response carrying text, framed as the MCP server sends it over SSE."""
+    message = {"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}], "isError": False}}
+    return f"event: message\ndata: {json.dumps(message)}\n\n".encode("utf-8")
+
+
+class ChunkedResponse:
+    """The part of httpx.Response the MCP reader uses: headers and aiter_bytes()."""
+
+    headers = {"content-type": "text/event-stream"}
+
+    def __init__(self, body: bytes, chunk_bytes: int = 64 * 1024):
+        self.body = body
+        self.chunk_bytes = chunk_bytes
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        for i in range(0, len(self.body), self.chunk_bytes):
+            yield self.body[i:i + self.chunk_bytes]
+
+
+def adversarial_outputs(target_chars: int) -> dict[str, str]:
+    """
+    Model outputs that make naive tool-call parsers backtrack: unclosed tags,
+    unterminated fences, stray braces, and a valid call buried at the end.
+    """
+    call = '{"tool": "get_lab_results", "args": {"limit": 5}}'
+    prose = "The isolate was resistant to ceftriaxone {see note} and the MIC was 32. "
+    return {
+        "unclosed_tags": ("<tool_call> {\"tool\": \"x\", " * (target_chars // 24))[:target_chars],
+        "unclosed_fences": ("```json\n{\"tool\": \"x\"\n" * (target_chars // 22))[:target_chars],
+        "open_braces": ('{"tool": {"a": [' * (target_chars // 16))[:target_chars],
+        "prose_braces": (prose * (target_chars // len(prose)))[:target_chars],
+        "call_at_end": (prose * (target_chars // len(prose)))[:target_chars] + f"\n<tool_call>\n{call}\n</tool_call>",
+    }
+
+
+def token_stream(text: str, chunk: int = 4) -> list[str]:
+    """Split text into model-token-sized chunks."""
+    return [text[i:i + chunk] for i in range(0, len(text), chunk)]
+
+
+class StubLlama:
+    """
+    Stands in for llama_cpp.Llama in generation benchmarks: same
+    create_chat_completion shape, no model. An optional per-token delay
+    simulates decode time.
+    """
+
+    def __init__(self, token: str = " lorem", token_seconds: float = 0.0):
+        self.token = token
+        self.token_seconds = token_seconds
+
+    def create_chat_completion(
+        self,
+        messages: list[dict],
+        max_tokens: int = 16,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        if stream:
+            return self._stream(max_tokens)
+        if self.token_seconds:
+            time.sleep(self.token_seconds * max_tokens)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": self.token * max_tokens}, "finish_reason": "length"}],
+            "usage": {"completion_tokens": max_tokens},
+        }
+
+    def _stream(self, max_tokens: int) -> Iterator[dict]:
+        for _ in range(max_tokens):
+            if self.token_seconds:
+                time.sleep(self.token_seconds)
+            yield {"choices": [{"delta": {"content": self.token}, "finish_reason": None}]}
+        yield {"choices": [{"delta": {}, "finish_reason": "length"}]}
+
+    def reset(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
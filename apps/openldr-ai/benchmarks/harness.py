@@ -0,0 +1,147 @@
+"""
+Timing, result files and baseline comparison for the benchmark suite.
+"""
+import asyncio
+import gc
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+@dataclass
+class Case:
+    name: str                      # "group/operation/params", the key in the result file
+    fn: Callable[[], Any]          # one operation; may return an awaitable
+    bytes: int = 0                 # input bytes per operation, for MB/s
+    items: int = 0                 # items per operation (tokens, events, queries), for items/s
+    params: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Budget:
+    min_runs: int = 3
+    max_runs: int = 200
+    min_seconds: float = 0.5
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(case: Case, budget: Budget, loop: asyncio.AbstractEventLoop) -> dict[str, Any]:
+    """Run case.fn until both min_runs and min_seconds are reached (or max_runs), and summarise."""
+    def once() -> float:
+        started = time.perf_counter()
+        result = case.fn()
+        if inspect.isawaitable(result):
+            loop.run_until_complete(result)
+        return time.perf_counter() - started
+
+    once()  # warm-up: imports, caches, first-call allocations
+    gc.collect()
+    times: list[float] = []
+    spent = 0.0
+    while len(times) < budget.max_runs and (len(times) < budget.min_runs or spent < budget.min_seconds):
+        elapsed = once()
+        times.append(elapsed)
+        spent += elapsed
+
+    times.sort()
+    median = statistics.median(times)
+    result = {
+        "runs": len(times),
+        "median_ms": round(median * 1000, 4),
+        "mean_ms": round(statistics.fmean(times) * 1000, 4),
+        "min_ms": round(times[0] * 1000, 4),
+        "p95_ms": round(_percentile(times, 0.95) * 1000, 4),
+        "ops_per_second": round(1 / median, 2) if median else None,
+        **case.params,
+    }
+    if case.bytes and median:
+        result["mb_per_second"] = round(case.bytes / median / 1024 ** 2, 2)
+    if case.items and median:
+        result["items_per_second"] = round(case.items / median, 1)
+    return result
+
+
+def _git_commit(cwd: Path) -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def metadata(quick: bool) -> dict[str, Any]:
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git_commit(Path(__file__).parent),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "quick": quick,
+    }
+
+
+def write_results(path: Path, meta: dict[str, Any], results: dict[str, dict[str, Any]]) -> None:
+    path.write_text(json.dumps({"meta": meta, "results": results}, indent=2) + "\n")
+
+
+def read_results(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text())
+
+
+def compare(
+    baseline: dict[str, Any],
+    current: dict[str, Any],
+    threshold: float,
+) -> tuple[list[dict[str, Any]], int]:
+    """
+    Compare median times case by case. A case is a regression when it got
+    slower by more than `threshold` (0.1 = 10%). Returns the rows and the
+    number of regressions.
+    """
+    rows = []
+    regressions = 0
+    base_results = baseline.get("results", {})
+    current_results = current.get("results", {})
+    for name in sorted(set(base_results) | set(current_results)):
+        before = base_results.get(name, {}).get("median_ms")
+        after = current_results.get(name, {}).get("median_ms")
+        if before is None or after is None:
+            status = "new" if before is None else "missing"
+            change = None
+        else:
+            change = (after - before) / before if before else 0.0
+            if change > threshold:
+                status = "REGRESSION"
+                regressions += 1
+            elif change < -threshold:
+                status = "faster"
+            else:
+                status = "ok"
+        rows.append({"name": name, "baseline_ms": before, "current_ms": after, "change": change, "status": status})
+    return rows, regressions
+
+
+def print_comparison(rows: list[dict[str, Any]], threshold: float) -> None:
+    width = max((len(r["name"]) for r in rows), default=10)
+    print(f"\n{'case':<{width}}  {'baseline ms':>12}  {'current ms':>12}  {'change':>8}  status")
+    for r in rows:
+        before = f"{r['baseline_ms']:.3f}" if r["baseline_ms"] is not None else "-"
+        after = f"{r['current_ms']:.3f}" if r["current_ms"] is not None else "-"
+        change = f"{r['change'] * 100:+.1f}%" if r["change"] is not None else "-"
+        print(f"{r['name']:<{width}}  {before:>12}  {after:>12}  {change:>8}  {r['status']}")
+    print(f"(threshold {threshold * 100:.0f}% on median time)")
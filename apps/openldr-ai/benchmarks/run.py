@@ -0,0 +1,95 @@
+"""
+Offline benchmark suite for the AI service hot paths.
+
+    python benchmarks/run.py                         # everything, results to benchmarks/results.json
+    python benchmarks/run.py --quick --group router  # smaller sizes, one group
+    python benchmarks/run.py --gguf /path/model.gguf # add real-model generation
+    python benchmarks/run.py --compare baseline.json # run, then compare against a baseline
+    python benchmarks/run.py --compare baseline.json --current results.json   # compare two files
+
+Needs no network and no MCP server: tool catalogues, payloads and model
+outputs are synthetic, and generation runs against a stub Llama unless
+--gguf is given. With --compare the exit code is 1 when any case got slower
+than --threshold.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "src"))
+sys.path.insert(0, str(BENCH_DIR))
+
+# Keep the service's settings away from real volumes and networks
+os.environ.setdefault("AI_MODELS_DIR", tempfile.mkdtemp(prefix="openldr-ai-bench-"))
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+from cases import GROUPS  # noqa: E402
+from harness import Budget, compare, measure, metadata, print_comparison, read_results, write_results  # noqa: E402
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for apps/openldr-ai")
+    parser.add_argument("--group", action="append", choices=list(GROUPS), help="run only these groups (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer repetitions")
+    parser.add_argument("--max-mb", type=float, default=50, help="largest payload for compactor/format (default 50)")
+    parser.add_argument("--gguf", help="GGUF file to benchmark real generation with")
+    parser.add_argument("--output", type=Path, default=BENCH_DIR / "results.json", help="where to write results")
+    parser.add_argument("--compare", type=Path, help="baseline results file to compare against")
+    parser.add_argument("--current", type=Path, help="with --compare: compare this file instead of running")
+    parser.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression (0.10 = 10%%)")
+    return parser.parse_args()
+
+
+def run(args: argparse.Namespace) -> dict:
+    budget = Budget(min_runs=2, max_runs=50, min_seconds=0.2) if args.quick else Budget()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    try:
+        for group in args.group or list(GROUPS):
+            for case in GROUPS[group](quick=args.quick, max_bytes=int(args.max_mb * 1024 * 1024), gguf=args.gguf):
+                result = measure(case, budget, loop)
+                results[case.name] = result
+                rate = ""
+                if "mb_per_second" in result:
+                    rate = f"  {result['mb_per_second']:>9.1f} MB/s"
+                elif "items_per_second" in result:
+                    rate = f"  {result['items_per_second']:>9.0f} items/s"
+                print(f"{case.name:<44} {result['median_ms']:>11.3f} ms  p95 {result['p95_ms']:>11.3f} ms{rate}")
+    finally:
+        from services.model_pool import model_pool
+
+        for model_id in [m["model_id"] for m in model_pool.snapshot()["models"]]:
+            model_pool.unload(model_id)
+        loop.close()
+
+    current = {"meta": metadata(args.quick), "results": results}
+    write_results(args.output, current["meta"], results)
+    print(f"\nWrote {len(results)} results to {args.output}")
+    return current
+
+
+def main() -> int:
+    args = _parse_args()
+    if args.current and not args.compare:
+        print("--current needs --compare", file=sys.stderr)
+        return 2
+
+    current = read_results(args.current) if args.current else run(args)
+    if not args.compare:
+        return 0
+
+    rows, regressions = compare(read_results(args.compare), current, args.threshold)
+    print_comparison(rows, args.threshold)
+    if regressions:
+        print(f"{regressions} regression(s)")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
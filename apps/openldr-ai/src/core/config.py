@@ -22,20 +22,123 @@ class Settings(BaseSettings):
     # Default model to load on startup (optional - leave empty to skip)
     AI_DEFAULT_MODEL: str = ""
 
+    # RAM budget for resident models (weights + KV cache); the least recently
+    # used model is unloaded when a new one doesn't fit
+    AI_MODEL_POOL_MAX_MB: int = 8192
+
+    # Load a downloaded but non-resident model when a chat request names it.
+    # Off by default: requests are only served by resident models, and models
+    # are loaded through /models/load
+    AI_LOAD_MODELS_ON_DEMAND: bool = False
+
+    # Where inference runs: "local" (one Llama per model in this process),
+    # "batch" (one context per model decoding up to AI_BATCH_MAX_SEQUENCES
+    # requests together), "workers" (AI_INFERENCE_WORKERS processes per model,
+    # each with AI_INFERENCE_THREADS_PER_WORKER threads; 0 = split the cores
+    # evenly) or "server" (forward to a llama_cpp.server at AI_LLAMA_SERVER_URL)
+    AI_INFERENCE_BACKEND: str = "local"
+    AI_BATCH_MAX_SEQUENCES: int = 8
+    AI_INFERENCE_WORKERS: int = 4
+    AI_INFERENCE_THREADS_PER_WORKER: int = 0
+    AI_LLAMA_SERVER_URL: str = "http://127.0.0.1:8000"
+
+    # Speculative decoding for the local and workers backends: "off",
+    # "prompt_lookup" (draft from n-grams already in the prompt) or "draft"
+    # (draft with AI_SPECULATIVE_DRAFT_MODEL, a downloaded model_id whose GGUF
+    # shares the main model's vocabulary). Up to AI_SPECULATIVE_NUM_PRED_TOKENS
+    # tokens are drafted per step; prompt lookup matches n-grams of up to
+    # AI_SPECULATIVE_NGRAM_SIZE tokens.
+    AI_SPECULATIVE_MODE: str = "off"
+    AI_SPECULATIVE_DRAFT_MODEL: str = ""
+    AI_SPECULATIVE_NUM_PRED_TOKENS: int = 10
+    AI_SPECULATIVE_NGRAM_SIZE: int = 2
+
     # Max tokens for generation
     AI_MAX_NEW_TOKENS: int = 512
 
+    # Tokens buffered between the inference thread and an SSE consumer
+    # before the decoder waits for the client to catch up (the batch engine
+    # leaves that sequence out of its steps until the client reads again)
+    AI_INFERENCE_QUEUE_SIZE: int = 64
+
+    # Memory for saved KV states of evaluated system-prompt prefixes (0 disables)
+    AI_PREFIX_CACHE_MAX_MB: int = 256
+
+    # /chat admission control: concurrent generations, wait-queue size and
+    # how long a queued request may wait for a slot before giving up
+    AI_SCHEDULER_MAX_CONCURRENCY: int = 2
+    AI_SCHEDULER_MAX_QUEUE: int = 16
+    AI_SCHEDULER_QUEUE_TIMEOUT_SECONDS: float = 60.0
+
+    # How often the event-loop lag probe behind /metrics wakes up (0 disables)
+    AI_EVENT_LOOP_LAG_INTERVAL_SECONDS: float = 0.5
+
+    # Per-request traces: how many recent ones /debug/traces keeps (0 keeps
+    # none) and an optional OTLP/HTTP collector to export them to, e.g.
+    # "http://localhost:4318" (needs the OpenTelemetry SDK and exporter)
+    AI_TRACE_BUFFER_SIZE: int = 100
+    AI_TRACE_OTLP_ENDPOINT: str = ""
+
     # MCP server URL (internal Docker network URL)
     AI_MCP_URL: str = "http://127.0.0.1:6060"
 
+    # Initialized MCP sessions kept open and shared between concurrent requests
+    AI_MCP_SESSION_POOL_SIZE: int = 4
+
+    # Tool catalogue: background refresh interval, retry interval while the
+    # MCP server is unreachable, and whether to listen for tools/list_changed
+    AI_MCP_TOOLS_TTL_SECONDS: float = 300.0
+    AI_MCP_TOOLS_RETRY_SECONDS: float = 15.0
+    AI_MCP_TOOLS_SUBSCRIBE: bool = True
+
+    # tools/call responses are read incrementally, at most AI_MCP_RESULT_MAX_MB
+    # per call; a result too big to pass on verbatim keeps the first
+    # AI_MCP_RESULT_KEEP_RECORDS records of each list, up to
+    # AI_MCP_RESULT_KEEP_MB of them, and counts the rest (the statistical
+    # summary still covers every record read)
+    AI_MCP_RESULT_MAX_MB: float = 64.0
+    AI_MCP_RESULT_KEEP_RECORDS: int = 5000
+    AI_MCP_RESULT_KEEP_MB: float = 4.0
+
     # Max tool calls per agentic turn (prevents infinite loops)
     AI_MAX_TOOL_CALLS: int = 3
 
+    # Constrain the model-driven tool-calling passes with a GBNF grammar built
+    # from the MCP tools' inputSchemas: either a plain answer or one valid
+    # <tool_call> object, with generation ending as soon as the object closes
+    AI_CONSTRAINED_TOOL_CALLS: bool = True
+
+    # Semantic routing stage: a downloaded GGUF embedding model_id (empty
+    # disables it). A tool's cosine similarity to the question, if at least
+    # AI_SEMANTIC_ROUTER_MIN_SIMILARITY, is rescaled from [min, 1] to
+    # [0, AI_SEMANTIC_ROUTER_WEIGHT] and added to its lexical score
+    AI_EMBEDDING_MODEL: str = ""
+    AI_SEMANTIC_ROUTER_WEIGHT: float = 2.5
+    AI_SEMANTIC_ROUTER_MIN_SIMILARITY: float = 0.5
+
+    # Tool result cache (deterministic route): total size, TTL for read-only
+    # tools, and per-tool overrides as "tool_name=seconds,..." (0 disables)
+    AI_TOOL_CACHE_MAX_MB: int = 32
+    AI_TOOL_CACHE_DEFAULT_TTL_SECONDS: float = 15.0
+    AI_TOOL_CACHE_TTLS: str = "health_check=0"
+
+    # Whole-answer cache (deterministic route): finished answers keyed by model,
+    # question, tool call and a hash of the tool result (TTL 0 disables it). With
+    # AI_ANSWER_CACHE_PERSIST it is saved to AI_MODELS_DIR on shutdown and
+    # loaded again on startup
+    AI_ANSWER_CACHE_MAX_MB: int = 8
+    AI_ANSWER_CACHE_TTL_SECONDS: float = 3600.0
+    AI_ANSWER_CACHE_PERSIST: bool = False
+
     # Prompt budgeting / small-model safety
     AI_MAX_INPUT_TOKENS: int = 4096
     AI_RESERVED_OUTPUT_TOKENS: int = 768
     AI_CONTEXT_SAFETY_MARGIN_TOKENS: int = 256
     AI_MAX_HISTORY_MESSAGES: int = 6
+    # Most tokens a tool result may take in the answer prompt; it gets less
+    # when the context has less left
+    AI_TOOL_RESULT_MAX_TOKENS: int = 1024
+    # Superseded by AI_TOOL_RESULT_MAX_TOKENS; still accepted so existing env files load
     AI_TOOL_RESULT_CHAR_LIMIT: int = 3500
 
     @property
@@ -9,6 +9,8 @@ from typing import Any
 # Shape: { "Qwen/Qwen2.5-0.5B-Instruct": { "status": "downloading", "progress": 45, "error": None } }
 download_state: dict[str, dict[str, Any]] = {}
 
-# Holds the currently loaded model + tokenizer
-# Shape: { "model_id": str, "model": <model>, "tokenizer": <tokenizer> }
-loaded_model: dict[str, Any] = {}
+# Tracks /models/tune jobs per model_id
+# Shape: { "Qwen/Qwen2.5-0.5B-Instruct": { "status": "running", "done": 3, "total": 12, "results": [...], "error": None } }
+tune_state: dict[str, dict[str, Any]] = {}
+
+# Loaded models live in services.model_pool.model_pool
@@ -3,7 +3,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from core.config import settings
-from routers import health, models, chat
+from routers import health, models, chat, tools, metrics, debug
 
 
 
@@ -22,16 +22,41 @@ async def lifespan(app: FastAPI):
         else:
             print(f"[startup] Default model not downloaded: {settings.AI_DEFAULT_MODEL}")
 
-    # Prefetch MCP tools so first request isn't slow
-    try:
-        from services.mcp_client import fetch_tools
-        tools = await fetch_tools()
-        print(f"[startup] MCP tools loaded: {[t['name'] for t in tools]}")
-    except Exception as e:
-        print(f"[startup] MCP tools unavailable (will retry on first request): {e}")
+    # Embedding model for the router's semantic stage (optional)
+    if settings.AI_EMBEDDING_MODEL:
+        from services.model_manager import load_embedding_model
+        success, err = load_embedding_model(settings.AI_EMBEDDING_MODEL)
+        if not success:
+            print(f"[startup] Failed to load embedding model {settings.AI_EMBEDDING_MODEL}: {err}")
+
+    # Load the MCP tool catalogue, then keep it fresh in the background
+    from services.mcp_client import tool_catalogue
+    snapshot = await tool_catalogue.start()
+    if snapshot.tools:
+        print(f"[startup] MCP tools loaded: {[t['name'] for t in snapshot.tools]}")
+    else:
+        print("[startup] MCP tools unavailable (will keep retrying in the background)")
+
+    # Answers saved by the previous run (AI_ANSWER_CACHE_PERSIST)
+    from services.answer_cache import answer_cache
+    answer_cache.load()
+
+    from services.metrics import start_event_loop_monitor
+    loop_monitor = start_event_loop_monitor()
 
     yield
 
+    if loop_monitor is not None:
+        loop_monitor.cancel()
+
+    from services.mcp_client import close_mcp_client
+    await close_mcp_client()
+
+    from services.semantic_router import semantic_router
+    semantic_router.close()
+
+    answer_cache.save()
+
 
 app = FastAPI(
     title=settings.AI_APP_NAME,
@@ -52,6 +77,9 @@ app.add_middleware(
 app.include_router(health.router)
 app.include_router(models.router)
 app.include_router(chat.router)
+app.include_router(tools.router)
+app.include_router(metrics.router)
+app.include_router(debug.router)
 
 
 @app.get("/")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Literal, Optional
 from datetime import datetime
 
@@ -30,6 +30,24 @@ class AvailableModel(BaseModel):
 class LoadModelRequest(BaseModel):
     model_id: str
     filename: Optional[str] = None
+    # Override AI_SPECULATIVE_MODE / AI_SPECULATIVE_DRAFT_MODEL for this model
+    speculative: Optional[Literal["off", "prompt_lookup", "draft"]] = None
+    draft_model: Optional[str] = None  # model_id of a downloaded draft GGUF
+
+
+class TuneModelRequest(BaseModel):
+    model_id: str
+    filename: Optional[str] = None
+    # Grid to benchmark; anything left out uses the tuner's defaults
+    n_threads: Optional[list[int]] = None  # default: half, all-but-one and all cores
+    n_batch: Optional[list[int]] = None
+    n_ctx: Optional[list[int]] = None
+    use_mmap: Optional[list[bool]] = None
+    use_mlock: Optional[list[bool]] = None
+    flash_attn: Optional[list[bool]] = None
+    kv_cache_type: Optional[list[Literal["f16", "q8_0", "q4_0"]]] = None
+    prompt_tokens: int = Field(256, ge=16, le=4096)
+    decode_tokens: int = Field(32, ge=4, le=1024)
 
 
 # --- Chat ---
@@ -45,11 +63,14 @@ class ChatRequest(BaseModel):
     temperature: float = 0.7
     stream: bool = True
     enable_thinking: bool = False
+    model: Optional[str] = None  # model_id to answer with; default model if omitted
+    timings: bool = False  # return the request's span timeline (a final SSE event when streaming)
 
 
 class ChatResponse(BaseModel):
     role: Literal["assistant"] = "assistant"
     content: str
+    timings: Optional[dict] = None
 
 
 # --- Health ---
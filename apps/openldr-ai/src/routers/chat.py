@@ -1,44 +1,91 @@
 import json
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
 
+from core.config import settings
 from models.schemas import ChatRequest, ChatResponse
 from services.inference import generate_stream, generate, is_model_loaded
+from services.model_manager import load_model
 from services.agentic_inference import agentic_stream
+from services.answer_cache import answer_cache
+from services.scheduler import scheduler, SchedulerRejected, Ticket, LANE_INTERACTIVE, LANE_BULK
+from services.tracing import Trace, activate, finish_trace, start_trace
 
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
-async def _sse_generator(messages: list[dict], max_new_tokens: int, temperature: float):
+async def _sse_generator(
+    ticket: Ticket,
+    messages: list[dict],
+    max_new_tokens: int,
+    temperature: float,
+    model_id: Optional[str] = None,
+    trace: Optional[Trace] = None,
+    timings: bool = False,
+):
     """Simple streaming - no tool use."""
+    activate(trace)
     try:
-        async for token in generate_stream(messages, max_new_tokens, temperature):
+        async for token in generate_stream(messages, max_new_tokens, temperature, model_id=model_id):
             yield f"data: {json.dumps({'token': token})}\n\n"
         yield f"data: {json.dumps({'done': True})}\n\n"
+        if trace is not None and timings:
+            yield _timings_event(trace)
     except Exception as e:
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        ticket.release()
+        _end_trace(trace)
 
 
 async def _agentic_sse_generator(
+    ticket: Ticket,
     messages: list[dict],
     max_new_tokens: int,
     temperature: float,
     enable_thinking: bool = False,
+    model_id: Optional[str] = None,
+    trace: Optional[Trace] = None,
+    timings: bool = False,
 ):
     """
     Agentic streaming - model can call MCP tools before answering.
     Yields the same SSE format as the simple endpoint plus:
     - {"status": "Querying tool_name..."} while tool executes
     - {"tool_call": {...}} for frontend to show what tool was called
+    - {"timings": {...}} after "done" when the request asked for timings
     """
+    activate(trace)
     try:
-        async for event in agentic_stream(messages, max_new_tokens, temperature, enable_thinking=enable_thinking):
+        async for event in agentic_stream(
+            messages, max_new_tokens, temperature, enable_thinking=enable_thinking, model_id=model_id,
+        ):
             yield f"data: {event}\n\n"
+        if trace is not None and timings:
+            yield _timings_event(trace)
     except Exception as e:
         import traceback
         traceback.print_exc()
         yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    finally:
+        ticket.release()
+        _end_trace(trace)
+
+
+def _timings_event(trace: Trace) -> str:
+    finish_trace(trace)
+    return f"data: {json.dumps({'timings': trace.to_dict()})}\n\n"
+
+
+def _end_trace(trace: Optional[Trace]) -> None:
+    if trace is not None:
+        finish_trace(trace)
+        activate(None)
 
 
 SSE_HEADERS = {
@@ -48,52 +95,155 @@ SSE_HEADERS = {
 }
 
 
+async def _ensure_model(model_id: Optional[str]) -> None:
+    """
+    Make sure the requested model (or the default one) is resident. Requests
+    are served by resident models only; with AI_LOAD_MODELS_ON_DEMAND a named
+    model that is downloaded but not loaded yet is loaded into the pool without
+    becoming the default (and without evicting it).
+    """
+    if is_model_loaded(model_id):
+        return
+    if not model_id:
+        raise HTTPException(status_code=503, detail="No model loaded.")
+    if not settings.AI_LOAD_MODELS_ON_DEMAND:
+        raise HTTPException(
+            status_code=409, detail=f"Model {model_id} is not loaded. Load it through /models/load first."
+        )
+    success, error = await run_in_threadpool(load_model, model_id, make_default=False)
+    if not success:
+        raise HTTPException(status_code=400, detail=f"Model {model_id} could not be loaded: {error}")
+
+
+async def _acquire_slot(lane: str, trace: Trace) -> Ticket:
+    """
+    Admit the request into the scheduler and wait for an inference slot.
+    Sheds load with 429/503 + Retry-After instead of queueing without bound.
+    """
+    try:
+        with trace.span("queue", lane=lane):
+            ticket = scheduler.admit(lane)
+            await ticket.acquire()
+    except SchedulerRejected as e:
+        finish_trace(trace)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    return ticket
+
+
+class _SSEResponse(StreamingResponse):
+    """
+    StreamingResponse that releases the slot and finishes the trace however
+    the response ends. A client that disconnects before the generator's
+    first iteration never runs its finally block, and Starlette skips
+    background tasks after a disconnect.
+    """
+
+    def __init__(self, body, ticket: Ticket, trace: Optional[Trace]):
+        super().__init__(body, media_type="text/event-stream", headers=SSE_HEADERS)
+        self.ticket = ticket
+        self.trace = trace
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Both are no-ops when the generator already did this
+            self.ticket.release()
+            _end_trace(self.trace)
+
+
+@router.get("/queue")
+async def chat_queue():
+    """Live scheduler figures: active generations, queue depth per lane, wait times."""
+    return scheduler.snapshot()
+
+
+@router.get("/cache")
+async def answer_cache_stats():
+    """Hit/miss counters and size of the deterministic-route answer cache."""
+    return answer_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_answer_cache():
+    """Drops every cached answer, including the saved copy on disk."""
+    answer_cache.clear()
+    return answer_cache.stats()
+
+
 @router.post("/stream")
 async def chat_stream(req: ChatRequest):
     """
     Simple streaming chat - no tool use.
     Use for general conversation not requiring live data.
     """
-    if not is_model_loaded():
-        raise HTTPException(status_code=503, detail="No model loaded.")
+    await _ensure_model(req.model)
 
+    trace = start_trace("chat.stream", model=req.model)
+    ticket = await _acquire_slot(LANE_INTERACTIVE, trace)
     messages = [m.model_dump() for m in req.messages]
-    return StreamingResponse(
-        _sse_generator(messages, req.max_new_tokens, req.temperature),
-        media_type="text/event-stream",
-        headers=SSE_HEADERS,
+    return _SSEResponse(
+        _sse_generator(
+            ticket, messages, req.max_new_tokens, req.temperature, model_id=req.model,
+            trace=trace, timings=req.timings,
+        ),
+        ticket,
+        trace,
     )
 
 
 @router.post("/agent")
 async def chat_agent(req: ChatRequest):
-    if not is_model_loaded():
-        raise HTTPException(status_code=503, detail="No model loaded.")
-    
+    await _ensure_model(req.model)
+
     messages = [m.model_dump() for m in req.messages]
-    
+
     # ← honour stream: false
     if not req.stream:
-        result = ""
-        async for event in agentic_stream(messages, req.max_new_tokens, req.temperature, enable_thinking=req.enable_thinking):
-            parsed = json.loads(event)
-            if "token" in parsed:
-                result += parsed["token"]
-        return ChatResponse(content=result)
-
-    return StreamingResponse(
-        _agentic_sse_generator(messages, req.max_new_tokens, req.temperature, enable_thinking=req.enable_thinking),
-        media_type="text/event-stream",
-        headers=SSE_HEADERS,
+        trace = start_trace("chat.agent", model=req.model, stream=False)
+        activate(trace)
+        try:
+            async with await _acquire_slot(LANE_BULK, trace):
+                result = ""
+                async for event in agentic_stream(
+                    messages, req.max_new_tokens, req.temperature,
+                    enable_thinking=req.enable_thinking, model_id=req.model,
+                ):
+                    parsed = json.loads(event)
+                    if "token" in parsed:
+                        result += parsed["token"]
+        finally:
+            _end_trace(trace)
+        return ChatResponse(content=result, timings=trace.to_dict() if req.timings else None)
+
+    trace = start_trace("chat.agent", model=req.model, stream=True)
+    ticket = await _acquire_slot(LANE_INTERACTIVE, trace)
+    return _SSEResponse(
+        _agentic_sse_generator(
+            ticket, messages, req.max_new_tokens, req.temperature,
+            enable_thinking=req.enable_thinking, model_id=req.model,
+            trace=trace, timings=req.timings,
+        ),
+        ticket,
+        trace,
     )
 
 
 @router.post("", response_model=ChatResponse)
 async def chat(req: ChatRequest):
     """Non-streaming chat - returns full response at once."""
-    if not is_model_loaded():
-        raise HTTPException(status_code=503, detail="No model loaded.")
+    await _ensure_model(req.model)
 
     messages = [m.model_dump() for m in req.messages]
-    content = await generate(messages, req.max_new_tokens, req.temperature)
-    return ChatResponse(content=content)
+    trace = start_trace("chat", model=req.model)
+    activate(trace)
+    try:
+        async with await _acquire_slot(LANE_BULK, trace):
+            content = await generate(messages, req.max_new_tokens, req.temperature, model_id=req.model)
+    finally:
+        _end_trace(trace)
+    return ChatResponse(content=content, timings=trace.to_dict() if req.timings else None)
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from services.tracing import trace_buffer
+
+router = APIRouter(prefix="/debug", tags=["debug"])
+
+
+@router.get("/traces")
+async def recent_traces(limit: int = Query(20, ge=1, le=1000)):
+    """The most recent request traces, newest first."""
+    return {"traces": trace_buffer.recent(limit)}
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    trace = trace_buffer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found (it may have been evicted).")
+    return trace
+
+
+@router.delete("/traces")
+async def clear_traces():
+    trace_buffer.clear()
+    return {"traces": []}
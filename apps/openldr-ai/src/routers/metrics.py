@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from services.metrics import CONTENT_TYPE, render
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(content=render(), media_type=CONTENT_TYPE)
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from pathlib import Path
 
 from models.schemas import (
@@ -6,14 +7,20 @@ from models.schemas import (
     ModelDownloadStatus,
     AvailableModel,
     LoadModelRequest,
+    TuneModelRequest,
 )
 from services.model_manager import (
     start_download,
     is_model_downloaded,
     get_model_size_gb,
     load_model,
+    start_tune,
+    get_tune_report,
+    delete_tune_profile,
 )
-from core.state import download_state, loaded_model
+from core.state import download_state, tune_state
+from services.model_pool import model_pool
+from services.model_tuner import TuneGrid
 from core.config import settings
 
 router = APIRouter(prefix="/models", tags=["models"])
@@ -50,7 +57,7 @@ async def get_download_status(model_id: str):
             model_id=model_id,
             status="ready",
             progress=100.0,
-            loaded=loaded_model.get("model_id") == model_id,
+            loaded=model_pool.is_resident(model_id),
         )
 
     state = download_state.get(model_id)
@@ -64,7 +71,7 @@ async def get_download_status(model_id: str):
         downloaded_gb=state["downloaded_gb"],
         total_gb=state["total_gb"],
         error=state["error"],
-        loaded=loaded_model.get("model_id") == model_id,
+        loaded=model_pool.is_resident(model_id),
     )
 
 
@@ -88,7 +95,7 @@ async def list_models():
             AvailableModel(
                 model_id=model_id,
                 size_gb=size_gb,
-                loaded=loaded_model.get("model_id") == model_id,
+                loaded=model_pool.is_resident(model_id),
             )
         )
 
@@ -98,19 +105,85 @@ async def list_models():
 @router.post("/load")
 async def load_model_endpoint(req: LoadModelRequest):
     """
-    Loads a downloaded model into memory for inference.
-    This can take 10-60s depending on model size.
+    Loads a downloaded model into memory for inference, optionally with
+    speculative decoding (prompt lookup, or a smaller draft model).
+    This can take 10-60s depending on model size, so it runs in a worker
+    thread to keep /health and in-flight streams responsive.
     """
-    kwargs = {"filename": req.filename} if req.filename else {}
-    success, error = load_model(req.model_id, **kwargs)
+    kwargs = {
+        key: value
+        for key, value in (
+            ("filename", req.filename),
+            ("speculative", req.speculative),
+            ("draft_model", req.draft_model),
+        )
+        if value
+    }
+    success, error = await run_in_threadpool(load_model, req.model_id, **kwargs)
     if not success:
         raise HTTPException(status_code=400, detail=error)
     return {"message": f"Model {req.model_id} loaded successfully"}
 
 
+@router.post("/tune", status_code=202)
+async def tune_model_endpoint(req: TuneModelRequest):
+    """
+    Starts a background benchmark of llama.cpp settings for a downloaded
+    model. The fastest configuration is saved next to the GGUF and used by
+    every later /models/load; a model that is already loaded keeps its
+    settings until it is reloaded.
+    Poll /models/tune/{model_id} for progress and the per-configuration report.
+    """
+    grid = TuneGrid(prompt_tokens=req.prompt_tokens, decode_tokens=req.decode_tokens)
+    for name in ("n_threads", "n_batch", "n_ctx", "use_mmap", "use_mlock", "flash_attn", "kv_cache_type"):
+        values = getattr(req, name)
+        if values is not None:
+            setattr(grid, name, values)
+    if any(v <= 0 for v in [*grid.n_threads, *grid.n_batch]) or any(v < 256 for v in grid.n_ctx):
+        raise HTTPException(status_code=400, detail="n_threads and n_batch must be positive and n_ctx at least 256")
+    if not grid.profiles():
+        raise HTTPException(status_code=400, detail="The grid has no valid configuration")
+
+    started, error = start_tune(req.model_id, req.filename, grid)
+    if not started:
+        raise HTTPException(status_code=409 if error and "running" in error else 400, detail=error)
+    return {"message": "Tuning started", "model_id": req.model_id, "configurations": len(grid.profiles())}
+
+
+@router.get("/tune/{model_id:path}")
+async def get_tune_status(model_id: str):
+    """
+    Progress of the current or last tuning job for a model, or the saved
+    report if it was tuned before this process started.
+    """
+    state = tune_state.get(model_id)
+    if state is not None:
+        return {"model_id": model_id, **state}
+
+    report = get_tune_report(model_id)
+    if report is None:
+        return {"model_id": model_id, "status": "idle"}
+    return {"status": "ready", **report}
+
+
+@router.delete("/tune/{model_id:path}")
+async def delete_tune_profile_endpoint(model_id: str):
+    """Forget a model's tuned settings; the next /models/load uses the defaults."""
+    if not delete_tune_profile(model_id):
+        raise HTTPException(status_code=404, detail="No tuning profile for this model")
+    return {"message": f"Tuning profile for {model_id} removed"}
+
+
 @router.get("/loaded")
 async def get_loaded_model():
-    """Returns info about the currently loaded model."""
-    if not loaded_model.get("model_id"):
-        return {"loaded": False, "model_id": None}
-    return {"loaded": True, "model_id": loaded_model["model_id"]}
+    """
+    Returns the default model plus every model resident in the pool, with
+    their memory use (weights + KV cache) against AI_MODEL_POOL_MAX_MB.
+    """
+    pool = model_pool.snapshot()
+    default_id = pool["default_model_id"]
+    return {
+        "loaded": default_id is not None,
+        "model_id": default_id,
+        **pool,
+    }
@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+
+from services.mcp_client import tool_catalogue
+from services.semantic_router import semantic_router
+from services.tool_result_cache import tool_result_cache
+
+router = APIRouter(prefix="/tools", tags=["tools"])
+
+
+@router.get("")
+async def list_tools():
+    """Returns the cached MCP tool catalogue and its freshness."""
+    return {
+        **tool_catalogue.status(),
+        "tools": [t.get("name") for t in tool_catalogue.snapshot.tools],
+        "semantic_router": semantic_router.status(),
+    }
+
+
+@router.post("/refresh")
+async def refresh_tool_catalogue():
+    """Re-fetches tools/list from the MCP server right away."""
+    await tool_catalogue.refresh()
+    return tool_catalogue.status()
+
+
+@router.get("/cache")
+async def tool_cache_stats():
+    """Hit/miss counters and size of the tool result cache."""
+    return tool_result_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_tool_cache():
+    """Drops every cached tool result."""
+    tool_result_cache.clear()
+    return tool_result_cache.stats()
@@ -7,28 +7,50 @@ Two-path design:
 2. Model-driven fallback — if the selector isn't confident, the LLM
    generates a tool call (or plain answer) in the normal agentic loop.
 
-First generation pass is always buffered (never streamed token-by-token)
-so code-fence leakage and tool-call syntax are stripped before the client
-sees anything.  The final answer pass streams token-by-token for real-time
-feel.
+Every model-driven pass is streamed through a ToolCallDetector: a plain
+answer reaches the client token by token, while tool-call syntax (tags,
+code fences, bare JSON) is held back and generation stops as soon as the
+call's JSON object closes. Answers lose <think> blocks and an outer code
+fence on the way, as strip_tool_call does for a whole output.
 """
 import asyncio
 import json
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, Optional
 
 from core.config import settings
-from core.state import loaded_model
-from services.mcp_client import fetch_tools, execute_tool, format_tools_for_prompt
+from services.answer_cache import answer_cache, digest_turns
+from services.inference import (
+    get_loaded_model_id,
+    is_model_loaded,
+    stream_chat_tokens,
+    token_counter,
+    tokens_left,
+)
+from services.mcp_client import (
+    execute_tool,
+    execute_tool_cached,
+    fetch_tools,
+    format_tools_for_prompt,
+    tool_catalogue,
+)
+from services.metrics import record_routing
 from services.result_compactor import compact_tool_result
+from services.semantic_router import semantic_router
 from services.tool_prompt import (
     build_system_prompt,
     extract_tool_call,
     format_tool_result,
-    strip_tool_call,
     strip_thinking,
     FINAL_ANSWER_SYSTEM_PROMPT,
+    TOOL_CALL_CLOSE,
+    TOOL_CALL_OPEN,
+    ToolCallDetector,
 )
+from services.tool_grammar import tool_call_grammar
+from services.tool_result import CompactView, ToolResult, estimate_tokens
 from services.tool_router import select_tool_for_query
+from services.tracing import span
 
 
 # ── helpers ────────────────────────────────────────────────────────────────────
@@ -40,6 +62,34 @@ def _latest_user_message(messages: list[dict]) -> str:
     return ""
 
 
+def _find_tool(tools: list[dict], name: str) -> dict | None:
+    return next((t for t in tools if t.get("name") == name), None)
+
+
+def _compact_for_prompt(
+    result: ToolResult,
+    context: list[dict],
+    max_new_tokens: int,
+    model_id: Optional[str],
+    question: str,
+) -> CompactView:
+    """
+    Compact a tool result into the tokens left once `context` and the
+    result template are in; summarised if the question asks for counts or trends.
+    """
+    template = {"role": "user", "content": format_tool_result(result, CompactView("", 0))}
+    budget = tokens_left([*context, template], max_new_tokens, model_id)
+    return compact_tool_result(result, budget, token_counter(model_id), question)
+
+
+def _hit_token_limit(tokens: list[str], max_new_tokens: int, model_id: Optional[str]) -> bool:
+    """Whether a streamed answer most likely stopped at max_new_tokens instead of ending."""
+    if len(tokens) >= max_new_tokens:
+        return True
+    count = token_counter(model_id) or estimate_tokens
+    return count("".join(tokens)) >= max_new_tokens
+
+
 THINKING_INSTRUCTION = (
     "\n\n## IMPORTANT: Thinking mode is ON\n"
     "You MUST start your response with a <think> block. "
@@ -72,45 +122,32 @@ def _inject_thinking_control(messages: list[dict], enable_thinking: bool) -> lis
     return [{"role": "system", "content": THINKING_INSTRUCTION.strip()}, *messages]
 
 
-def _generate_buffered(
-    llm, messages: list[dict], max_tokens: int, temperature: float,
-    enable_thinking: bool = False,
-) -> str:
-    """Non-streaming generation — returns the full text at once."""
-    response = llm.create_chat_completion(
-        messages=_inject_thinking_control(messages, enable_thinking),
-        max_tokens=max_tokens,
-        temperature=temperature,
-        stream=False,
-    )
-    return response.get("choices", [{}])[0].get("message", {}).get("content", "")
-
-
 async def _stream_final_answer(
     messages: list[dict],
     max_new_tokens: int,
     temperature: float,
     enable_thinking: bool = False,
+    model_id: Optional[str] = None,
+    collect: Optional[list[str]] = None,
 ) -> AsyncGenerator[str, None]:
-    """Stream the final answer token-by-token (no tool call expected)."""
-    llm = loaded_model.get("model")
-    if not llm:
+    """
+    Stream the final answer token-by-token (no tool call expected). The
+    tokens are also appended to `collect`, if given.
+    """
+    if not is_model_loaded(model_id):
         yield json.dumps({"error": "No model loaded"})
         return
 
-    response = llm.create_chat_completion(
-        messages=_inject_thinking_control(messages, enable_thinking),
-        max_tokens=max_new_tokens,
-        temperature=temperature,
-        stream=True,
-    )
-
-    for chunk in response:
-        delta = chunk.get("choices", [{}])[0].get("delta", {})
-        token = delta.get("content")
-        if token:
-            yield json.dumps({"token": token})
-            await asyncio.sleep(0)  # flush to event loop so SSE sends immediately
+    async for token in stream_chat_tokens(
+        _inject_thinking_control(messages, enable_thinking),
+        max_new_tokens,
+        temperature,
+        model_id=model_id,
+    ):
+        if collect is not None:
+            collect.append(token)
+        yield json.dumps({"token": token})
+        await asyncio.sleep(0)  # flush to event loop so SSE sends immediately
 
 
 # ── main entry point ───────────────────────────────────────────────────────────
@@ -121,9 +158,11 @@ async def agentic_stream(
     temperature: float = 0.7,
     max_tool_calls: int = 3,
     enable_thinking: bool = False,
+    model_id: Optional[str] = None,
 ) -> AsyncGenerator[str, None]:
     """
-    Main agentic streaming generator.
+    Main agentic streaming generator. `model_id` picks a resident model;
+    None uses the pool's default.
 
     Yields SSE-compatible JSON events:
       {"token": "..."}                          — response text
@@ -133,16 +172,26 @@ async def agentic_stream(
     """
     max_new_tokens = max(max_new_tokens, 512)
 
-    llm = loaded_model.get("model")
-    if not llm:
+    if not is_model_loaded(model_id):
         yield json.dumps({"error": "No model loaded"})
         return
 
     tools = await fetch_tools()
 
     # ── Path 1: deterministic routing ─────────────────────────────────────────
-    selection = select_tool_for_query(_latest_user_message(messages), tools)
-    if selection.should_call_tool and selection.tool_name:
+    with span("route") as attrs:
+        user_text = _latest_user_message(messages)
+        semantic = await semantic_router.scores(user_text, tools)
+        selection = select_tool_for_query(user_text, tools, semantic)
+        deterministic = bool(selection.should_call_tool and selection.tool_name)
+        attrs.update(
+            route="deterministic" if deterministic else "model",
+            tool=selection.tool_name,
+            confidence=selection.confidence,
+            semantic_matches=len(semantic),
+        )
+    if deterministic:
+        record_routing("deterministic", selection.confidence)
         yield json.dumps({
             "status": f"Querying {selection.tool_name}...",
             "tool_call": {"tool": selection.tool_name, "args": selection.args or {}},
@@ -153,8 +202,16 @@ async def agentic_stream(
             },
         })
 
-        raw_result = await execute_tool(selection.tool_name, selection.args or {})
-        compact_result = compact_tool_result(selection.tool_name, raw_result)
+        result, from_cache = await execute_tool_cached(
+            selection.tool_name,
+            selection.args or {},
+            tool=_find_tool(tools, selection.tool_name),
+        )
+        answer_context = _inject_thinking_control(
+            [{"role": "system", "content": FINAL_ANSWER_SYSTEM_PROMPT}, *messages[-4:]],
+            enable_thinking,
+        )
+        view = _compact_for_prompt(result, answer_context, max_new_tokens, model_id, user_text)
 
         # Send reasoning data so frontend can show what the system "thought"
         if enable_thinking:
@@ -162,61 +219,102 @@ async def agentic_stream(
                 "reasoning": (
                     f"Tool: {selection.tool_name}\n"
                     f"Route: {selection.reason} (confidence: {selection.confidence})\n"
-                    f"Args: {json.dumps(selection.args or {})}\n\n"
-                    f"Raw result:\n{compact_result[:1500]}"
+                    f"Args: {json.dumps(selection.args or {})}\n"
+                    f"Source: {'cache' if from_cache else 'live'}\n\n"
+                    f"Raw result:\n{view.text[:1500]}"
                 ),
             })
 
+        # The same question over the same data, after the same turns, gets the
+        # same answer: replay it
+        recent = messages[-4:]
+        earlier = recent[:-1] if recent and recent[-1].get("role") == "user" else recent
+        answer_key = None
+        if answer_cache.enabled and result.ok:
+            answer_key = answer_cache.key(
+                model_id or get_loaded_model_id() or "",
+                user_text,
+                selection.tool_name,
+                selection.args,
+                result,
+                context=digest_turns(earlier),
+                budget=view.budget_tokens,
+                thinking=enable_thinking,
+                max_new_tokens=max_new_tokens,
+            )
+        with span("answer_cache") as attrs:
+            cached_answer = answer_cache.get(answer_key) if answer_key else None
+            attrs["hit"] = cached_answer is not None
+        if cached_answer is not None:
+            for token in cached_answer:
+                yield json.dumps({"token": token})
+                await asyncio.sleep(0)
+            yield json.dumps({"done": True})
+            return
+
         answer_messages = [
             {"role": "system", "content": FINAL_ANSWER_SYSTEM_PROMPT},
-            *messages[-4:],
-            {"role": "user", "content": format_tool_result(selection.tool_name, compact_result)},
+            *recent,
+            {"role": "user", "content": format_tool_result(result, view)},
         ]
-        async for event in _stream_final_answer(answer_messages, max_new_tokens, 0.2, enable_thinking=enable_thinking):
+        answer: list[str] = []
+        async for event in _stream_final_answer(
+            answer_messages, max_new_tokens, 0.2, enable_thinking=enable_thinking, model_id=model_id,
+            collect=answer,
+        ):
             yield event
 
+        # Only an answer that streamed to the end gets here (a disconnect stops at the yield)
+        if answer_key and not _hit_token_limit(answer, max_new_tokens, model_id):
+            answer_cache.put(answer_key, answer)
         yield json.dumps({"done": True})
         return
 
     # ── Path 2: model-driven fallback ──────────────────────────────────────────
+    record_routing("model", selection.confidence)
     tools_text = format_tools_for_prompt(tools)
     system_prompt = build_system_prompt(tools_text)
     full_messages = [{"role": "system", "content": system_prompt}, *messages]
 
+    # Either a plain answer or one schema-valid <tool_call>, nothing else
+    with span("tool_grammar"):
+        grammar = (
+            tool_call_grammar(tools, tool_catalogue.snapshot.version)
+            if settings.AI_CONSTRAINED_TOOL_CALLS
+            else None
+        )
+    grammar_kwargs = {"grammar": grammar} if grammar is not None else {}
+
     tool_calls_made = 0
     max_calls = min(max_tool_calls, settings.AI_MAX_TOOL_CALLS)
 
     while tool_calls_made <= max_calls:
-        is_first_pass = tool_calls_made == 0
-
-        if is_first_pass:
-            # Buffer first pass to detect tool calls before streaming
-            full_output = _generate_buffered(llm, full_messages, max_new_tokens, temperature, enable_thinking=enable_thinking)
-        else:
-            # Final answer pass — stream token-by-token and collect for tool-call check
-            collected = []
-            response = llm.create_chat_completion(
-                messages=_inject_thinking_control(full_messages, enable_thinking),
-                max_tokens=max_new_tokens,
-                temperature=temperature,
-                stream=True,
-            )
-            for chunk in response:
-                delta = chunk.get("choices", [{}])[0].get("delta", {})
-                token = delta.get("content")
-                if token:
-                    collected.append(token)
-                    yield json.dumps({"token": token})
+        # Stream the pass; the detector decides within the first few tokens
+        # whether this is an answer (released as it comes) or a tool call (held)
+        detector = ToolCallDetector()
+        async with aclosing(stream_chat_tokens(
+            _inject_thinking_control(full_messages, enable_thinking),
+            max_new_tokens,
+            temperature,
+            model_id=model_id,
+            stop=[TOOL_CALL_CLOSE],
+            **grammar_kwargs,
+        )) as tokens:
+            async for token in tokens:
+                text = detector.feed(token)
+                if text:
+                    yield json.dumps({"token": text})
                     await asyncio.sleep(0)
-            full_output = "".join(collected)
+                if detector.complete:
+                    # The call's JSON has closed - nothing after it is needed
+                    break
 
         # ── No tool call ───────────────────────────────────────────────────────
-        parsed = extract_tool_call(full_output)
+        parsed = extract_tool_call(detector.tool_call_text) if detector.is_tool_call else None
         if not parsed:
-            if is_first_pass:
-                remaining = strip_tool_call(full_output)
-                if remaining:
-                    yield json.dumps({"token": remaining})
+            remaining = detector.finish()
+            if remaining:
+                yield json.dumps({"token": remaining})
             break
 
         # ── Tool call detected ─────────────────────────────────────────────────
@@ -229,8 +327,18 @@ async def agentic_stream(
             "routing": {"mode": "model", "reason": "Fallback to model-generated tool call."},
         })
 
-        raw_tool_result = await execute_tool(tool_name, tool_args)
-        compact_result = compact_tool_result(tool_name, raw_tool_result)
+        result = await execute_tool(tool_name, tool_args)
+
+        # Record the call in the prompted format, whatever form the model used
+        call_json = json.dumps({"tool": tool_name, "args": tool_args})
+        full_messages.append({
+            "role": "assistant",
+            "content": f"{detector.text_before_call}{TOOL_CALL_OPEN}\n{call_json}\n{TOOL_CALL_CLOSE}",
+        })
+        view = _compact_for_prompt(
+            result, _inject_thinking_control(full_messages, enable_thinking), max_new_tokens, model_id,
+            user_text,
+        )
 
         if enable_thinking:
             yield json.dumps({
@@ -238,14 +346,13 @@ async def agentic_stream(
                     f"Tool: {tool_name}\n"
                     f"Route: model-generated tool call\n"
                     f"Args: {json.dumps(tool_args)}\n\n"
-                    f"Raw result:\n{compact_result[:1500]}"
+                    f"Raw result:\n{view.text[:1500]}"
                 ),
             })
 
-        full_messages.append({"role": "assistant", "content": full_output})
         full_messages.append({
             "role": "user",
-            "content": format_tool_result(tool_name, compact_result),
+            "content": format_tool_result(result, view),
         })
 
     yield json.dumps({"done": True})
@@ -0,0 +1,194 @@
+"""
+Whole-answer cache for the deterministic routing path.
+
+A deterministic-route answer is generated at a low temperature from
+FINAL_ANSWER_SYSTEM_PROMPT and one tool result. The same question over the
+same data gives the same answer, yet it used to be decoded from scratch
+each time. Finished answers are kept here as their token stream and
+replayed through the normal SSE path on a hit.
+
+The key covers everything that shapes the answer:
+- the model id
+- the normalised question (case, spacing and trailing punctuation ignored)
+- a hash of the earlier conversation turns the answer prompt includes
+- the tool name and canonical args
+- a hash of the tool result, and the token budget it was compacted to
+- the generation settings that change the output (thinking mode, token limit)
+New data therefore means a new key, and the TTL only bounds how long an
+unused answer is kept. An answer that stopped at the token limit is not
+stored, so a cut-off answer is never replayed.
+
+Entries are evicted least-recently-used once AI_ANSWER_CACHE_MAX_MB is
+reached. With AI_ANSWER_CACHE_PERSIST the cache is written to
+AI_MODELS_DIR/answer_cache.json on shutdown and read back on startup.
+Expiry uses wall-clock time so it holds across restarts.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional
+
+from core.config import settings
+from services.tool_result import ToolResult
+from services.tool_result_cache import canonical_args
+
+CACHE_FILENAME = "answer_cache.json"
+FILE_VERSION = 1
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+@dataclass
+class _Entry:
+    tokens: list[str]
+    size: int
+    expires_at: float  # time.time()
+
+
+def normalise_question(question: str) -> str:
+    return _SPACE_RE.sub(" ", question).strip().rstrip("?!. ").lower()
+
+
+def digest_turns(turns: list[dict]) -> str:
+    """Hash of conversation turns (role and content), for keys that depend on the context."""
+    text = json.dumps([[turn.get("role"), turn.get("content")] for turn in turns], ensure_ascii=False)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, max_bytes: int, ttl: float, path: Optional[Path] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evictions": 0, "expired": 0, "loaded": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def key(
+        model_id: str,
+        question: str,
+        tool_name: str,
+        args: dict[str, Any] | None,
+        result: ToolResult,
+        **variant: Any,
+    ) -> str:
+        """Cache key for an answer; `variant` holds the generation settings that change it."""
+        parts = [
+            model_id,
+            normalise_question(question),
+            tool_name,
+            canonical_args(args),
+            result.digest(),
+            json.dumps(variant, sort_keys=True),
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[list[str]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at <= time.time():
+            self._remove(key)
+            self._stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry.tokens
+
+    def put(self, key: str, tokens: list[str]) -> None:
+        if not tokens:
+            return
+        self._store(key, tokens, time.time() + self.ttl)
+        self._stats["stored"] += 1
+
+    def _store(self, key: str, tokens: list[str], expires_at: float) -> None:
+        size = sum(len(t.encode("utf-8")) for t in tokens)
+        # One huge answer shouldn't wipe out everything else
+        if size > self.max_bytes // 4:
+            return
+        self._remove(key)
+        self._entries[key] = _Entry(tokens, size, expires_at)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry.size
+
+    # ── persistence ───────────────────────────────────────────────────────────
+
+    def load(self) -> None:
+        """Read the saved cache, skipping expired entries (blocking; call at startup)."""
+        if self.path is None or not self.enabled or not self.path.exists():
+            return
+        try:
+            saved = json.loads(self.path.read_text())
+            if saved.get("version") != FILE_VERSION:
+                return
+            now = time.time()
+            for item in saved.get("entries", []):
+                if item["expires_at"] > now:
+                    self._store(item["key"], item["tokens"], item["expires_at"])
+                    self._stats["loaded"] += 1
+        except Exception as e:
+            print(f"[answer-cache] Ignoring unreadable {self.path.name}: {e}")
+            return
+        print(f"[answer-cache] Loaded {self._stats['loaded']} answers from {self.path.name}")
+
+    def save(self) -> None:
+        """Write the live entries, least recently used first (blocking; call at shutdown)."""
+        if self.path is None or not self.enabled:
+            return
+        now = time.time()
+        entries = [
+            {"key": key, "tokens": entry.tokens, "expires_at": entry.expires_at}
+            for key, entry in self._entries.items()
+            if entry.expires_at > now
+        ]
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp.write_text(json.dumps({"version": FILE_VERSION, "entries": entries}))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[answer-cache] Failed to save {self.path.name}: {e}")
+            return
+        print(f"[answer-cache] Saved {len(entries)} answers to {self.path.name}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        if self.path is not None and self.path.exists():
+            self.path.unlink()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "persisted": self.path is not None,
+        }
+
+
+answer_cache = AnswerCache(
+    max_bytes=settings.AI_ANSWER_CACHE_MAX_MB * 1024 * 1024,
+    ttl=settings.AI_ANSWER_CACHE_TTL_SECONDS,
+    path=Path(settings.AI_MODELS_DIR) / CACHE_FILENAME if settings.AI_ANSWER_CACHE_PERSIST else None,
+)
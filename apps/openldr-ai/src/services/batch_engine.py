@@ -0,0 +1,512 @@
+"""
+Continuous batching engine (AI_INFERENCE_BACKEND=batch).
+
+One llama context is shared by up to AI_BATCH_MAX_SEQUENCES concurrent chat
+sequences, each with its own sequence id. A single engine thread builds one
+llama_batch per step containing the next token of every decoding sequence
+plus prompt chunks of newly admitted ones, runs llama_decode once, and
+samples each sequence from its own logits row. Requests join at the next
+token boundary and leave as soon as they finish, so a long answer never
+holds up a short one.
+
+A finished sequence keeps its tokens in the KV cache until the slot is
+reused; new requests go to the free slot sharing the longest prefix, so a
+repeated system prompt is only evaluated once per slot.
+
+A streaming sequence runs at most AI_INFERENCE_QUEUE_SIZE chunks ahead of its
+client. One whose client has stopped reading sits out the following steps,
+keeping its slot and KV cache, while the rest of the batch carries on; it
+rejoins once the client has drained its queue.
+
+Exposes the same complete()/stream_tokens() interface as InferenceExecutor.
+"""
+import asyncio
+import codecs
+import os
+import queue
+import threading
+import time
+from typing import Any, AsyncGenerator, Optional
+
+from core.config import settings
+from services.chat_template import ChatTemplate, ModelHandle
+
+_DEFAULT_SEED = 0xFFFFFFFF
+_PENALTY_LAST_N = 64
+# How long the engine thread sleeps when every active sequence is held back
+# by its client, before looking again without being woken
+_STALLED_POLL_S = 0.1
+# Put on the incoming queue to wake the engine thread without a new request
+_WAKE = object()
+
+# create_chat_completion arguments the engine understands
+_SUPPORTED_KWARGS = {
+    "max_tokens", "temperature", "top_p", "top_k", "min_p", "stop", "seed",
+    "repeat_penalty", "presence_penalty", "frequency_penalty", "grammar",
+}
+
+
+class _Sequence:
+    """One request moving through the engine."""
+
+    def __init__(self, prompt: list[int], params: dict, loop: asyncio.AbstractEventLoop, stream: bool):
+        self.prompt = prompt
+        self.params = params
+        self.loop = loop
+        self.stream = stream
+        self.out: asyncio.Queue = asyncio.Queue()
+        # Chunks pushed by the engine thread and taken by the client; each
+        # counter has a single writer, so their difference needs no lock
+        self.queue_size = max(1, settings.AI_INFERENCE_QUEUE_SIZE)
+        self.pushed = 0
+        self.taken = 0
+        self.max_tokens = params.get("max_tokens") or 512
+        stop = params.get("stop") or []
+        self.stops = [stop] if isinstance(stop, str) else list(stop)
+        self.cancelled = False
+
+        self.slot: Optional["_Slot"] = None
+        self.sampler: Any = None
+        self.n_prefilled = 0
+        self.last_token: Optional[int] = None
+        self.completion_tokens = 0
+        self.text = ""
+        self.emitted = 0
+        self.finish_reason: Optional[str] = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        self.submitted_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def push(self, kind: str, payload: Any = None) -> None:
+        # Called from the engine thread
+        self.pushed += 1
+        self.loop.call_soon_threadsafe(self.out.put_nowait, (kind, payload))
+
+    @property
+    def backed_up(self) -> bool:
+        """True while the client is AI_INFERENCE_QUEUE_SIZE chunks behind."""
+        return self.pushed - self.taken >= self.queue_size
+
+    def add_piece(self, piece: bytes) -> bool:
+        """Append decoded text, emit what is safe to emit; True if a stop string hit."""
+        self.text += self._decoder.decode(piece)
+        for stop in self.stops:
+            index = self.text.find(stop, max(0, self.emitted - len(stop)))
+            if index != -1:
+                self.text = self.text[:index]
+                self._emit(len(self.text))
+                return True
+        # Hold back a tail that could still turn into a stop string
+        held = 0
+        for stop in self.stops:
+            for n in range(min(len(stop) - 1, len(self.text)), 0, -1):
+                if self.text.endswith(stop[:n]):
+                    held = max(held, n)
+                    break
+        self._emit(len(self.text) - held)
+        return False
+
+    def flush(self) -> None:
+        self.text += self._decoder.decode(b"", final=True)
+        self._emit(len(self.text))
+
+    def _emit(self, upto: int) -> None:
+        if upto <= self.emitted:
+            return
+        chunk = self.text[self.emitted:upto]
+        self.emitted = upto
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        if self.stream:
+            self.push("token", chunk)
+
+
+class _Slot:
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        # Tokens currently held in the KV cache for this sequence id
+        self.tokens: list[int] = []
+        self.sequence: Optional[_Sequence] = None
+
+
+class BatchEngine:
+    def __init__(
+        self,
+        model_path: str,
+        n_ctx_per_sequence: int,
+        n_sequences: int,
+        n_threads: Optional[int] = None,
+        n_batch: int = 512,
+        name: str = "llama",
+        use_mmap: bool = True,
+        use_mlock: bool = False,
+        flash_attn: Optional[bool] = None,
+        type_k: Optional[int] = None,
+        type_v: Optional[int] = None,
+    ):
+        from llama_cpp import llama_cpp
+        from llama_cpp._internals import LlamaBatch, LlamaContext, LlamaModel
+        from llama_cpp._logger import set_verbose
+
+        set_verbose(False)
+        self._llama_cpp = llama_cpp
+        # Each decoding sequence adds one token per step, so the batch bounds them
+        self.n_sequences = max(1, min(n_sequences, n_batch))
+        self.n_ctx_per_sequence = n_ctx_per_sequence
+        self.n_batch = n_batch
+
+        model_params = llama_cpp.llama_model_default_params()
+        model_params.n_gpu_layers = 0
+        model_params.use_mmap = use_mmap
+        model_params.use_mlock = use_mlock
+        self._model = LlamaModel(path_model=model_path, params=model_params, verbose=False)
+
+        threads = n_threads or os.cpu_count() or 4
+        ctx_params = llama_cpp.llama_context_default_params()
+        ctx_params.n_ctx = n_ctx_per_sequence * self.n_sequences
+        ctx_params.n_batch = n_batch
+        ctx_params.n_ubatch = n_batch
+        ctx_params.n_seq_max = self.n_sequences
+        ctx_params.kv_unified = True
+        ctx_params.n_threads = threads
+        ctx_params.n_threads_batch = threads
+        if flash_attn is not None:
+            ctx_params.flash_attn_type = (
+                llama_cpp.LLAMA_FLASH_ATTN_TYPE_ENABLED if flash_attn else llama_cpp.LLAMA_FLASH_ATTN_TYPE_DISABLED
+            )
+        if type_k is not None:
+            ctx_params.type_k = type_k
+        if type_v is not None:
+            ctx_params.type_v = type_v
+        self._ctx = LlamaContext(model=self._model, params=ctx_params, verbose=False)
+        self._batch = LlamaBatch(n_tokens=n_batch, embd=0, n_seq_max=1, verbose=False)
+
+        self.template = ChatTemplate(ModelHandle(self._model))
+        if not self.template.available:
+            self.close()
+            raise RuntimeError("The batch backend needs a GGUF chat template (tokenizer.chat_template)")
+
+        self._slots = [_Slot(i) for i in range(self.n_sequences)]
+        self._incoming: queue.Queue = queue.Queue()
+        self._waiting: list[_Sequence] = []
+        self._closed = False
+        self._stats = {
+            "requests": 0, "prompt_tokens": 0, "reused_prompt_tokens": 0,
+            "completion_tokens": 0, "steps": 0, "batched_tokens": 0,
+        }
+        self._busy_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name=f"batch-{name}", daemon=True)
+        self._thread.start()
+
+    # ── request side (event loop) ─────────────────────────────────────────────
+
+    def _submit(self, messages: list[dict], stream: bool, kwargs: dict) -> _Sequence:
+        unsupported = set(kwargs) - _SUPPORTED_KWARGS
+        if unsupported:
+            raise ValueError(f"Not supported by the batch engine: {', '.join(sorted(unsupported))}")
+        if self._closed:
+            raise RuntimeError("Batch engine is shut down")
+
+        prompt_text = self.template.render(messages, add_generation_prompt=True)
+        if prompt_text is None:
+            raise RuntimeError("Chat template could not render these messages")
+        prompt = self.template.tokenize(prompt_text)
+        if len(prompt) >= self.n_ctx_per_sequence:
+            raise RuntimeError(
+                f"Prompt is {len(prompt)} tokens, the per-sequence context is {self.n_ctx_per_sequence}"
+            )
+
+        sequence = _Sequence(prompt, kwargs, asyncio.get_running_loop(), stream)
+        self._incoming.put(sequence)
+        return sequence
+
+    async def complete(self, messages: list[dict], namespace: str = "", **kwargs: Any) -> dict:
+        sequence = self._submit(messages, False, kwargs)
+        try:
+            kind, payload = await sequence.out.get()
+        finally:
+            sequence.cancelled = True
+        if kind == "error":
+            raise RuntimeError(payload)
+        return {
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": sequence.text},
+                "finish_reason": sequence.finish_reason,
+            }],
+            "usage": {
+                "prompt_tokens": len(sequence.prompt),
+                "completion_tokens": sequence.completion_tokens,
+                "total_tokens": len(sequence.prompt) + sequence.completion_tokens,
+            },
+        }
+
+    async def stream_tokens(
+        self, messages: list[dict], namespace: str = "", **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        sequence = self._submit(messages, True, kwargs)
+        try:
+            while True:
+                kind, payload = await sequence.out.get()
+                resumes = sequence.backed_up
+                sequence.taken += 1
+                if resumes:
+                    # The engine skipped this sequence; let it decode again
+                    self._incoming.put(_WAKE)
+                if kind == "token":
+                    yield payload
+                elif kind == "error":
+                    raise RuntimeError(payload)
+                else:
+                    return
+        finally:
+            # No-op if already finished; otherwise frees the slot at the next step
+            sequence.cancelled = True
+            if sequence.backed_up:
+                self._incoming.put(_WAKE)
+
+    # ── engine thread ─────────────────────────────────────────────────────────
+
+    def _run(self) -> None:
+        while not self._closed:
+            active = [s.sequence for s in self._slots if s.sequence is not None]
+            if not active and not self._waiting:
+                item = self._incoming.get()
+                if item is None:
+                    break
+                if item is not _WAKE:
+                    self._waiting.append(item)
+            self._drain_incoming()
+            self._admit()
+            if any(s.sequence is not None for s in self._slots):
+                started = time.monotonic()
+                decoded = self._step()
+                self._busy_seconds += time.monotonic() - started
+                if not decoded:
+                    self._wait_for_clients()
+
+        for slot in self._slots:
+            if slot.sequence is not None:
+                self._finish(slot, "error", "Batch engine shut down")
+        for sequence in self._waiting:
+            sequence.push("error", "Batch engine shut down")
+
+    def _drain_incoming(self) -> None:
+        while True:
+            try:
+                item = self._incoming.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                self._closed = True
+                return
+            if item is not _WAKE:
+                self._waiting.append(item)
+
+    def _wait_for_clients(self) -> None:
+        """Every active sequence is held back: sleep until a client reads, leaves or a request arrives."""
+        try:
+            item = self._incoming.get(timeout=_STALLED_POLL_S)
+        except queue.Empty:
+            return
+        if item is None:
+            self._closed = True
+        elif item is not _WAKE:
+            self._waiting.append(item)
+
+    def _admit(self) -> None:
+        """Move waiting requests into free slots, preferring the longest cached prefix."""
+        self._waiting = [s for s in self._waiting if not s.cancelled]
+        while self._waiting:
+            free = [slot for slot in self._slots if slot.sequence is None]
+            if not free:
+                return
+            sequence = self._waiting.pop(0)
+            slot = max(free, key=lambda sl: self._common_prefix(sl.tokens, sequence.prompt))
+            self._assign(slot, sequence)
+
+    @staticmethod
+    def _common_prefix(a: list[int], b: list[int]) -> int:
+        n = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            n += 1
+        return n
+
+    def _assign(self, slot: _Slot, sequence: _Sequence) -> None:
+        llama_cpp = self._llama_cpp
+        memory = llama_cpp.llama_get_memory(self._ctx.ctx)
+
+        # Keep the shared prefix, but always re-evaluate at least the last
+        # prompt token so there are fresh logits to sample from
+        keep = min(self._common_prefix(slot.tokens, sequence.prompt), len(sequence.prompt) - 1)
+        if not llama_cpp.llama_memory_seq_rm(memory, slot.seq_id, keep, -1):
+            # Recurrent/hybrid memory can't be cut back to a prefix
+            llama_cpp.llama_memory_seq_rm(memory, slot.seq_id, -1, -1)
+            keep = 0
+        slot.tokens = sequence.prompt[:keep]
+        slot.sequence = sequence
+        sequence.slot = slot
+        sequence.n_prefilled = keep
+        sequence.sampler = self._make_sampler(sequence.params)
+
+        self._stats["requests"] += 1
+        self._stats["prompt_tokens"] += len(sequence.prompt)
+        self._stats["reused_prompt_tokens"] += keep
+
+    def _make_sampler(self, params: dict) -> Any:
+        from llama_cpp._internals import LlamaSampler
+
+        sampler = LlamaSampler()
+        sampler.add_penalties(
+            penalty_last_n=_PENALTY_LAST_N,
+            penalty_repeat=params.get("repeat_penalty", 1.0),
+            penalty_freq=params.get("frequency_penalty", 0.0),
+            penalty_present=params.get("presence_penalty", 0.0),
+        )
+        if params.get("grammar") is not None:
+            sampler.add_grammar(self._model, params["grammar"])
+
+        temperature = params.get("temperature", 0.2)
+        seed = params.get("seed")
+        seed = _DEFAULT_SEED if seed is None else seed
+        if temperature == 0.0:
+            sampler.add_greedy()
+        else:
+            sampler.add_top_k(params.get("top_k", 40))
+            sampler.add_top_p(params.get("top_p", 0.95), 1)
+            sampler.add_min_p(params.get("min_p", 0.05), 1)
+            sampler.add_temp(max(temperature, 0.0))
+            sampler.add_dist(seed)
+        return sampler
+
+    def _step(self) -> bool:
+        """
+        Build one batch across all active sequences, decode it, sample.
+        Returns False when nothing could be decoded because every active
+        sequence is waiting for its client.
+        """
+        llama_cpp = self._llama_cpp
+        batch = self._batch.batch
+        n = 0
+        sample_at: list[tuple[_Slot, int]] = []
+
+        def add(slot: _Slot, token: int, logits: bool) -> None:
+            nonlocal n
+            batch.token[n] = token
+            batch.pos[n] = len(slot.tokens)
+            batch.n_seq_id[n] = 1
+            batch.seq_id[n][0] = slot.seq_id
+            batch.logits[n] = logits
+            slot.tokens.append(token)
+            if logits:
+                sample_at.append((slot, n))
+            n += 1
+
+        for slot in self._slots:
+            sequence = slot.sequence
+            if sequence is not None and sequence.cancelled:
+                self._finish(slot, "cancelled")
+
+        # Decoding sequences first: one token each keeps their latency flat.
+        # One whose client isn't reading skips the step instead of blocking it.
+        for slot in self._slots:
+            sequence = slot.sequence
+            if sequence is not None and sequence.last_token is not None and not sequence.backed_up:
+                add(slot, sequence.last_token, True)
+
+        # Then spend whatever room is left on prompt chunks
+        for slot in self._slots:
+            sequence = slot.sequence
+            if sequence is None or sequence.last_token is not None:
+                continue
+            room = self.n_batch - n
+            if room <= 0:
+                break
+            remaining = sequence.prompt[sequence.n_prefilled:]
+            chunk = remaining[:room]
+            for i, token in enumerate(chunk):
+                add(slot, token, i == len(remaining) - 1)
+            sequence.n_prefilled += len(chunk)
+
+        if n == 0:
+            return False
+        batch.n_tokens = n
+        status = llama_cpp.llama_decode(self._ctx.ctx, batch)
+        self._stats["steps"] += 1
+        self._stats["batched_tokens"] += n
+        if status != 0:
+            # Shouldn't happen - every slot owns n_ctx_per_sequence cells - but
+            # don't leave requests hanging if it does
+            for slot in self._slots:
+                if slot.sequence is not None:
+                    self._finish(slot, "error", f"llama_decode returned {status}")
+            return True
+
+        vocab = self._model.vocab
+        for slot, index in sample_at:
+            sequence = slot.sequence
+            token = sequence.sampler.sample(self._ctx, index)
+            sequence.last_token = token
+            if llama_cpp.llama_vocab_is_eog(vocab, token):
+                self._finish(slot, "stop")
+                continue
+            sequence.completion_tokens += 1
+            self._stats["completion_tokens"] += 1
+            if sequence.add_piece(self._model.detokenize([token], special=False)):
+                self._finish(slot, "stop")
+            elif sequence.completion_tokens >= sequence.max_tokens:
+                self._finish(slot, "length")
+            elif len(slot.tokens) + 1 >= self.n_ctx_per_sequence:
+                self._finish(slot, "length")
+        return True
+
+    def _finish(self, slot: _Slot, reason: str, error: Optional[str] = None) -> None:
+        sequence = slot.sequence
+        slot.sequence = None
+        if sequence is None:
+            return
+        if sequence.sampler is not None:
+            sequence.sampler.close()
+            sequence.sampler = None
+        if error:
+            sequence.push("error", error)
+            # Don't trust a half-written cache after a failure
+            memory = self._llama_cpp.llama_get_memory(self._ctx.ctx)
+            self._llama_cpp.llama_memory_seq_rm(memory, slot.seq_id, -1, -1)
+            slot.tokens = []
+            return
+        sequence.finish_reason = reason
+        sequence.flush()
+        sequence.push("done", reason)
+
+    # ── lifecycle / stats ─────────────────────────────────────────────────────
+
+    def stats(self) -> dict[str, Any]:
+        completion = self._stats["completion_tokens"]
+        return {
+            "backend": "batch",
+            "max_sequences": self.n_sequences,
+            "ctx_per_sequence": self.n_ctx_per_sequence,
+            "active": sum(1 for s in self._slots if s.sequence is not None),
+            "held_back": sum(1 for s in self._slots if s.sequence is not None and s.sequence.backed_up),
+            "waiting": len(self._waiting) + self._incoming.qsize(),
+            **self._stats,
+            "avg_batch_tokens": round(self._stats["batched_tokens"] / self._stats["steps"], 1)
+            if self._stats["steps"] else 0.0,
+            "decode_tokens_per_s": round(completion / self._busy_seconds, 1) if self._busy_seconds else 0.0,
+        }
+
+    def close(self) -> None:
+        """Stop the engine thread; queued and running requests get an error."""
+        if getattr(self, "_thread", None) is not None and self._thread.is_alive():
+            self._incoming.put(None)
+            self._thread.join(timeout=10)
+        for resource in ("_batch", "_ctx", "_model"):
+            handle = getattr(self, resource, None)
+            if handle is not None:
+                handle.close()
+
+    shutdown = close
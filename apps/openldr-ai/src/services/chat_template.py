@@ -0,0 +1,95 @@
+"""
+Chat template rendering for a loaded GGUF model.
+
+Renders messages with the model's own `tokenizer.chat_template` (the same
+Jinja template llama-cpp-python uses inside create_chat_completion) and
+tokenizes the result the same way, so callers can reason about the exact
+prompt tokens a completion will evaluate.
+
+Backends that don't keep a Llama in this process get a ModelHandle over a
+vocabulary-only load of the GGUF instead.
+"""
+from pathlib import Path
+from typing import Any, Optional
+
+
+class ModelHandle:
+    """The bits of the Llama API ChatTemplate needs, backed by a bare LlamaModel."""
+
+    def __init__(self, model: Any):
+        self._model = model
+        self.metadata = model.metadata()
+
+    def token_eos(self) -> int:
+        return self._model.token_eos()
+
+    def token_bos(self) -> int:
+        return self._model.token_bos()
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list[int]:
+        return self._model.tokenize(text, add_bos, special)
+
+    def detokenize(self, tokens: list[int], special: bool = False) -> bytes:
+        return self._model.detokenize(tokens, special)
+
+    def close(self) -> None:
+        self._model.close()
+
+
+def load_vocab(gguf_path: Path) -> ModelHandle:
+    """Tokenizer and metadata of a GGUF, without its weights or a context."""
+    from llama_cpp import llama_cpp
+    from llama_cpp._internals import LlamaModel
+
+    params = llama_cpp.llama_model_default_params()
+    params.vocab_only = True
+    return ModelHandle(LlamaModel(path_model=str(gguf_path), params=params, verbose=False))
+
+
+class ChatTemplate:
+    def __init__(self, llm: Any):
+        self.llm = llm
+        self._formatters: dict[bool, Any] = {}
+
+        template = (getattr(llm, "metadata", None) or {}).get("tokenizer.chat_template")
+        if not template:
+            return
+
+        try:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+            eos_token = self._token_text(llm.token_eos())
+            bos_token = self._token_text(llm.token_bos())
+            for add_generation_prompt in (True, False):
+                self._formatters[add_generation_prompt] = Jinja2ChatFormatter(
+                    template=template,
+                    eos_token=eos_token,
+                    bos_token=bos_token,
+                    add_generation_prompt=add_generation_prompt,
+                )
+        except Exception as e:
+            print(f"[chat-template] GGUF chat template unavailable: {e}")
+            self._formatters = {}
+
+    def _token_text(self, token_id: int) -> str:
+        if token_id is None or token_id < 0:
+            return ""
+        return self.llm.detokenize([token_id], special=True).decode("utf-8", errors="ignore")
+
+    @property
+    def available(self) -> bool:
+        return bool(self._formatters)
+
+    def render(self, messages: list[dict], add_generation_prompt: bool = True) -> Optional[str]:
+        """Prompt text for these messages, or None if the template can't render them."""
+        formatter = self._formatters.get(add_generation_prompt)
+        if formatter is None:
+            return None
+        try:
+            return formatter(messages=messages).prompt
+        except Exception:
+            return None
+
+    def tokenize(self, text: str) -> list[int]:
+        # Jinja-rendered prompts already carry their special tokens (BOS etc.)
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
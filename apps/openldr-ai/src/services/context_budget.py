@@ -1,108 +1,216 @@
+"""
+Token-accurate prompt budgeting for every generation call.
+
+A prompt plus the tokens reserved for the answer must fit the model's
+context. Anything beyond that makes llama.cpp reject the request, and a
+prompt that merely comes close still spends prompt-eval time on history the
+answer doesn't need.
+
+ContextBudget counts tokens with the model's own tokenizer (Llama.tokenize,
+or a vocabulary-only load for out-of-process backends) and the GGUF chat
+template. Each message is tokenized once. The count is its content tokens
+plus the template's per-role overhead, measured once by rendering probe
+messages, and it is cached by (role, content). Fitting a conversation is
+then a sum and a single pass over the messages:
+
+  1. drop the oldest non-system messages until the prompt fits, never the
+     last message, and never leave an assistant turn first
+  2. if it still doesn't fit, cut the middle out of the largest messages
+
+The per-message sums are approximate at message boundaries, which
+AI_CONTEXT_SAFETY_MARGIN_TOKENS absorbs.
+"""
 from __future__ import annotations
 
-from dataclasses import dataclass
+from collections import OrderedDict
 from typing import Any
 
 from core.config import settings
-
-
-@dataclass
-class BudgetedPrompt:
-    prompt: str
-    token_count: int
-    trimmed_messages: list[dict[str, str]]
-
-
-def render_chat_prompt(tokenizer, messages: list[dict[str, str]]) -> str:
-    try:
-        return tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
+from services.chat_template import ChatTemplate
+
+# Per-message token counts kept per model
+MAX_CACHED_COUNTS = 4096
+
+# Template overhead assumed when the model has no usable chat template
+FALLBACK_MESSAGE_OVERHEAD = 8
+FALLBACK_PROMPT_OVERHEAD = 16
+
+# Shortest content a truncated message is cut down to
+MIN_TRUNCATED_TOKENS = 32
+
+TRUNCATION_MARKER = "\n[...]\n"
+
+_PROBE_TEXT = "x"
+
+
+class ContextBudget:
+    """
+    Fits chat messages into one model's context window. Runs on the event
+    loop; the tokenizer only reads the vocabulary, so it is safe to use while
+    the model decodes on its inference thread.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Any,
+        n_ctx: int,
+        template: ChatTemplate | None = None,
+        owns_tokenizer: bool = False,
+    ):
+        self.tokenizer = tokenizer
+        self.owns_tokenizer = owns_tokenizer
+        self.n_ctx = n_ctx
+        self.template = template or ChatTemplate(tokenizer)
+        self._counts: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._overheads: dict[str, int] = {}
+        self._prompt_overhead: int | None = None
+        self._stats = {"requests": 0, "trimmed": 0, "dropped_messages": 0, "truncated_messages": 0}
+
+    # ── counting ──────────────────────────────────────────────────────────────
+
+    def _tokenize(self, text: str) -> list[int]:
+        return self.template.tokenize(text)
+
+    def _rendered_tokens(self, messages: list[dict], add_generation_prompt: bool) -> int | None:
+        rendered = self.template.render(messages, add_generation_prompt=add_generation_prompt)
+        return len(self._tokenize(rendered)) if rendered is not None else None
+
+    def _overhead(self, role: str) -> int:
+        """Tokens the template wraps around one message with this role."""
+        overhead = self._overheads.get(role)
+        if overhead is not None:
+            return overhead
+
+        overhead = FALLBACK_MESSAGE_OVERHEAD
+        probe = {"role": "user", "content": _PROBE_TEXT}
+        one = self._rendered_tokens([probe], add_generation_prompt=False)
+        two = self._rendered_tokens([probe, {"role": role, "content": _PROBE_TEXT}], add_generation_prompt=False)
+        if one is not None and two is not None and two > one:
+            overhead = two - one - len(self._tokenize(_PROBE_TEXT))
+        elif role != "user":
+            # Templates that only allow this role first (system) - close enough
+            overhead = self._overhead("user")
+        self._overheads[role] = max(0, overhead)
+        return self._overheads[role]
+
+    def _fixed_overhead(self) -> int:
+        """Tokens of a prompt that don't belong to any message: BOS, generation prompt, default system text."""
+        if self._prompt_overhead is None:
+            tokens = self._rendered_tokens([{"role": "user", "content": _PROBE_TEXT}], add_generation_prompt=True)
+            if tokens is None:
+                self._prompt_overhead = FALLBACK_PROMPT_OVERHEAD
+            else:
+                self._prompt_overhead = max(0, tokens - self._overhead("user") - len(self._tokenize(_PROBE_TEXT)))
+        return self._prompt_overhead
+
+    def count(self, message: dict) -> int:
+        """Tokens this message adds to a rendered prompt."""
+        role = str(message.get("role", "user"))
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            content = str(content)
+
+        key = (role, content)
+        count = self._counts.get(key)
+        if count is not None:
+            self._counts.move_to_end(key)
+            return count
+
+        count = self._overhead(role) + len(self._tokenize(content))
+        self._counts[key] = count
+        if len(self._counts) > MAX_CACHED_COUNTS:
+            self._counts.popitem(last=False)
+        return count
+
+    def text_tokens(self, text: str) -> int:
+        """Tokens of a piece of text on its own, without any template."""
+        return len(self._tokenize(text))
+
+    def prompt_tokens(self, messages: list[dict]) -> int:
+        return self._fixed_overhead() + sum(self.count(m) for m in messages)
+
+    # ── fitting ───────────────────────────────────────────────────────────────
+
+    def limit(self, max_tokens: int | None) -> int:
+        """Prompt tokens allowed when max_tokens are reserved for the answer."""
+        reserved = min(max_tokens or settings.AI_RESERVED_OUTPUT_TOKENS, self.n_ctx // 2)
+        window = min(self.n_ctx - reserved, settings.AI_MAX_INPUT_TOKENS)
+        return max(1, window - settings.AI_CONTEXT_SAFETY_MARGIN_TOKENS)
+
+    def fit(self, messages: list[dict], max_tokens: int | None) -> list[dict]:
+        """
+        Messages that fit the context with max_tokens left for the answer.
+        Returns the list itself when nothing has to go.
+        """
+        self._stats["requests"] += 1
+        limit = self.limit(max_tokens)
+        counts = [self.count(m) for m in messages]
+        total = self._fixed_overhead() + sum(counts)
+        if total <= limit or not messages:
+            return messages
+
+        self._stats["trimmed"] += 1
+        last = len(messages) - 1
+        keep = [True] * len(messages)
+
+        # 1. Oldest history first; the conversation must then open on a user turn
+        opened = False
+        for i, message in enumerate(messages[:last]):
+            if message.get("role") == "system":
+                continue
+            if opened or (total <= limit and message.get("role") == "user"):
+                opened = True
+                continue
+            keep[i] = False
+            total -= counts[i]
+            self._stats["dropped_messages"] += 1
+
+        kept = [i for i in range(len(messages)) if keep[i]]
+        fitted = {i: messages[i] for i in kept}
+
+        # 2. Still too long: cut the largest messages, conversation before system
+        if total > limit:
+            by_size = sorted(
+                kept, key=lambda i: (messages[i].get("role") != "system", counts[i]), reverse=True
+            )
+            for i in by_size:
+                if total <= limit:
+                    break
+                message, saved = self._truncate(messages[i], counts[i], total - limit)
+                if saved:
+                    fitted[i] = message
+                    total -= saved
+                    self._stats["truncated_messages"] += 1
+
+        return [fitted[i] for i in kept]
+
+    def _truncate(self, message: dict, count: int, excess: int) -> tuple[dict, int]:
+        """Cut the middle of a message's content by at least `excess` tokens if it can; returns (message, tokens saved)."""
+        content = message.get("content") or ""
+        if not isinstance(content, str):
+            return message, 0
+        tokens = self._tokenize(content)
+        marker = len(self._tokenize(TRUNCATION_MARKER))
+        keep = max(MIN_TRUNCATED_TOKENS, len(tokens) - excess - marker)
+        if keep >= len(tokens):
+            return message, 0
+
+        head, tail = keep - keep // 2, keep // 2
+        text = (
+            self._detokenize(tokens[:head])
+            + TRUNCATION_MARKER
+            + (self._detokenize(tokens[-tail:]) if tail else "")
         )
-    except Exception:
-        return "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages) + "\nASSISTANT:"
-
-
-def count_tokens(tokenizer, text: str) -> int:
-    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
-
-
-def trim_text_to_token_budget(tokenizer, text: str, max_tokens: int) -> str:
-    if max_tokens <= 0:
-        return ""
-
-    input_ids = tokenizer(text, add_special_tokens=False)["input_ids"]
-    if len(input_ids) <= max_tokens:
-        return text
-
-    trimmed_ids = input_ids[-max_tokens:]
-    return tokenizer.decode(trimmed_ids, skip_special_tokens=True)
-
-
-def compact_messages(messages: list[dict[str, str]]) -> list[dict[str, str]]:
-    if not messages:
-        return []
-
-    system_messages = [m for m in messages if m.get("role") == "system"]
-    other_messages = [m for m in messages if m.get("role") != "system"]
-
-    max_history = max(1, settings.AI_MAX_HISTORY_MESSAGES)
-    trimmed = other_messages[-max_history:]
-    return [*system_messages[-1:], *trimmed] if system_messages else trimmed
-
-
-def build_budgeted_prompt(
-    tokenizer,
-    messages: list[dict[str, str]],
-    max_input_tokens: int | None = None,
-    reserved_output_tokens: int | None = None,
-    safety_margin_tokens: int | None = None,
-) -> BudgetedPrompt:
-    max_input_tokens = max_input_tokens or settings.AI_MAX_INPUT_TOKENS
-    reserved_output_tokens = reserved_output_tokens or settings.AI_RESERVED_OUTPUT_TOKENS
-    safety_margin_tokens = safety_margin_tokens or settings.AI_CONTEXT_SAFETY_MARGIN_TOKENS
-
-    effective_budget = max(512, max_input_tokens - reserved_output_tokens - safety_margin_tokens)
-
-    working = compact_messages(messages)
-
-    while working:
-        prompt = render_chat_prompt(tokenizer, working)
-        token_count = count_tokens(tokenizer, prompt)
-        if token_count <= effective_budget:
-            return BudgetedPrompt(prompt=prompt, token_count=token_count, trimmed_messages=working)
-
-        non_system_indexes = [i for i, m in enumerate(working) if m.get("role") != "system"]
-        if len(non_system_indexes) > 1:
-            del working[non_system_indexes[0]]
-            continue
-
-        # Last resort: trim the final non-system message content itself.
-        target_index = non_system_indexes[0] if non_system_indexes else len(working) - 1
-        keep_budget = max(128, effective_budget // max(1, len(working)))
-        content = working[target_index].get("content", "")
-        working[target_index] = {
-            **working[target_index],
-            "content": trim_text_to_token_budget(tokenizer, content, keep_budget),
-        }
-
-        prompt = render_chat_prompt(tokenizer, working)
-        token_count = count_tokens(tokenizer, prompt)
-        if token_count <= effective_budget:
-            return BudgetedPrompt(prompt=prompt, token_count=token_count, trimmed_messages=working)
-
-        if len(working) == 1:
-            break
+        truncated = {**message, "content": text}
+        return truncated, max(0, count - self.count(truncated))
 
-    prompt = render_chat_prompt(tokenizer, working[:1] if working else messages[-1:])
-    return BudgetedPrompt(
-        prompt=prompt,
-        token_count=count_tokens(tokenizer, prompt),
-        trimmed_messages=working[:1] if working else messages[-1:],
-    )
+    def _detokenize(self, tokens: list[int]) -> str:
+        return self.tokenizer.detokenize(tokens).decode("utf-8", errors="ignore")
 
+    def stats(self) -> dict[str, Any]:
+        return {**self._stats, "n_ctx": self.n_ctx, "cached_counts": len(self._counts)}
 
-def tokenize_budgeted_prompt(tokenizer, prompt: str, device) -> dict[str, Any]:
-    inputs = tokenizer(prompt, return_tensors="pt", truncation=True)
-    return {k: v.to(device) for k, v in inputs.items()}
+    def close(self) -> None:
+        # A shared Llama is closed by its executor
+        if self.owns_tokenizer:
+            self.tokenizer.close()
@@ -1,54 +1,193 @@
 """
-Inference service - generates responses using the loaded llama-cpp-python model.
+Inference service - generates responses using models from the resident pool.
 Supports both streaming (SSE) and non-streaming responses.
+
+All llama-cpp calls go through the model's executor so decoding never runs
+on the event loop. The executor is an in-process InferenceExecutor, a
+continuous BatchEngine, a multi-process WorkerPool or a LlamaServerBackend,
+depending on AI_INFERENCE_BACKEND; they all expose complete() and
+stream_tokens().
+
+Every call takes an optional model_id; None means the pool's default model.
+Messages are fitted to the model's context (services.context_budget) before
+they reach the executor. Each generation is recorded in services.metrics
+once it ends, and as a span (fit, prompt eval, decode) on the request's
+trace; while tokens stream only a local counter is touched.
 """
-from typing import AsyncGenerator
+import asyncio
+import time
+from typing import Any, AsyncGenerator, Callable, Optional
 
-from core.state import loaded_model
+from services.mcp_client import tool_catalogue
+from services.metrics import record_generation
+from services.model_pool import ResidentModel, model_pool
+from services.tracing import record, span
 
 
-def is_model_loaded() -> bool:
-    return bool(loaded_model.get("model"))
+def is_model_loaded(model_id: Optional[str] = None) -> bool:
+    if model_id:
+        return model_pool.is_resident(model_id)
+    return model_pool.default_model_id is not None
 
 
 def get_loaded_model_id() -> str | None:
-    return loaded_model.get("model_id")
+    return model_pool.default_model_id
+
+
+def _get_model(model_id: Optional[str] = None) -> ResidentModel:
+    resident = model_pool.get(model_id)
+    if resident is None:
+        raise RuntimeError(f"Model {model_id} is not loaded" if model_id else "No model loaded")
+    return resident
+
+
+def _fit(resident: ResidentModel, messages: list[dict], max_tokens: int) -> list[dict]:
+    # Out-of-process models without a local GGUF have no tokenizer to count with
+    return resident.budget.fit(messages, max_tokens) if resident.budget else messages
+
+
+def _prompt_tokens(resident: ResidentModel, messages: list[dict]) -> Optional[int]:
+    # Per-message counts are already cached by the fit
+    return resident.budget.prompt_tokens(messages) if resident.budget else None
+
+
+def _peek_budget(model_id: Optional[str]) -> Any:
+    resident = model_pool.peek(model_id or model_pool.default_model_id or "")
+    return resident.budget if resident is not None else None
+
+
+def tokens_left(messages: list[dict], max_tokens: int, model_id: Optional[str] = None) -> Optional[int]:
+    """
+    Prompt tokens still free once `messages` are in, with max_tokens kept
+    for the answer; None when the model has no tokenizer to count with.
+    """
+    budget = _peek_budget(model_id)
+    if budget is None:
+        return None
+    return budget.limit(max_tokens) - budget.prompt_tokens(messages)
+
+
+def token_counter(model_id: Optional[str] = None) -> Optional[Callable[[str], int]]:
+    """The model's own token count for a piece of text, if it has a tokenizer."""
+    budget = _peek_budget(model_id)
+    return budget.text_tokens if budget is not None else None
+
+
+def _record_phases(started: float, fitted: float, first_token_at: Optional[float], finished: float) -> None:
+    record("generation.fit", started, fitted)
+    if first_token_at is None:
+        return
+    # Prompt eval includes any wait for the executor; the first token closes it
+    record("generation.prompt_eval", fitted, first_token_at)
+    record("generation.decode", first_token_at, finished)
+
+
+def _namespace() -> str:
+    # Prefix-cache key namespace: the tool catalogue the prompts were built from
+    return str(tool_catalogue.snapshot.version)
+
+
+async def stream_chat_tokens(
+    messages: list[dict],
+    max_tokens: int,
+    temperature: float,
+    model_id: Optional[str] = None,
+    **kwargs: Any,
+) -> AsyncGenerator[str, None]:
+    """Stream content tokens for a chat completion from the inference executor."""
+    resident = _get_model(model_id)
+    with span("generation", model=resident.model_id, mode="stream") as attrs:
+        started = time.perf_counter()
+        messages = _fit(resident, messages, max_tokens)
+        fitted = time.perf_counter()
+        first_token_at = None
+        n_tokens = 0
+        outcome = "error"
+        try:
+            async for token in resident.executor.stream_tokens(
+                messages,
+                namespace=_namespace(),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs,
+            ):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                n_tokens += 1
+                yield token
+            outcome = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            # The consumer stopped early: a detected tool call or a client disconnect
+            outcome = "stopped"
+            raise
+        finally:
+            finished = time.perf_counter()
+            prompt_tokens = _prompt_tokens(resident, messages)
+            record_generation(
+                resident.model_id, "stream", outcome, prompt_tokens,
+                n_tokens, started, first_token_at, finished,
+            )
+            attrs.update(outcome=outcome, prompt_tokens=prompt_tokens, completion_tokens=n_tokens)
+            _record_phases(started, fitted, first_token_at, finished)
+
+
+async def complete_chat(
+    messages: list[dict],
+    max_tokens: int,
+    temperature: float,
+    model_id: Optional[str] = None,
+    **kwargs: Any,
+) -> str:
+    """Run a non-streaming chat completion on the inference executor."""
+    resident = _get_model(model_id)
+    with span("generation", model=resident.model_id, mode="complete") as attrs:
+        started = time.perf_counter()
+        messages = _fit(resident, messages, max_tokens)
+        record("generation.fit", started, time.perf_counter())
+        try:
+            response = await resident.executor.complete(
+                messages,
+                namespace=_namespace(),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs,
+            )
+        except Exception:
+            record_generation(resident.model_id, "complete", "error", _prompt_tokens(resident, messages), 0, started)
+            raise
+        usage = response.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or _prompt_tokens(resident, messages)
+        completion_tokens = usage.get("completion_tokens") or 0
+        record_generation(resident.model_id, "complete", "ok", prompt_tokens, completion_tokens, started)
+        attrs.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    return response.get("choices", [{}])[0].get("message", {}).get("content", "") or ""
 
 
 async def generate_stream(
     messages: list[dict],
     max_new_tokens: int = 512,
     temperature: float = 0.7,
+    model_id: Optional[str] = None,
 ) -> AsyncGenerator[str, None]:
     """
     Yields tokens one by one using llama-cpp-python's streaming chat completion.
     """
-    llm = loaded_model.get("model")
-    if not llm:
+    if not is_model_loaded(model_id):
         yield "[ERROR: No model loaded]"
         return
 
-    response = llm.create_chat_completion(
-        messages=messages,
-        max_tokens=max_new_tokens,
-        temperature=temperature,
-        stream=True,
-    )
-
-    for chunk in response:
-        delta = chunk.get("choices", [{}])[0].get("delta", {})
-        token = delta.get("content")
-        if token:
-            yield token
+    async for token in stream_chat_tokens(messages, max_new_tokens, temperature, model_id=model_id):
+        yield token
 
 
 async def generate(
     messages: list[dict],
     max_new_tokens: int = 512,
     temperature: float = 0.7,
+    model_id: Optional[str] = None,
 ) -> str:
     """Non-streaming version - collects the full response."""
     result = []
-    async for token in generate_stream(messages, max_new_tokens, temperature):
+    async for token in generate_stream(messages, max_new_tokens, temperature, model_id=model_id):
         result.append(token)
     return "".join(result)
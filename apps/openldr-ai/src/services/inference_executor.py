@@ -0,0 +1,176 @@
+"""
+Inference executor - runs llama-cpp-python calls off the asyncio event loop.
+
+A Llama instance is not thread-safe, so each loaded model gets one dedicated
+worker thread that owns it and runs every generation in turn. Streaming
+completions are handed back to async consumers through a bounded
+asyncio.Queue: when the SSE client falls behind the worker blocks instead of
+buffering the whole answer, and when the client goes away the worker stops
+decoding at the next token.
+
+run_chat_completion() is the one place a chat completion is actually
+started; the multi-process worker pool runs the same function inside each
+worker so both paths behave identically.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Callable, Iterable
+
+from core.config import settings
+from services.speculative import SpeculativeDecoder
+
+_END = object()
+
+
+def iter_content_tokens(chunks: Iterable[dict]) -> Iterable[str]:
+    """Pull the text deltas out of a streaming chat completion."""
+    for chunk in chunks:
+        delta = chunk.get("choices", [{}])[0].get("delta", {})
+        token = delta.get("content")
+        if token:
+            yield token
+
+
+def run_chat_completion(
+    llm: Any,
+    prefix_cache: Any,
+    messages: list[dict],
+    namespace: str = "",
+    **kwargs: Any,
+) -> Any:
+    """
+    Start create_chat_completion on the thread (or process) that owns llm,
+    restoring the system-prompt KV prefix first if there is a prefix cache.
+    With speculative decoding, non-streaming responses carry the request's
+    draft acceptance under "speculative".
+    """
+    if prefix_cache is not None:
+        try:
+            prefix_cache.prepare(messages, namespace=namespace)
+        except Exception as e:
+            # Never fail a completion over the cache - it just runs cold
+            print(f"[prefix-cache] Prepare failed: {e}")
+            llm.reset()
+
+    decoder = getattr(llm, "draft_model", None)
+    if not isinstance(decoder, SpeculativeDecoder):
+        return llm.create_chat_completion(messages=messages, **kwargs)
+
+    # Speculative decoding: count draft acceptance for this request
+    decoder.begin()
+    if kwargs.get("stream"):
+        return decoder.track_stream(llm.create_chat_completion(messages=messages, **kwargs))
+    try:
+        response = llm.create_chat_completion(messages=messages, **kwargs)
+    finally:
+        request = decoder.end()
+    response["speculative"] = request
+    return response
+
+
+class InferenceExecutor:
+    """Owns a Llama instance and serialises all work on it onto one thread."""
+
+    def __init__(self, llm: Any, name: str = "llama", prefix_cache: Any = None):
+        self.llm = llm
+        self.prefix_cache = prefix_cache
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{name}")
+
+    async def run(self, fn: Callable[[Any], Any]) -> Any:
+        """Run fn(llm) on the worker thread and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, self.llm)
+
+    async def stream(self, fn: Callable[[Any], Iterable[Any]]) -> AsyncGenerator[Any, None]:
+        """
+        Run fn(llm) on the worker thread and yield each item of the iterable
+        it returns as soon as it is produced.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.AI_INFERENCE_QUEUE_SIZE))
+        cancelled = threading.Event()
+
+        def put(item: tuple[Any, BaseException | None]) -> bool:
+            # Blocks the worker while the queue is full (backpressure), but
+            # re-checks for cancellation so an abandoned stream never hangs it.
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return True
+                except TimeoutError:
+                    if cancelled.is_set():
+                        future.cancel()
+                        return False
+                except Exception:
+                    return False
+
+        def work(llm: Any) -> None:
+            iterator = None
+            try:
+                iterator = iter(fn(llm))
+                for item in iterator:
+                    if cancelled.is_set() or not put((item, None)):
+                        return
+            except BaseException as e:
+                put((_END, e))
+                return
+            finally:
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+            put((_END, None))
+
+        loop.run_in_executor(self._pool, work, self.llm)
+
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is _END:
+                    if error:
+                        raise error
+                    return
+                yield item
+        finally:
+            cancelled.set()
+
+    async def complete(self, messages: list[dict], namespace: str = "", **kwargs: Any) -> dict:
+        """Non-streaming chat completion; returns the OpenAI-style response."""
+        return await self.run(
+            lambda llm: run_chat_completion(llm, self.prefix_cache, messages, namespace, stream=False, **kwargs)
+        )
+
+    async def stream_tokens(
+        self, messages: list[dict], namespace: str = "", **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        """Streaming chat completion; yields content tokens."""
+        async for token in self.stream(
+            lambda llm: iter_content_tokens(
+                run_chat_completion(llm, self.prefix_cache, messages, namespace, stream=True, **kwargs)
+            )
+        ):
+            yield token
+
+    def stats(self) -> dict[str, Any]:
+        decoder = getattr(self.llm, "draft_model", None)
+        if isinstance(decoder, SpeculativeDecoder):
+            return {"backend": "local", "speculative": decoder.stats.snapshot()}
+        return {"backend": "local"}
+
+    def shutdown(self) -> None:
+        """Stop accepting work; queued and running generations still finish."""
+        self._pool.shutdown(wait=False)
+
+    def close(self) -> None:
+        """
+        Shut down and free the model once queued and running generations
+        have finished, so an unloaded model never disappears mid-stream.
+        """
+        close = getattr(self.llm, "close", None)
+        if close:
+            self._pool.submit(close)
+        decoder = getattr(self.llm, "draft_model", None)
+        if isinstance(decoder, SpeculativeDecoder):
+            self._pool.submit(decoder.close)
+        self.shutdown()
@@ -0,0 +1,86 @@
+"""
+Out-of-process backend for llama-cpp-python's bundled OpenAI-compatible
+server (AI_INFERENCE_BACKEND=server).
+
+Run the server separately, e.g.
+    python -m llama_cpp.server --model /ai/downloads/.../model.gguf --n_threads 8
+and point AI_LLAMA_SERVER_URL at it. Chat completions are forwarded to
+/v1/chat/completions; streaming responses are read as SSE and turned back
+into content tokens, so the rest of the service can't tell the difference.
+"""
+import asyncio
+import json
+from typing import Any, AsyncGenerator
+
+import httpx
+
+from services.inference_executor import iter_content_tokens
+
+
+class LlamaServerBackend:
+    def __init__(self, base_url: str, model: str, timeout: float = 300.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        self._requests = 0
+        self._errors = 0
+
+    def _body(self, messages: list[dict], stream: bool, kwargs: dict) -> dict:
+        grammar = kwargs.get("grammar")
+        if grammar is not None and not isinstance(grammar, str):
+            # The server takes GBNF text, not a LlamaGrammar
+            kwargs = {**kwargs, "grammar": grammar._grammar}
+        return {"model": self.model, "messages": messages, "stream": stream, **kwargs}
+
+    async def complete(self, messages: list[dict], namespace: str = "", **kwargs: Any) -> dict:
+        # namespace is for the in-process prefix cache; the server manages its own
+        self._requests += 1
+        try:
+            resp = await self._client.post("/v1/chat/completions", json=self._body(messages, False, kwargs))
+            resp.raise_for_status()
+            return resp.json()
+        except httpx.HTTPError as e:
+            self._errors += 1
+            raise RuntimeError(f"llama_cpp.server request failed: {e}")
+
+    async def stream_tokens(
+        self, messages: list[dict], namespace: str = "", **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        self._requests += 1
+        try:
+            async with self._client.stream(
+                "POST", "/v1/chat/completions", json=self._body(messages, True, kwargs)
+            ) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        return
+                    for token in iter_content_tokens([json.loads(data)]):
+                        yield token
+        except httpx.HTTPError as e:
+            self._errors += 1
+            raise RuntimeError(f"llama_cpp.server request failed: {e}")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": "server",
+            "url": self.base_url,
+            "requests": self._requests,
+            "errors": self._errors,
+        }
+
+    def close(self) -> None:
+        client = self._client
+        try:
+            asyncio.get_running_loop().create_task(client.aclose())
+        except RuntimeError:
+            # No loop in this thread (unloaded from a worker thread) - let GC close it
+            pass
+
+    shutdown = close
@@ -3,17 +3,43 @@ MCP Client Service — Streamable HTTP Transport
 -----------------------------------------------
 Your MCP server uses StreamableHTTPServerTransport (POST+GET /stream).
 
-Protocol per request:
+Protocol:
 1. POST /stream (no session ID)  → initialize → get mcp-session-id from header
 2. POST /stream (with session ID) → send JSON-RPC method → read SSE response body
+
+Sessions are long-lived: a small pool of initialized sessions shares one
+keep-alive HTTP client, so a tool call costs a single round trip. When the
+server forgets a session (restart, expiry) it is re-initialized transparently.
+tools/call responses are read incrementally and bounded (see mcp_stream), so
+a tool returning 100k records never lands in memory whole.
+
+The tool list lives in a versioned ToolCatalogue that is refreshed in the
+background (on a TTL, and whenever the server pushes
+notifications/tools/list_changed on the GET /stream channel). Readers always
+get the current snapshot immediately and never wait on tools/list.
 """
+import asyncio
+import hashlib
+import itertools
 import json
+import time
 import httpx
+from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Any
 from core.config import settings
+from services.mcp_stream import ToolResponseReader
+from services.metrics import mcp_handshake_seconds, mcp_tool_call_seconds, mcp_tool_calls_total
+from services.semantic_router import semantic_router
+from services.tool_result import SHAPE_RECORDS, ToolResult
+from services.tool_result_cache import tool_result_cache
+from services.tool_router import tool_index
+from services.tracing import span
 
-_tools_cache: list[dict] = []
-_tools_fetched = False
+MCP_HEADERS = {
+    "Content-Type": "application/json",
+    "Accept": "application/json, text/event-stream",
+}
 
 
 def _parse_sse_body(text: str) -> dict | None:
@@ -31,16 +57,70 @@ def _parse_sse_body(text: str) -> dict | None:
     return None
 
 
-async def _mcp_request(method: str, params: dict, timeout: float = 30.0) -> dict:
+class MCPSessionExpired(Exception):
+    """The server no longer recognises the session ID we sent."""
+
+
+def _is_session_expired(resp: httpx.Response) -> bool:
+    # The SDK transport answers an unknown session with 404; our server's
+    # own router answers a missing/unknown one with 400 "No valid session ID".
+    if resp.status_code == 404:
+        return True
+    return resp.status_code == 400 and "session" in resp.text.lower()
+
+
+class MCPSessionPool:
     """
-    Open a fresh MCP session, send one JSON-RPC request, return the result.
-    Each call goes through the full initialize → request → close cycle.
+    Pool of initialized MCP sessions over one keep-alive httpx client.
+    Each request checks a session out exclusively and returns it afterwards;
+    at most `size` sessions are opened against the server.
     """
-    async with httpx.AsyncClient(timeout=timeout) as client:
 
-        # ── 1. Initialize session ──────────────────────────────────────────
-        init_resp = await client.post(
-            f"{settings.AI_MCP_URL}/stream",
+    def __init__(self, base_url: str, size: int):
+        self.base_url = base_url.rstrip("/")
+        self.size = max(1, size)
+        self._client: httpx.AsyncClient | None = None
+        self._idle: asyncio.Queue[str | None] | None = None
+        self._opened = 0
+        self._ids = itertools.count(1)
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/stream"
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(
+                    max_connections=self.size * 2,
+                    max_keepalive_connections=self.size * 2,
+                ),
+            )
+        return self._client
+
+    def _idle_queue(self) -> asyncio.Queue[str | None]:
+        # Holds idle session IDs; None marks a free slot whose session was dropped
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        return self._idle
+
+    async def _initialize(self, timeout: float) -> str:
+        """Run the initialize handshake and return the new session ID."""
+        started = time.perf_counter()
+        try:
+            with span("mcp.initialize"):
+                session_id = await self._handshake(timeout)
+        except BaseException:
+            mcp_handshake_seconds.observe(time.perf_counter() - started, "error")
+            raise
+        mcp_handshake_seconds.observe(time.perf_counter() - started, "ok")
+        return session_id
+
+    async def _handshake(self, timeout: float) -> str:
+        init_resp = await self.client.post(
+            self.url,
             json={
                 "jsonrpc": "2.0",
                 "id": 0,
@@ -51,10 +131,8 @@ async def _mcp_request(method: str, params: dict, timeout: float = 30.0) -> dict
                     "clientInfo": {"name": "openldr-ai", "version": "0.1.0"},
                 },
             },
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json, text/event-stream",
-            },
+            headers=MCP_HEADERS,
+            timeout=timeout,
         )
         init_resp.raise_for_status()
 
@@ -66,39 +144,61 @@ async def _mcp_request(method: str, params: dict, timeout: float = 30.0) -> dict
                 f"Status: {init_resp.status_code}, Body: {init_resp.text[:300]}"
             )
 
-        # ── 2. Send initialized notification (MCP protocol requires this) ──
-        await client.post(
-            f"{settings.AI_MCP_URL}/stream",
-            json={
-                "jsonrpc": "2.0",
-                "method": "notifications/initialized",
-                "params": {},
-            },
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json, text/event-stream",
-                "mcp-session-id": session_id,
-            },
+        # MCP protocol requires the initialized notification before any request
+        await self.client.post(
+            self.url,
+            json={"jsonrpc": "2.0", "method": "notifications/initialized", "params": {}},
+            headers={**MCP_HEADERS, "mcp-session-id": session_id},
+            timeout=timeout,
         )
+        return session_id
 
-        # ── 3. Send actual request ─────────────────────────────────────────
-        resp = await client.post(
-            f"{settings.AI_MCP_URL}/stream",
-            json={
-                "jsonrpc": "2.0",
-                "id": 1,
-                "method": method,
-                "params": params,
-            },
-            headers={
-                "Content-Type": "application/json",
-                "Accept": "application/json, text/event-stream",
-                "mcp-session-id": session_id,
-            },
-        )
-        resp.raise_for_status()
+    async def _acquire(self, timeout: float) -> str:
+        idle = self._idle_queue()
+        if idle.empty() and self._opened < self.size:
+            self._opened += 1
+            try:
+                return await self._initialize(timeout)
+            except BaseException:
+                self._opened -= 1
+                raise
+
+        session_id = await idle.get()
+        if session_id is not None:
+            return session_id
+        try:
+            return await self._initialize(timeout)
+        except BaseException:
+            idle.put_nowait(None)
+            raise
+
+    def _release(self, session_id: str | None) -> None:
+        self._idle_queue().put_nowait(session_id)
+
+    async def _send(
+        self,
+        session_id: str,
+        method: str,
+        params: dict,
+        timeout: float,
+        reader: ToolResponseReader | None = None,
+    ) -> dict:
+        async with self.client.stream(
+            "POST",
+            self.url,
+            json={"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": params},
+            headers={**MCP_HEADERS, "mcp-session-id": session_id},
+            timeout=timeout,
+        ) as resp:
+            if reader is None or resp.is_error:
+                await resp.aread()
+            if _is_session_expired(resp):
+                raise MCPSessionExpired(session_id)
+            resp.raise_for_status()
+            if reader is not None:
+                # Read incrementally; the body is never held whole
+                return await reader.read(resp, method)
 
-        # ── 4. Parse SSE response body ─────────────────────────────────────
         parsed = _parse_sse_body(resp.text)
         if not parsed:
             raise RuntimeError(
@@ -109,34 +209,293 @@ async def _mcp_request(method: str, params: dict, timeout: float = 30.0) -> dict
 
         return parsed.get("result", {})
 
+    async def request(
+        self,
+        method: str,
+        params: dict,
+        timeout: float = 30.0,
+        reader: ToolResponseReader | None = None,
+    ) -> dict:
+        """
+        Send one JSON-RPC request on a pooled session and return its result.
+        With a reader, the response is read incrementally through it.
+        """
+        session_id = await self._acquire(timeout)
+        try:
+            try:
+                return await self._send(session_id, method, params, timeout, reader)
+            except MCPSessionExpired:
+                # Server dropped the session - open a fresh one in its place and retry once
+                print(f"[mcp] Session {session_id} expired, re-initializing")
+                session_id = None
+                session_id = await self._initialize(timeout)
+                return await self._send(session_id, method, params, timeout, reader)
+        except MCPSessionExpired:
+            session_id = None
+            raise RuntimeError(f"MCP server rejected a freshly initialized session for '{method}'")
+        finally:
+            self._release(session_id)
 
-async def fetch_tools() -> list[dict]:
-    """Fetch and cache the tool list from the MCP server."""
-    global _tools_cache, _tools_fetched
+    async def close(self) -> None:
+        """Terminate pooled sessions (best effort) and close the HTTP client."""
+        if self._client is None:
+            return
+        idle = self._idle_queue()
+        while not idle.empty():
+            session_id = idle.get_nowait()
+            if session_id is None:
+                continue
+            try:
+                await self._client.delete(self.url, headers={"mcp-session-id": session_id}, timeout=5.0)
+            except Exception:
+                pass
+        self._idle = None
+        self._opened = 0
+        await self._client.aclose()
+        self._client = None
 
-    if _tools_fetched and _tools_cache:
-        return _tools_cache
 
-    try:
-        result = await _mcp_request("tools/list", {}, timeout=15.0)
-        _tools_cache = result.get("tools", [])
-        _tools_fetched = True
-        print(f"[mcp] Loaded {len(_tools_cache)} tools: "
-              f"{[t['name'] for t in _tools_cache]}")
-    except Exception as e:
-        print(f"[mcp] Failed to fetch tools: {e}")
-        _tools_cache = []
+_pool = MCPSessionPool(settings.AI_MCP_URL, settings.AI_MCP_SESSION_POOL_SIZE)
+
+
+async def _mcp_request(
+    method: str,
+    params: dict,
+    timeout: float = 30.0,
+    reader: ToolResponseReader | None = None,
+) -> dict:
+    """Send one JSON-RPC request over a pooled MCP session, return the result."""
+    return await _pool.request(method, params, timeout=timeout, reader=reader)
+
+
+async def close_mcp_client() -> None:
+    await tool_catalogue.stop()
+    await _pool.close()
+
+
+@dataclass(frozen=True)
+class CatalogueSnapshot:
+    version: int = 0
+    tools: list[dict] = field(default_factory=list)
+    fingerprint: str = ""
+    fetched_at: float = 0.0  # time.time() of the last successful fetch, 0 = never
+
+    @cached_property
+    def names(self) -> frozenset[str]:
+        return frozenset(tool.get("name", "") for tool in self.tools)
 
-    return _tools_cache
 
+def _fingerprint(tools: list[dict]) -> str:
+    return hashlib.sha256(json.dumps(tools, sort_keys=True).encode("utf-8")).hexdigest()[:16]
 
-async def execute_tool(tool_name: str, arguments: dict[str, Any]) -> str:
-    """Execute an MCP tool and return the result as plain text."""
+
+class ToolCatalogue:
+    """
+    Stale-while-revalidate cache of the MCP tool list.
+
+    The version only increments when the tool list actually changes, so
+    anything derived from it (prompts, indexes, grammars) can key on it.
+    """
+
+    def __init__(self, pool: MCPSessionPool, ttl: float, retry_interval: float, subscribe: bool):
+        self.pool = pool
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.subscribe = subscribe
+        self._snapshot = CatalogueSnapshot()
+        self._last_error: str | None = None
+        self._refresh_lock: asyncio.Lock | None = None
+        self._wake: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._kick: asyncio.Task | None = None
+
+    @property
+    def snapshot(self) -> CatalogueSnapshot:
+        return self._snapshot
+
+    def is_stale(self) -> bool:
+        return time.time() - self._snapshot.fetched_at > self.ttl
+
+    def tools(self) -> list[dict]:
+        """
+        Current tool list, returned immediately. If nothing has ever been
+        fetched and no background loop is running, a refresh is kicked off
+        for next time.
+        """
+        if not self._tasks and self.is_stale() and (self._kick is None or self._kick.done()):
+            self._kick = asyncio.create_task(self.refresh())
+        return self._snapshot.tools
+
+    async def refresh(self) -> CatalogueSnapshot:
+        """Fetch tools/list now. On failure the previous snapshot is kept."""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            try:
+                result = await self.pool.request("tools/list", {}, timeout=15.0)
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"[mcp] Failed to fetch tools (keeping {len(self._snapshot.tools)} cached): {e}")
+                return self._snapshot
+
+            tools = result.get("tools", [])
+            fingerprint = _fingerprint(tools)
+            previous = self._snapshot
+            if fingerprint == previous.fingerprint:
+                self._snapshot = CatalogueSnapshot(previous.version, previous.tools, fingerprint, time.time())
+            else:
+                self._snapshot = CatalogueSnapshot(previous.version + 1, tools, fingerprint, time.time())
+                # Build the router's index (and tool embeddings) now rather than on the first question
+                tool_index(tools)
+                semantic_router.prepare(tools)
+                print(f"[mcp] Loaded {len(tools)} tools (catalogue v{self._snapshot.version}): "
+                      f"{[t['name'] for t in tools]}")
+            self._last_error = None
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """Ask the background loop to refresh as soon as possible."""
+        if self._wake is not None:
+            self._wake.set()
+        else:
+            self._snapshot = CatalogueSnapshot(
+                self._snapshot.version, self._snapshot.tools, self._snapshot.fingerprint, 0.0
+            )
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            snapshot = await self.refresh()
+            delay = self.ttl if self._last_error is None and snapshot.fetched_at else self.retry_interval
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _listen_loop(self) -> None:
+        """Hold a GET /stream channel open and refresh on tools/list_changed."""
+        session_id: str | None = None
+        while True:
+            try:
+                if session_id is None:
+                    session_id = await self.pool._initialize(timeout=15.0)
+                async with self.pool.client.stream(
+                    "GET",
+                    self.pool.url,
+                    headers={"Accept": "text/event-stream", "mcp-session-id": session_id},
+                    timeout=httpx.Timeout(15.0, read=None),
+                ) as resp:
+                    if resp.status_code == 405:
+                        print("[mcp] Server offers no GET /stream channel, relying on TTL refresh only")
+                        return
+                    if resp.status_code != 200:
+                        await resp.aread()
+                        if _is_session_expired(resp):
+                            session_id = None
+                        raise RuntimeError(f"GET /stream returned {resp.status_code}")
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            message = json.loads(line[5:].strip())
+                        except json.JSONDecodeError:
+                            continue
+                        if message.get("method") == "notifications/tools/list_changed":
+                            print("[mcp] Server reported tools/list_changed, refreshing catalogue")
+                            self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[mcp] Tool change stream unavailable, retrying in {self.retry_interval:.0f}s: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def start(self) -> CatalogueSnapshot:
+        """Load the catalogue once, then keep it fresh in the background."""
+        self._wake = asyncio.Event()
+        snapshot = await self.refresh()
+        self._wake.clear()
+        self._tasks.append(asyncio.create_task(self._refresh_loop()))
+        if self.subscribe:
+            self._tasks.append(asyncio.create_task(self._listen_loop()))
+        return snapshot
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except BaseException:
+                pass
+        self._tasks = []
+        self._wake = None
+
+    def status(self) -> dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "tool_count": len(snapshot.tools),
+            "fetched_at": snapshot.fetched_at or None,
+            "stale": self.is_stale(),
+            "last_error": self._last_error,
+            "subscribed": self.subscribe and bool(self._tasks),
+        }
+
+
+tool_catalogue = ToolCatalogue(
+    _pool,
+    ttl=settings.AI_MCP_TOOLS_TTL_SECONDS,
+    retry_interval=settings.AI_MCP_TOOLS_RETRY_SECONDS,
+    subscribe=settings.AI_MCP_TOOLS_SUBSCRIBE,
+)
+
+
+async def fetch_tools() -> list[dict]:
+    """Return the cached tool list without waiting on the MCP server."""
+    return tool_catalogue.tools()
+
+
+async def _call_tool(tool_name: str, arguments: dict[str, Any]) -> ToolResult:
+    """Execute an MCP tool; the result is parsed here, once, for everything downstream."""
+    started = time.perf_counter()
+    reader = ToolResponseReader(
+        max_bytes=int(settings.AI_MCP_RESULT_MAX_MB * 1024 * 1024),
+        keep_records=settings.AI_MCP_RESULT_KEEP_RECORDS,
+        keep_chars=int(settings.AI_MCP_RESULT_KEEP_MB * 1024 * 1024),
+    )
+    with span("mcp.tool_call", tool=tool_name) as attrs:
+        text, outcome = await _call_tool_once(tool_name, arguments, reader)
+        result = ToolResult.from_text(tool_name, text, ok=outcome == "ok")
+        if result.shape == SHAPE_RECORDS:
+            # Summaries then cover the records the reader dropped as well
+            result.columns = reader.record_columns(result.records_key)
+        attrs.update(
+            outcome=outcome,
+            result_chars=len(text),
+            shape=result.shape,
+            response_bytes=reader.bytes_read,
+            read_limit_reached=reader.cut_short,
+        )
+    if reader.cut_short:
+        print(f"[mcp] {tool_name} response cut at {reader.bytes_read} bytes (AI_MCP_RESULT_MAX_MB)")
+    # Tool names come from the model; only catalogue names become label values
+    label = tool_name if tool_name in tool_catalogue.snapshot.names else "unknown"
+    mcp_tool_call_seconds.observe(time.perf_counter() - started, label)
+    mcp_tool_calls_total.inc(label, outcome)
+    return result
+
+
+async def _call_tool_once(
+    tool_name: str,
+    arguments: dict[str, Any],
+    reader: ToolResponseReader,
+) -> tuple[str, str]:
     try:
         result = await _mcp_request(
             "tools/call",
             {"name": tool_name, "arguments": arguments},
             timeout=45.0,
+            reader=reader,
         )
 
         content_blocks = result.get("content", [])
@@ -151,21 +510,46 @@ async def execute_tool(tool_name: str, arguments: dict[str, Any]) -> str:
             text = json.dumps(result, indent=2)
 
         if result.get("isError"):
-            return f"Tool error: {text}"
+            return f"Tool error: {text}", "tool_error"
 
-        return text or "(no data returned)"
+        return text or "(no data returned)", "ok"
 
     except httpx.TimeoutException:
-        return f"Tool '{tool_name}' timed out after 45 seconds."
+        return f"Tool '{tool_name}' timed out after 45 seconds.", "timeout"
     except Exception as e:
-        return f"Tool '{tool_name}' failed: {str(e)}"
+        return f"Tool '{tool_name}' failed: {str(e)}", "error"
+
+
+async def execute_tool(tool_name: str, arguments: dict[str, Any]) -> ToolResult:
+    """Execute an MCP tool and return its parsed result."""
+    with span("tool", tool=tool_name, cached=False):
+        return await _call_tool(tool_name, arguments)
+
+
+async def execute_tool_cached(
+    tool_name: str,
+    arguments: dict[str, Any],
+    tool: dict[str, Any] | None = None,
+) -> tuple[ToolResult, bool]:
+    """
+    Like execute_tool, but serves repeat calls from the tool result cache
+    when the tool is cacheable. Returns (result, from_cache).
+    """
+    with span("tool", tool=tool_name) as attrs:
+        result, from_cache = await tool_result_cache.get_or_call(
+            tool_name,
+            arguments,
+            lambda: _call_tool(tool_name, arguments),
+            tool=tool,
+        )
+        attrs["cached"] = from_cache
+    return result, from_cache
 
 
 async def refresh_tools() -> list[dict]:
     """Force-refresh the tools cache."""
-    global _tools_fetched
-    _tools_fetched = False
-    return await fetch_tools()
+    snapshot = await tool_catalogue.refresh()
+    return snapshot.tools
 
 
 def format_tools_for_prompt(tools: list[dict]) -> str:
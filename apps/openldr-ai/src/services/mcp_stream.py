@@ -0,0 +1,635 @@
+"""
+Incremental, memory-bounded reading of MCP tools/call responses.
+
+A tool can return a result of any size, so its response is never held
+whole. Bytes are read as they arrive, up to a hard cap per call
+(AI_MCP_RESULT_MAX_MB), and the SSE events are split on the fly. The
+JSON-RPC envelope is parsed incrementally, and the text of each content
+block is unescaped chunk by chunk into a RecordCollector.
+
+A payload small enough to pass on verbatim (VERBATIM_CHARS) is passed on
+as it arrived. A bigger one keeps, per list, its first
+AI_MCP_RESULT_KEEP_RECORDS records, up to AI_MCP_RESULT_KEEP_MB of them;
+every further record is decoded only to be counted, then dropped. Every
+record, kept or dropped, also goes into the list's RecordColumns, so the
+statistical summary covers the whole list. What is kept is re-assembled as
+JSON with a {"_truncated_items": n} marker at the end of each list it cut.
+Peak memory per call is a read chunk, the kept records and a few bytes per
+field of every record, whatever the result size.
+
+Parsing is driven by generators that yield whenever they need more input,
+so the same parser code works however the input is chunked. Each record is
+decoded by the C JSON decoder (raw_decode) rather than character by
+character.
+"""
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Generator, Optional
+
+import httpx
+
+from services.record_columns import RecordColumns
+
+# Payloads up to this many characters are passed on exactly as received
+VERBATIM_CHARS = 256 * 1024
+
+# Characters of records kept per list from a bigger payload
+KEEP_CHARS = 4 * 1024 * 1024
+
+# An object deeper than this is kept or dropped as a whole, not walked
+MAX_WALK_DEPTH = 2
+
+_decoder = json.JSONDecoder(strict=False)
+_NON_WS = re.compile(r"[^ \t\n\r]")
+# String content made only of complete characters and escape sequences
+_STRING_RUN = re.compile(r'[^"\\]*(?:(?:\\u[0-9a-fA-F]{4}|\\[^u])[^"\\]*)*')
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}")
+_STRUCTURAL = re.compile(r'[\[\]{}"]')
+
+# Parser generators yield how many more characters they want
+_Parse = Generator[int, None, Any]
+
+
+def _ends_with_high_surrogate(buf: str, start: int, end: int) -> bool:
+    """Whether buf[start:end] (whole escape sequences) ends in a \\uD800-\\uDBFF escape."""
+    if end - start < 6 or not _HIGH_SURROGATE.match(buf, end - 6, end):
+        return False
+    # ...and that backslash starts an escape rather than ending a "\\\\"
+    backslashes = 0
+    i = end - 7
+    while i >= start and buf[i] == "\\":
+        backslashes += 1
+        i -= 1
+    return backslashes % 2 == 0
+
+
+class Malformed(Exception):
+    """The input stopped being the JSON it started out as (or ended early)."""
+
+
+class _IncrementalParser(ABC):
+    """
+    Base for the parsers below: buffers input and resumes the _parse()
+    generator once enough has arrived for it to make progress. The part of
+    the buffer already consumed is dropped every time new input is joined.
+    """
+
+    def __init__(self) -> None:
+        self.buf = ""
+        self.pos = 0
+        self.done = False        # no more input will come
+        self.complete = False    # _parse() returned
+        self.failed = False      # _parse() raised Malformed
+        self.decoded: Any = None # the value _value() consumed last
+        self._pending: list[str] = []
+        self._pending_chars = 0
+        self._want = 0
+        self._parser: Optional[_Parse] = None
+
+    @abstractmethod
+    def _parse(self) -> _Parse:
+        """The parse itself: a generator yielding how many more characters it needs."""
+
+    def feed(self, text: str) -> None:
+        if not text or self.complete or self.failed:
+            return
+        self._pending.append(text)
+        self._pending_chars += len(text)
+        if self._pending_chars >= self._want:
+            self._resume()
+
+    def finish(self) -> None:
+        """End of input: let the parser complete, or fail if it can't."""
+        self.done = True
+        self._resume()
+
+    def _resume(self) -> None:
+        if self._pending:
+            self.buf = self.buf[self.pos:] + "".join(self._pending)
+            self.pos = 0
+            self._pending = []
+            self._pending_chars = 0
+        if self.complete or self.failed:
+            return
+        if self._parser is None:
+            self._parser = self._parse()
+        try:
+            self._want = self._parser.send(None)
+        except StopIteration:
+            self.complete = True
+        except Malformed:
+            self.failed = True
+
+    # ── primitives (generators; `yield from` them) ───────────────────────────
+
+    def _more(self, want: int = 1) -> _Parse:
+        if self.done:
+            raise Malformed("unexpected end of input")
+        yield want
+
+    def _peek(self) -> _Parse:
+        """Skip whitespace and return the next character without consuming it."""
+        while True:
+            match = _NON_WS.search(self.buf, self.pos)
+            if match is not None:
+                self.pos = match.start()
+                return match.group()
+            self.pos = len(self.buf)
+            yield from self._more()
+
+    def _expect(self, char: str) -> _Parse:
+        if (yield from self._peek()) != char:
+            raise Malformed(f"expected {char!r}")
+        self.pos += 1
+
+    def _value(self, keep: bool = True) -> _Parse:
+        """Consume one complete JSON value; returns its source text if `keep`."""
+        yield from self._peek()
+        while True:
+            start = self.pos
+            try:
+                decoded, end = _decoder.raw_decode(self.buf, start)
+            except json.JSONDecodeError:
+                if self.done:
+                    raise Malformed("invalid JSON value")
+                end = None
+            # A value that ends exactly where the input does (a number, say)
+            # may still continue in the next chunk
+            if end is not None and (end < len(self.buf) or self.done):
+                self.pos = end
+                self.decoded = decoded
+                return self.buf[start:end] if keep else None
+            # Wait until the buffered part has doubled, so a value arriving in
+            # many chunks is re-decoded a logarithmic number of times
+            yield from self._more(max(1, len(self.buf) - start))
+
+    def _stream_string(self, sink: Optional["_IncrementalParser"]) -> _Parse:
+        """Consume a JSON string, feeding its unescaped text to sink chunk by chunk."""
+        yield from self._expect('"')
+        while True:
+            end = _STRING_RUN.match(self.buf, self.pos).end()
+            closed = end < len(self.buf) and self.buf[end] == '"'
+            if not closed and _ends_with_high_surrogate(self.buf, self.pos, end):
+                end -= 6  # keep a surrogate pair together
+            if sink is not None and end > self.pos:
+                try:
+                    sink.feed(_decoder.decode('"' + self.buf[self.pos:end] + '"'))
+                except ValueError:
+                    raise Malformed("invalid string escape")
+            self.pos = end
+            if closed:
+                self.pos += 1
+                return
+            yield from self._more()
+
+    def _skip(self, sink: Optional["_IncrementalParser"] = None) -> _Parse:
+        """Consume one value without holding it; its source text goes to sink if given."""
+        char = yield from self._peek()
+        if char not in '[{"':
+            value = yield from self._value(keep=sink is not None)
+            if sink is not None:
+                sink.feed(value)
+            return
+        mark = self.pos
+        depth = 0
+        in_string = False
+        while True:
+            buf = self.buf
+            if in_string:
+                self.pos = _STRING_RUN.match(buf, self.pos).end()
+                if self.pos < len(buf) and buf[self.pos] == '"':
+                    self.pos += 1
+                    in_string = False
+                    if depth == 0:
+                        break
+                    continue
+            else:
+                match = _STRUCTURAL.search(buf, self.pos)
+                if match is not None:
+                    self.pos = match.end()
+                    char = match.group()
+                    if char == '"':
+                        in_string = True
+                        continue
+                    depth += 1 if char in "[{" else -1
+                    if depth == 0:
+                        break
+                    continue
+                self.pos = len(buf)
+            if sink is not None:
+                sink.feed(buf[mark:self.pos])
+            yield from self._more()
+            mark = self.pos
+        if sink is not None:
+            sink.feed(self.buf[mark:self.pos])
+
+    def _each_member(self, handle: Callable[[str], _Parse]) -> _Parse:
+        """Walk an object, calling handle(key) to consume each member's value."""
+        yield from self._expect("{")
+        if (yield from self._peek()) == "}":
+            self.pos += 1
+            return
+        while True:
+            key = yield from self._value()
+            yield from self._expect(":")
+            yield from handle(key)
+            char = yield from self._peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise Malformed("expected ',' or '}'")
+
+    def _each_element(self, handle: Callable[[], _Parse]) -> _Parse:
+        """Walk an array, calling handle() to consume each element."""
+        yield from self._expect("[")
+        if (yield from self._peek()) == "]":
+            self.pos += 1
+            return
+        while True:
+            yield from handle()
+            char = yield from self._peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise Malformed("expected ',' or ']'")
+
+
+# ── tool payloads ────────────────────────────────────────────────────────────
+
+class _Records:
+    """A list: its first records (source text), how many more were dropped, and columns of them all."""
+
+    def __init__(self) -> None:
+        self.kept: list[str] = []
+        self.kept_chars = 0
+        self.dropped = 0
+        self.open = True
+        self.columns = RecordColumns()
+
+
+class _Members:
+    """An object walked member by member: (key source, value) pairs and dropped keys."""
+
+    def __init__(self) -> None:
+        self.items: list[tuple[str, Any]] = []
+        self.dropped = 0
+        self.open = True
+
+
+def _render(node: Any, cut_short: bool) -> str:
+    if isinstance(node, str):
+        return node
+    marker: dict[str, Any] = {}
+    if isinstance(node, _Records):
+        parts = list(node.kept)
+        if node.dropped:
+            marker["_truncated_items"] = node.dropped
+        if cut_short and node.open:
+            marker.update(_truncated_items=node.dropped, _read_limit_reached=True)
+        if marker:
+            parts.append(json.dumps(marker))
+        return "[" + ", ".join(parts) + "]"
+    parts = [f"{key}: {_render(value, cut_short)}" for key, value in node.items]
+    if node.dropped:
+        parts.append(f'"_truncated_keys": {node.dropped}')
+    if cut_short and node.open:
+        parts.append('"_read_limit_reached": true')
+    return "{" + ", ".join(parts) + "}"
+
+
+class RecordCollector(_IncrementalParser):
+    """
+    Receives one tool payload as text, in chunks of any size, and keeps a
+    bounded view of it: the first `verbatim_chars` characters, and - for a
+    JSON array, or an object holding arrays - the first `keep_records`
+    records of every list (at most `keep_chars` of them) plus a count and
+    columns of them all.
+    """
+
+    def __init__(self, keep_records: int, verbatim_chars: int = VERBATIM_CHARS, keep_chars: int = KEEP_CHARS):
+        super().__init__()
+        self.keep_records = max(1, keep_records)
+        self.verbatim_chars = verbatim_chars
+        self.keep_chars = keep_chars
+        self.head: list[str] = []
+        self.head_chars = 0
+        self.total_chars = 0
+        self.root: Any = None
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        self.total_chars += len(text)
+        piece = ""
+        if self.head_chars < self.verbatim_chars:
+            piece = text[: self.verbatim_chars - self.head_chars]
+            self.head.append(piece)
+            self.head_chars += len(piece)
+        if self.total_chars <= self.verbatim_chars:
+            return  # passed on verbatim; nothing to walk
+        if self._parser is None and not self._pending:
+            # Outgrew the verbatim limit: walk it from the start
+            text = "".join(self.head) + text[len(piece):]
+        super().feed(text)
+
+    def finish(self) -> None:
+        if self.total_chars > self.verbatim_chars:
+            super().finish()
+
+    def _parse(self) -> _Parse:
+        char = yield from self._peek()
+        if char == "[":
+            self.root = _Records()
+            yield from self._records(self.root)
+        elif char == "{":
+            self.root = _Members()
+            yield from self._members(self.root, 0)
+        else:
+            raise Malformed("not a JSON array or object")
+
+    def _keeps(self, count: int, chars: int) -> bool:
+        return count < self.keep_records and chars < self.keep_chars
+
+    def _records(self, node: _Records) -> _Parse:
+        def element() -> _Parse:
+            if self._keeps(len(node.kept), node.kept_chars):
+                value = yield from self._value()
+                node.kept.append(value)
+                node.kept_chars += len(value)
+            else:
+                yield from self._value(keep=False)
+                node.dropped += 1
+            node.columns.add(self.decoded)
+
+        yield from self._each_element(element)
+        node.open = False
+
+    def _members(self, node: _Members, depth: int) -> _Parse:
+        def member(key: str) -> _Parse:
+            if not self._keeps(len(node.items), 0):
+                yield from self._skip()
+                node.dropped += 1
+                return
+            char = yield from self._peek()
+            if char == "[":
+                child: Any = _Records()
+                node.items.append((key, child))
+                yield from self._records(child)
+            elif char == "{" and depth + 1 < MAX_WALK_DEPTH:
+                child = _Members()
+                node.items.append((key, child))
+                yield from self._members(child, depth + 1)
+            else:
+                node.items.append((key, (yield from self._value())))
+
+        yield from self._each_member(member)
+        node.open = False
+
+    def record_columns(self, key: Optional[str] = None) -> Optional[RecordColumns]:
+        """
+        Columns of every record of the payload's list - the root list, or
+        the list under `key` in the root object - if the payload was walked.
+        """
+        if self.failed:
+            return None
+        if key is None:
+            return self.root.columns if isinstance(self.root, _Records) else None
+        if isinstance(self.root, _Members):
+            for source, value in self.root.items:
+                if isinstance(value, _Records) and json.loads(source) == key:
+                    return value.columns
+        return None
+
+    def text(self, cut_short: bool = False) -> str:
+        """The payload as passed on: verbatim if small, records and counts if not."""
+        head = "".join(self.head)
+        if not cut_short and self.total_chars <= self.verbatim_chars:
+            return head
+        if self._parser is None and head:
+            # Cut short before it outgrew the verbatim limit: walk what arrived
+            _IncrementalParser.feed(self, head)
+        if self.root is not None and not self.failed and (self.complete or cut_short):
+            return _render(self.root, cut_short)
+        note = f"{self.total_chars - len(head)} more characters omitted"
+        if cut_short:
+            note += ", response cut at the read limit"
+        return f"{head}\n... ({note})"
+
+
+# ── JSON-RPC over SSE ────────────────────────────────────────────────────────
+
+class _ResponseParser(_IncrementalParser):
+    """One JSON-RPC message, with tools/call content text streamed into collectors."""
+
+    def __init__(self, new_collector: Callable[[], RecordCollector]):
+        super().__init__()
+        self._new_collector = new_collector
+        self.has_result = False
+        self.error: Any = None
+        self.is_error = False
+        self.blocks: list[dict[str, Any]] = []
+        self.structured: Optional[RecordCollector] = None
+
+    @property
+    def is_response(self) -> bool:
+        return self.has_result or self.error is not None
+
+    def _parse(self) -> _Parse:
+        def top(key: str) -> _Parse:
+            if key == '"result"' and (yield from self._peek()) == "{":
+                self.has_result = True
+                yield from self._each_member(result_member)
+            elif key == '"error"':
+                self.error = json.loads((yield from self._value()))
+            else:
+                yield from self._skip()
+
+        def result_member(key: str) -> _Parse:
+            if key == '"content"' and (yield from self._peek()) == "[":
+                yield from self._each_element(content_block)
+            elif key == '"structuredContent"':
+                self.structured = self._new_collector()
+                yield from self._skip(self.structured)
+                self.structured.finish()
+            elif key == '"isError"':
+                self.is_error = json.loads((yield from self._value())) is True
+            else:
+                yield from self._skip()
+
+        def content_block() -> _Parse:
+            if (yield from self._peek()) != "{":
+                yield from self._skip()
+                return
+            block: dict[str, Any] = {"type": None, "collector": None}
+            self.blocks.append(block)
+
+            def block_member(key: str) -> _Parse:
+                if key == '"type"':
+                    block["type"] = json.loads((yield from self._value()))
+                elif key == '"text"' and (yield from self._peek()) == '"':
+                    block["collector"] = self._new_collector()
+                    yield from self._stream_string(block["collector"])
+                    block["collector"].finish()
+                else:
+                    yield from self._skip()
+
+            yield from self._each_member(block_member)
+
+        yield from self._each_member(top)
+
+
+class _SSEEvents:
+    """
+    Splits an SSE stream into events. Each event's data is streamed into a
+    fresh parser as it arrives - a data line is never buffered whole - and
+    on_event(parser) is called when the event ends.
+    """
+
+    def __init__(self, new_parser: Callable[[], _IncrementalParser], on_event: Callable[[_IncrementalParser], None]):
+        self._new_parser = new_parser
+        self._on_event = on_event
+        self.parser: Optional[_IncrementalParser] = None
+        self._line = ""             # start of a non-data line
+        self._in_data = False
+        self._strip_space = False   # drop the single space after "data:"
+
+    def feed(self, text: str) -> None:
+        i = 0
+        while i < len(text):
+            newline = text.find("\n", i)
+            end = len(text) if newline < 0 else newline
+            if self._in_data:
+                self._emit(text[i:end])
+            else:
+                line = self._line + text[i:end]
+                if line.startswith("data:"):
+                    if self.parser is None:
+                        self.parser = self._new_parser()
+                    elif self.parser.buf or self.parser._pending:
+                        self.parser.feed("\n")  # data lines of one event join with newlines
+                    self._in_data = True
+                    self._strip_space = True
+                    self._line = ""
+                    self._emit(line[5:])
+                elif newline < 0 and len(line) < 5 and "data:".startswith(line):
+                    self._line = line  # maybe "data:" split across chunks
+                elif newline >= 0:
+                    self._line = ""
+                    if not line.strip("\r"):
+                        self._end_event()
+                else:
+                    self._line = line[:5]  # another field; only its name matters
+            if newline < 0:
+                return
+            self._in_data = False
+            i = newline + 1
+
+    def _emit(self, text: str) -> None:
+        if self._strip_space and text:
+            self._strip_space = False
+            if text[0] == " ":
+                text = text[1:]
+        if text:
+            self.parser.feed(text)
+
+    def _end_event(self) -> None:
+        parser, self.parser = self.parser, None
+        if parser is not None:
+            parser.finish()
+            self._on_event(parser)
+
+    def finish(self) -> None:
+        self._end_event()
+
+
+class ToolResponseReader:
+    """
+    Reads a tools/call response incrementally and returns its result in the
+    usual MCP shape ({"content": [{"type": "text", "text": ...}], "isError":
+    ...}), with every text payload bounded by a RecordCollector.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        keep_records: int,
+        verbatim_chars: int = VERBATIM_CHARS,
+        keep_chars: int = KEEP_CHARS,
+    ):
+        self.max_bytes = max(1, max_bytes)
+        self.keep_records = keep_records
+        self.verbatim_chars = verbatim_chars
+        self.keep_chars = keep_chars
+        self.bytes_read = 0
+        self.cut_short = False
+        self._response: Optional[_ResponseParser] = None
+        self._collector: Optional[RecordCollector] = None
+
+    def _new_collector(self) -> RecordCollector:
+        return RecordCollector(self.keep_records, self.verbatim_chars, self.keep_chars)
+
+    def _new_parser(self) -> _ResponseParser:
+        return _ResponseParser(self._new_collector)
+
+    def _on_event(self, parser: _IncrementalParser) -> None:
+        if self._response is None and isinstance(parser, _ResponseParser) and parser.is_response:
+            self._response = parser
+
+    async def read(self, resp: httpx.Response, method: str = "tools/call") -> dict[str, Any]:
+        is_sse = "text/event-stream" in resp.headers.get("content-type", "")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        if is_sse:
+            stream: Any = _SSEEvents(self._new_parser, self._on_event)
+        else:
+            stream = self._new_parser()
+
+        chunks = resp.aiter_bytes()
+        try:
+            async for chunk in chunks:
+                room = self.max_bytes - self.bytes_read
+                if len(chunk) > room:
+                    chunk, self.cut_short = chunk[:room], True
+                self.bytes_read += len(chunk)
+                stream.feed(decoder.decode(chunk))
+                if self.cut_short or self._response is not None:
+                    break
+            else:
+                stream.feed(decoder.decode(b"", final=True))
+                stream.finish()
+                if not is_sse:
+                    self._on_event(stream)
+        finally:
+            await chunks.aclose()
+
+        response = self._response
+        if response is None and self.cut_short:
+            # The limit was hit inside the response itself
+            response = stream.parser if is_sse else stream
+        if response is None or not self.cut_short and (response.failed or not response.is_response):
+            raise RuntimeError(f"Empty/unparseable response for '{method}' ({self.bytes_read} bytes read)")
+        if response.error is not None:
+            raise RuntimeError(f"MCP error ({method}): {response.error}")
+        return self._result(response)
+
+    def _result(self, response: _ResponseParser) -> dict[str, Any]:
+        collectors = [
+            block["collector"]
+            for block in response.blocks
+            if block["type"] == "text" and block["collector"] is not None
+        ]
+        if not collectors and response.structured is not None:
+            collectors = [response.structured]
+        if len(collectors) == 1:
+            self._collector = collectors[0]
+        content = [{"type": "text", "text": collector.text(self.cut_short)} for collector in collectors]
+        return {"content": content, "isError": response.is_error}
+
+    def record_columns(self, key: Optional[str] = None) -> Optional[RecordColumns]:
+        """Columns of every record of the result's list, for a result made of one payload that was walked."""
+        return self._collector.record_columns(key) if self._collector is not None else None
@@ -0,0 +1,386 @@
+"""
+Prometheus metrics, served as text exposition format on GET /metrics.
+
+A small in-process registry instead of a client library: counters,
+histograms and scrape-time collectors, all keyed by a tuple of label
+values. Everything is recorded from the event loop, so no locks are taken.
+
+Recording is kept off the per-token path: generation metrics are counted
+in local variables while tokens stream and observed once when the stream
+ends. Figures other services already keep (scheduler counters, pool memory)
+are read by collectors when /metrics is scraped rather than duplicated.
+"""
+import asyncio
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+from core.config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PREFIX = "openldr_ai_"
+
+# Bucket upper bounds (+Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200, 500)
+ROUTING_SCORE_BUCKETS = (0.5, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 7.5)
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 .. 64M
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = labelnames
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> list[str]:
+        """Exposition lines for this metric, HELP and TYPE first."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        # Buckets are stored non-cumulatively and summed up at scrape time
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(float(total))}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Collected(_Metric):
+    """A gauge or counter whose samples are read from elsewhere when /metrics is scraped."""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        kind: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(float(value))}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def collected(
+        self,
+        name: str,
+        help_text: str,
+        kind: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+    ) -> Collected:
+        return self.register(Collected(name, help_text, kind, labelnames, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # One broken collector must not take the whole scrape down
+                print(f"[metrics] Failed to render {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# ── generation ────────────────────────────────────────────────────────────────
+
+ttft_seconds = registry.histogram(
+    "generation_time_to_first_token_seconds",
+    "Time from the start of a streamed generation (prompt fit and eval included) to its first token.",
+    ("model",),
+)
+decode_tokens_per_second = registry.histogram(
+    "generation_decode_tokens_per_second",
+    "Decode rate of a streamed generation, first token excluded.",
+    ("model",),
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+prompt_tokens_total = registry.counter(
+    "generation_prompt_tokens_total",
+    "Prompt tokens sent for evaluation, after context fitting.",
+    ("model",),
+)
+completion_tokens_total = registry.counter(
+    "generation_completion_tokens_total",
+    "Tokens generated.",
+    ("model",),
+)
+generations_total = registry.counter(
+    "generations_total",
+    "Generations by mode (stream, complete) and outcome (ok, stopped by the consumer, error).",
+    ("model", "mode", "outcome"),
+)
+
+
+def record_generation(
+    model_id: str,
+    mode: str,
+    outcome: str,
+    prompt_tokens: Optional[int],
+    completion_tokens: int,
+    started: float,
+    first_token_at: Optional[float] = None,
+    finished: Optional[float] = None,
+) -> None:
+    """Record one finished generation; times are time.perf_counter() values."""
+    generations_total.inc(model_id, mode, outcome)
+    if prompt_tokens:
+        prompt_tokens_total.inc(model_id, amount=prompt_tokens)
+    if completion_tokens:
+        completion_tokens_total.inc(model_id, amount=completion_tokens)
+    if first_token_at is None:
+        return
+    ttft_seconds.observe(first_token_at - started, model_id)
+    decode_seconds = (finished or time.perf_counter()) - first_token_at
+    if completion_tokens > 1 and decode_seconds > 0:
+        decode_tokens_per_second.observe((completion_tokens - 1) / decode_seconds, model_id)
+
+
+# ── routing ───────────────────────────────────────────────────────────────────
+
+routing_decisions_total = registry.counter(
+    "routing_decisions_total",
+    "Agent requests by route: deterministic (selector called the tool) or model (left to the model).",
+    ("route",),
+)
+routing_confidence = registry.histogram(
+    "routing_confidence",
+    "Tool selector confidence (best BM25 score) per route.",
+    ("route",),
+    buckets=ROUTING_SCORE_BUCKETS,
+)
+
+
+def record_routing(route: str, confidence: float) -> None:
+    routing_decisions_total.inc(route)
+    routing_confidence.observe(confidence, route)
+
+
+# ── MCP ───────────────────────────────────────────────────────────────────────
+
+mcp_handshake_seconds = registry.histogram(
+    "mcp_handshake_seconds",
+    "Duration of MCP session initialize handshakes.",
+    ("outcome",),
+)
+mcp_tool_call_seconds = registry.histogram(
+    "mcp_tool_call_seconds",
+    "MCP tools/call latency (cache hits excluded); tools missing from the catalogue count as unknown.",
+    ("tool",),
+)
+mcp_tool_calls_total = registry.counter(
+    "mcp_tool_calls_total",
+    "MCP tools/call requests by tool and outcome (ok, tool_error, timeout, error).",
+    ("tool", "outcome"),
+)
+
+
+# ── result compactor ─────────────────────────────────────────────────────────
+
+compactor_input_chars = registry.histogram(
+    "compactor_input_chars",
+    "Characters in tool results handed to the compactor.",
+    buckets=SIZE_BUCKETS,
+)
+compactor_output_chars = registry.histogram(
+    "compactor_output_chars",
+    "Characters in compacted tool results placed in prompts.",
+    buckets=SIZE_BUCKETS,
+)
+
+
+# ── event loop and scheduler ─────────────────────────────────────────────────
+
+event_loop_lag_seconds = registry.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke a periodic timer; high values mean blocking work on the loop.",
+    buckets=LOOP_LAG_BUCKETS,
+)
+scheduler_wait_seconds = registry.histogram(
+    "scheduler_wait_seconds",
+    "Time a request waited in the scheduler queue for an inference slot.",
+    ("lane",),
+)
+
+
+async def monitor_event_loop(interval: float) -> None:
+    """Sleep `interval` seconds at a time and record how much later than that the loop woke up."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
+
+
+def start_event_loop_monitor() -> Optional[asyncio.Task]:
+    interval = settings.AI_EVENT_LOOP_LAG_INTERVAL_SECONDS
+    if interval <= 0:
+        return None
+    return asyncio.create_task(monitor_event_loop(interval))
+
+
+def _scheduler_samples(key: str):
+    from services.scheduler import scheduler
+
+    snapshot = scheduler.snapshot()
+    if key == "queued":
+        return [((lane,), n) for lane, n in snapshot["queued"].items()]
+    if key == "requests":
+        return [((k,), snapshot[k]) for k in ("admitted", "rejected", "timed_out", "completed")]
+    return [((), snapshot[key])]
+
+
+def _answer_cache_samples():
+    from services.answer_cache import answer_cache
+
+    stats = answer_cache.stats()
+    return [(("hit",), stats["hits"]), (("miss",), stats["misses"])]
+
+
+def _pool_samples(key: str):
+    from services.model_pool import model_pool
+
+    if key == "memory":
+        return [((model_id,), n) for model_id, n in model_pool.memory_by_model().items()]
+    return [((), model_pool.budget_bytes)]
+
+
+registry.collected(
+    "scheduler_active", "Generations holding an inference slot.", "gauge", (),
+    lambda: _scheduler_samples("active"),
+)
+registry.collected(
+    "scheduler_queued", "Requests waiting for an inference slot, per lane.", "gauge", ("lane",),
+    lambda: _scheduler_samples("queued"),
+)
+registry.collected(
+    "scheduler_requests_total", "Scheduler admissions by result.", "counter", ("result",),
+    lambda: _scheduler_samples("requests"),
+)
+registry.collected(
+    "answer_cache_lookups_total", "Deterministic-route answer cache lookups by result.", "counter",
+    ("result",), _answer_cache_samples,
+)
+registry.collected(
+    "model_memory_bytes", "Estimated memory (weights, KV cache, draft model) per resident model.", "gauge",
+    ("model",), lambda: _pool_samples("memory"),
+)
+registry.collected(
+    "model_pool_budget_bytes", "Memory budget of the resident model pool.", "gauge", (),
+    lambda: _pool_samples("budget"),
+)
+
+
+def render() -> str:
+    return registry.render()
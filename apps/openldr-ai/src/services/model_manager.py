@@ -6,6 +6,7 @@ ModelManager handles:
 """
 import os
 import threading
+from dataclasses import asdict
 from pathlib import Path
 from typing import Optional
 
@@ -13,7 +14,31 @@ from huggingface_hub import hf_hub_download
 from huggingface_hub.utils import HfHubHTTPError
 
 from core.config import settings
-from core.state import download_state, loaded_model
+from core.state import download_state, tune_state
+from services.batch_engine import BatchEngine
+from services.chat_template import load_vocab
+from services.context_budget import ContextBudget
+from services.inference_executor import InferenceExecutor
+from services.llama_server_backend import LlamaServerBackend
+from services.model_pool import GgufInfo, ResidentModel, estimate_kv_bytes, model_pool, read_gguf_info
+from services.model_tuner import TuneGrid, TuneProfile, delete_profile, load_profile, read_report, tune_model
+from services.prefix_cache import PrefixStateCache
+from services.semantic_router import semantic_router
+from services.speculative import (
+    SPECULATIVE_MODES,
+    SpeculativeConfig,
+    build_speculative_decoder,
+    logits_buffer_bytes,
+    release_score_buffer,
+)
+from services.worker_pool import WorkerPool
+
+# Context window and prompt batch size a model is loaded with until it is tuned
+DEFAULT_N_CTX = 4096
+DEFAULT_N_BATCH = 512
+
+# One load at a time, so two loads can't both claim the same free memory
+_load_lock = threading.Lock()
 
 
 def _get_model_local_path(model_id: str) -> Path:
@@ -163,12 +188,14 @@ def start_download(model_id: str, filename: str) -> bool:
     return True
 
 
-def load_model(model_id: str, filename: str | None = None) -> tuple[bool, Optional[str]]:
-    """
-    Loads a GGUF model into memory via llama-cpp-python.
-    Returns (success, error_message).
-    The model must already be downloaded.
-    """
+def _threads_per_worker(workers: int) -> int:
+    if settings.AI_INFERENCE_THREADS_PER_WORKER > 0:
+        return settings.AI_INFERENCE_THREADS_PER_WORKER
+    return max(1, (os.cpu_count() or 4) // workers)
+
+
+def _resolve_gguf_path(model_id: str, filename: str | None = None) -> Optional[Path]:
+    """The downloaded GGUF for model_id (the first one if no filename), or None."""
     local_dir = Path(settings.AI_MODELS_DIR) / "downloads" / model_id.replace("/", "--")
     if filename:
         gguf_path = local_dir / filename
@@ -176,33 +203,331 @@ def load_model(model_id: str, filename: str | None = None) -> tuple[bool, Option
         # Find the first .gguf file in the model directory
         gguf_files = [f for f in local_dir.iterdir() if f.suffix == ".gguf"] if local_dir.exists() else []
         if not gguf_files:
-            return False, "Model not downloaded yet"
+            return None
         gguf_path = gguf_files[0]
 
     if not gguf_path.exists() or os.path.getsize(gguf_path) == 0:
+        return None
+    return gguf_path
+
+
+def _default_profile() -> TuneProfile:
+    return TuneProfile(n_threads=os.cpu_count() or 4, n_batch=DEFAULT_N_BATCH, n_ctx=DEFAULT_N_CTX)
+
+
+def _speculative_config(
+    mode: str,
+    draft_model_id: str,
+    info: GgufInfo,
+    profile: TuneProfile,
+) -> tuple[Optional[SpeculativeConfig], int]:
+    """
+    Resolve the speculative decoding setup for a model about to be loaded.
+    Returns the config (None when off) and the extra memory each Llama
+    instance needs for it: the logits output buffer plus the draft model's KV cache.
+    Draft weights are mmapped and shared, so they aren't included.
+    """
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"Unknown speculative mode '{mode}' (expected one of {', '.join(SPECULATIVE_MODES)})")
+    if mode == "off":
+        return None, 0
+    if info.recurrent:
+        print("[model-manager] Recurrent/hybrid models can't discard rejected drafts; speculative decoding is off")
+        return None, 0
+
+    config = SpeculativeConfig(
+        mode=mode,
+        num_pred_tokens=max(1, settings.AI_SPECULATIVE_NUM_PRED_TOKENS),
+        ngram_size=max(1, settings.AI_SPECULATIVE_NGRAM_SIZE),
+    )
+    extra_bytes = logits_buffer_bytes(profile.n_batch, info.n_vocab)
+
+    if mode == "draft":
+        if not draft_model_id:
+            raise ValueError("Speculative mode 'draft' needs a draft model (AI_SPECULATIVE_DRAFT_MODEL)")
+        draft_path = _resolve_gguf_path(draft_model_id)
+        if draft_path is None:
+            raise ValueError(f"Draft model {draft_model_id} not downloaded yet")
+        draft_info = read_gguf_info(draft_path)
+        if draft_info.n_vocab != info.n_vocab:
+            raise ValueError(
+                f"Draft model {draft_model_id} has a different vocabulary "
+                f"({draft_info.n_vocab} tokens, model has {info.n_vocab})"
+            )
+        config.draft_model_path = str(draft_path)
+        extra_bytes += estimate_kv_bytes(draft_info.metadata, profile.n_ctx)
+
+    return config, extra_bytes
+
+
+def _register_server_model(model_id: str, filename: str | None, make_default: bool) -> tuple[bool, Optional[str]]:
+    """
+    AI_INFERENCE_BACKEND=server: the model lives in a llama_cpp.server
+    process, so nothing is loaded here and it takes no room in the pool.
+    """
+    with _load_lock:
+        if model_pool.peek(model_id) is None:
+            # Budget prompts with the GGUF's tokenizer when we have a copy of it
+            gguf_path = _resolve_gguf_path(model_id, filename)
+            budget = None
+            if gguf_path is not None:
+                try:
+                    budget = ContextBudget(load_vocab(gguf_path), DEFAULT_N_CTX, owns_tokenizer=True)
+                except Exception as e:
+                    print(f"[model-manager] No tokenizer for {model_id}, prompts won't be budgeted: {e}")
+            model_pool.add(
+                ResidentModel(
+                    model_id=model_id,
+                    filename=filename,
+                    llm=None,
+                    executor=LlamaServerBackend(settings.AI_LLAMA_SERVER_URL, model=model_id),
+                    prefix_cache=None,
+                    n_ctx=DEFAULT_N_CTX,
+                    weights_bytes=0,
+                    kv_bytes=0,
+                    budget=budget,
+                ),
+                make_default=make_default,
+            )
+        elif make_default:
+            model_pool.default_model_id = model_id
+    return True, None
+
+
+def load_model(
+    model_id: str,
+    filename: str | None = None,
+    make_default: bool = True,
+    speculative: str | None = None,
+    draft_model: str | None = None,
+) -> tuple[bool, Optional[str]]:
+    """
+    Loads a GGUF model into the resident model pool via llama-cpp-python,
+    unloading least-recently-used models first if it wouldn't fit the budget.
+    Depending on AI_INFERENCE_BACKEND the model runs in this process (one
+    sequence at a time, or continuously batched), in a pool of worker
+    processes, or in an external llama_cpp.server.
+    speculative/draft_model override AI_SPECULATIVE_MODE and
+    AI_SPECULATIVE_DRAFT_MODEL for this model (local and workers backends).
+    Settings saved by /models/tune for this GGUF replace the defaults.
+    Returns (success, error_message).
+    The model must already be downloaded (except for the server backend).
+    """
+    if settings.AI_INFERENCE_BACKEND == "server":
+        return _register_server_model(model_id, filename, make_default)
+
+    gguf_path = _resolve_gguf_path(model_id, filename)
+    if gguf_path is None:
         return False, "Model not downloaded yet"
 
+    mode = (speculative or settings.AI_SPECULATIVE_MODE or "off").lower()
+    if settings.AI_INFERENCE_BACKEND == "batch" and mode != "off":
+        print("[model-manager] Speculative decoding isn't supported by the batch backend; loading without it")
+        mode = "off"
+
+    with _load_lock:
+        resident = model_pool.peek(model_id)
+        if (
+            resident is not None
+            and resident.filename in (None, filename, gguf_path.name)
+            and (speculative is None or resident.speculative == mode)
+        ):
+            if make_default:
+                model_pool.default_model_id = model_id
+            return True, None
+
+        try:
+            info = read_gguf_info(gguf_path)
+            tuned = load_profile(gguf_path)
+            profile = tuned or _default_profile()
+            weights_bytes = os.path.getsize(gguf_path)
+            kv_bytes = estimate_kv_bytes(info.metadata, profile.n_ctx, profile.kv_bytes_per_element)
+            prefix_cache_bytes = settings.AI_PREFIX_CACHE_MAX_MB * 1024 * 1024
+            spec_config, speculative_bytes = _speculative_config(
+                mode, draft_model or settings.AI_SPECULATIVE_DRAFT_MODEL, info, profile
+            )
+            mode = spec_config.mode if spec_config else "off"
+            draft_weights_bytes = (
+                os.path.getsize(spec_config.draft_model_path) if spec_config and spec_config.draft_model_path else 0
+            )
+
+            if settings.AI_INFERENCE_BACKEND == "batch":
+                # One context holding a KV region per concurrent sequence. Every
+                # decoding sequence takes a batch position each step, so there
+                # can be no more of them than the batch holds tokens.
+                sequences = max(1, min(settings.AI_BATCH_MAX_SEQUENCES, profile.n_batch))
+                if sequences < settings.AI_BATCH_MAX_SEQUENCES:
+                    print(
+                        f"[model-manager] AI_BATCH_MAX_SEQUENCES={settings.AI_BATCH_MAX_SEQUENCES} "
+                        f"exceeds n_batch={profile.n_batch}; using {sequences} sequences"
+                    )
+                kv_bytes *= sequences
+                model_pool.make_room(
+                    weights_bytes + kv_bytes, replacing=model_id, keep_default=not make_default
+                )
+
+                llm = None
+                prefix_cache = None
+                executor = BatchEngine(
+                    model_path=str(gguf_path),
+                    n_ctx_per_sequence=profile.n_ctx,
+                    n_sequences=sequences,
+                    n_threads=profile.n_threads,
+                    n_batch=profile.n_batch,
+                    name=gguf_path.stem,
+                    # Untuned models keep llama.cpp's own flash attention choice
+                    **({
+                        key: value
+                        for key, value in profile.llama_kwargs().items()
+                        if key in ("use_mmap", "use_mlock", "flash_attn", "type_k", "type_v")
+                    } if tuned else {}),
+                )
+                budget = ContextBudget(executor.template.llm, profile.n_ctx, template=executor.template)
+            elif settings.AI_INFERENCE_BACKEND == "workers":
+                # Weights are mmapped and shared between workers; each has its own KV cache
+                workers = max(1, settings.AI_INFERENCE_WORKERS)
+                kv_bytes *= workers
+                speculative_bytes = speculative_bytes * workers + draft_weights_bytes
+                model_pool.make_room(
+                    weights_bytes + kv_bytes + speculative_bytes, replacing=model_id, keep_default=not make_default
+                )
+
+                llm = None
+                prefix_cache = None
+                executor = WorkerPool(
+                    model_path=str(gguf_path),
+                    n_ctx=profile.n_ctx,
+                    workers=workers,
+                    # Threads stay split between the workers; the profile was timed in one process
+                    threads_per_worker=_threads_per_worker(workers),
+                    prefix_cache_bytes=prefix_cache_bytes,
+                    name=gguf_path.stem,
+                    speculative=spec_config,
+                    llama_kwargs={
+                        key: value
+                        for key, value in profile.llama_kwargs().items()
+                        if key not in ("n_ctx", "n_threads", "n_threads_batch")
+                    },
+                )
+                executor.start()
+                budget = ContextBudget(load_vocab(gguf_path), profile.n_ctx, owns_tokenizer=True)
+            else:
+                from llama_cpp import Llama
+
+                speculative_bytes += draft_weights_bytes
+                model_pool.make_room(
+                    weights_bytes + kv_bytes + speculative_bytes, replacing=model_id, keep_default=not make_default
+                )
+
+                decoder = build_speculative_decoder(spec_config, n_ctx=profile.n_ctx, n_threads=profile.n_threads)
+                llm = Llama(
+                    model_path=str(gguf_path),
+                    n_gpu_layers=0,
+                    draft_model=decoder,
+                    verbose=False,
+                    **profile.llama_kwargs(),
+                )
+                if decoder is not None:
+                    release_score_buffer(llm)
+                prefix_cache = PrefixStateCache(llm, max_bytes=prefix_cache_bytes)
+                executor = InferenceExecutor(llm, name=gguf_path.stem, prefix_cache=prefix_cache)
+                budget = ContextBudget(llm, profile.n_ctx, template=prefix_cache.template)
+
+            model_pool.add(
+                ResidentModel(
+                    model_id=model_id,
+                    filename=gguf_path.name,
+                    llm=llm,
+                    executor=executor,
+                    prefix_cache=prefix_cache,
+                    n_ctx=profile.n_ctx,
+                    weights_bytes=weights_bytes,
+                    kv_bytes=kv_bytes,
+                    speculative=mode,
+                    speculative_bytes=speculative_bytes,
+                    budget=budget,
+                    tune_profile=asdict(tuned) if tuned else None,
+                ),
+                make_default=make_default,
+            )
+
+            return True, None
+
+        except Exception as e:
+            return False, str(e)
+
+
+def load_embedding_model(model_id: str, filename: str | None = None) -> tuple[bool, Optional[str]]:
+    """
+    Load a downloaded GGUF embedding model for the semantic router stage.
+    It lives outside the model pool: it's small and must stay resident.
+    Returns (success, error_message).
+    """
+    gguf_path = _resolve_gguf_path(model_id, filename)
+    if gguf_path is None:
+        return False, "Model not downloaded yet"
     try:
-        from llama_cpp import Llama
-
-        # Unload previous model to free memory
-        if loaded_model:
-            loaded_model.clear()
-
-        llm = Llama(
-            model_path=str(gguf_path),
-            n_ctx=4096,
-            n_threads=os.cpu_count() or 4,
-            n_gpu_layers=0,
-            verbose=False,
-        )
+        semantic_router.load(model_id, gguf_path)
+        return True, None
+    except Exception as e:
+        return False, str(e)
 
-        loaded_model["model_id"] = model_id
-        loaded_model["filename"] = filename
-        loaded_model["model"] = llm
-        loaded_model["tokenizer"] = None
 
-        return True, None
+def _tune_background(model_id: str, gguf_path: Path, grid: TuneGrid) -> None:
+    """Runs in a background thread; progress and results go to tune_state."""
+    state = tune_state[model_id]
 
+    def on_result(result: dict, done: int, total: int) -> None:
+        state["results"].append(result)
+        state.update(done=done, total=total)
+
+    try:
+        report = tune_model(model_id, gguf_path, grid, on_result=on_result)
+        state.update(status="ready", profile=report["profile"])
+        print(f"[model-tuner] Tuned {model_id}: {report['profile']}")
     except Exception as e:
-        return False, str(e)
+        state.update(status="error", error=str(e))
+
+
+def start_tune(model_id: str, filename: str | None, grid: TuneGrid) -> tuple[bool, Optional[str]]:
+    """
+    Starts a background tuning job for a downloaded model.
+    Returns (started, error_message); a job already running counts as not started.
+    """
+    gguf_path = _resolve_gguf_path(model_id, filename)
+    if gguf_path is None:
+        return False, "Model not downloaded yet"
+    if any(job.get("status") == "running" for job in tune_state.values()):
+        # Two jobs would time each other's CPU contention
+        return False, "A tuning job is already running"
+
+    tune_state[model_id] = {
+        "status": "running",
+        "filename": gguf_path.name,
+        "done": 0,
+        "total": len(grid.profiles()),
+        "results": [],
+        "profile": None,
+        "error": None,
+    }
+    threading.Thread(
+        target=_tune_background,
+        args=(model_id, gguf_path, grid),
+        daemon=True,
+        name=f"tune-{model_id}",
+    ).start()
+    return True, None
+
+
+def get_tune_report(model_id: str) -> Optional[dict]:
+    """The saved tuning report for a downloaded model, or None if it was never tuned."""
+    gguf_path = _resolve_gguf_path(model_id)
+    return read_report(gguf_path) if gguf_path else None
+
+
+def delete_tune_profile(model_id: str) -> bool:
+    """Remove a model's tuning profile. Returns False if it had none."""
+    gguf_path = _resolve_gguf_path(model_id)
+    if tune_state.get(model_id, {}).get("status") != "running":
+        tune_state.pop(model_id, None)
+    return gguf_path is not None and delete_profile(gguf_path)
@@ -0,0 +1,237 @@
+"""
+Resident model pool - keeps several GGUF models loaded at once.
+
+Every resident model has its own executor - an InferenceExecutor (worker
+thread), a BatchEngine, a WorkerPool (worker processes) or a
+LlamaServerBackend - and, with the local backend, its own PrefixStateCache.
+The pool is bounded by AI_MODEL_POOL_MAX_MB, counting each model's weights
+plus the KV cache its context size needs (and, with speculative decoding, the
+score buffer and draft model); when a new model doesn't fit,
+least-recently-used models are unloaded first.
+
+One model is the default - the last one loaded through /models/load or
+AI_DEFAULT_MODEL - and serves every request that doesn't pick a model. It is
+never evicted to make room for a model that isn't replacing it as default.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from core.config import settings
+
+# llama.cpp's default KV cache type is f16; tuned profiles may quantise it
+KV_BYTES_PER_ELEMENT = 2
+
+
+@dataclass
+class GgufInfo:
+    metadata: dict[str, str]
+    n_vocab: int
+    # Recurrent/hybrid models can't drop KV entries past a position
+    recurrent: bool
+
+
+def read_gguf_info(gguf_path: Path) -> GgufInfo:
+    """GGUF key/value metadata and vocabulary, read without loading weights or a context."""
+    from llama_cpp import llama_cpp
+    from llama_cpp._internals import LlamaModel
+
+    params = llama_cpp.llama_model_default_params()
+    params.vocab_only = True
+    model = LlamaModel(path_model=str(gguf_path), params=params, verbose=False)
+    try:
+        return GgufInfo(
+            metadata=model.metadata(),
+            n_vocab=model.n_vocab(),
+            recurrent=bool(
+                llama_cpp.llama_model_is_recurrent(model.model) or llama_cpp.llama_model_is_hybrid(model.model)
+            ),
+        )
+    finally:
+        model.close()
+
+
+def estimate_kv_bytes(
+    metadata: dict[str, str],
+    n_ctx: int,
+    bytes_per_element: float = KV_BYTES_PER_ELEMENT,
+) -> int:
+    """KV cache size for n_ctx tokens, from the model's attention geometry."""
+    arch = metadata.get("general.architecture", "")
+
+    def meta_int(key: str, default: int) -> int:
+        try:
+            return int(metadata[f"{arch}.{key}"])
+        except (KeyError, ValueError):
+            # Missing, or a per-layer array we can't use - fall back
+            return default
+
+    n_layer = meta_int("block_count", 0)
+    n_embd = meta_int("embedding_length", 0)
+    n_head = meta_int("attention.head_count", 1) or 1
+    n_head_kv = meta_int("attention.head_count_kv", n_head) or n_head
+    key_length = meta_int("attention.key_length", n_embd // n_head)
+    value_length = meta_int("attention.value_length", key_length)
+    return int(n_layer * n_ctx * n_head_kv * (key_length + value_length) * bytes_per_element)
+
+
+@dataclass
+class ResidentModel:
+    model_id: str
+    filename: Optional[str]
+    llm: Any  # None when the model runs out of process
+    executor: Any
+    prefix_cache: Any
+    n_ctx: int
+    weights_bytes: int
+    kv_bytes: int
+    speculative: str = "off"
+    # Score buffer plus draft model weights and KV cache when speculative decoding is on
+    speculative_bytes: int = 0
+    # ContextBudget fitting prompts into n_ctx; None when there's no local tokenizer
+    budget: Any = None
+    # Settings from a /models/tune profile, None when loaded with the defaults
+    tune_profile: Optional[dict[str, Any]] = None
+    loaded_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    requests: int = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return self.weights_bytes + self.kv_bytes + self.speculative_bytes
+
+    def close(self) -> None:
+        # Frees the weights once in-flight generations on this model finish
+        self.executor.close()
+        if self.budget is not None:
+            self.budget.close()
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            "model_id": self.model_id,
+            "filename": self.filename,
+            "n_ctx": self.n_ctx,
+            "weights_mb": round(self.weights_bytes / 1024 ** 2, 1),
+            "kv_cache_mb": round(self.kv_bytes / 1024 ** 2, 1),
+            "speculative": self.speculative,
+            "speculative_mb": round(self.speculative_bytes / 1024 ** 2, 1),
+            "tune_profile": self.tune_profile,
+            "memory_mb": round(self.memory_bytes / 1024 ** 2, 1),
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "requests": self.requests,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache else None,
+            "context_budget": self.budget.stats() if self.budget else None,
+            "backend": self.executor.stats(),
+        }
+
+
+class ModelPool:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.default_model_id: Optional[str] = None
+        # Least-recently-used first
+        self._models: OrderedDict[str, ResidentModel] = OrderedDict()
+        # Loads run in worker threads while requests read from the event loop
+        self._lock = threading.RLock()
+        self._evictions = 0
+
+    def get(self, model_id: Optional[str] = None) -> Optional[ResidentModel]:
+        """The requested (or default) model, marked as most recently used."""
+        with self._lock:
+            model_id = model_id or self.default_model_id
+            entry = self._models.get(model_id) if model_id else None
+            if entry is not None:
+                self._models.move_to_end(model_id)
+                entry.last_used = time.time()
+                entry.requests += 1
+            return entry
+
+    def peek(self, model_id: str) -> Optional[ResidentModel]:
+        """Look up a resident model without counting it as used."""
+        return self._models.get(model_id)
+
+    def is_resident(self, model_id: str) -> bool:
+        return model_id in self._models
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(m.memory_bytes for m in self._models.values())
+
+    def memory_by_model(self) -> dict[str, int]:
+        with self._lock:
+            return {model_id: m.memory_bytes for model_id, m in self._models.items()}
+
+    def make_room(
+        self, needed_bytes: int, replacing: Optional[str] = None, keep_default: bool = False
+    ) -> list[str]:
+        """
+        Unload `replacing` (if resident) and then LRU models until
+        `needed_bytes` fits the budget. Returns the unloaded model ids.
+
+        With `keep_default` the default model is never unloaded (unless it is
+        `replacing`); MemoryError is raised when the new model doesn't fit
+        beside it.
+        """
+        evicted = []
+        with self._lock:
+            kept = self.default_model_id if keep_default and self.default_model_id != replacing else None
+            if replacing in self._models:
+                self._unload(replacing)
+                evicted.append(replacing)
+            while self.memory_bytes() + needed_bytes > self.budget_bytes:
+                oldest = next((model_id for model_id in self._models if model_id != kept), None)
+                if oldest is None:
+                    break
+                self._unload(oldest)
+                self._evictions += 1
+                evicted.append(oldest)
+            if kept in self._models and self.memory_bytes() + needed_bytes > self.budget_bytes:
+                raise MemoryError(
+                    f"Model needs {needed_bytes / 1024 ** 2:.0f} MB; it doesn't fit the "
+                    f"{self.budget_bytes / 1024 ** 2:.0f} MB budget beside the default model {kept}"
+                )
+        if needed_bytes > self.budget_bytes:
+            print(
+                f"[model-pool] Model needs {needed_bytes / 1024 ** 2:.0f} MB, more than the "
+                f"{self.budget_bytes / 1024 ** 2:.0f} MB budget; loading it on its own"
+            )
+        return evicted
+
+    def add(self, entry: ResidentModel, make_default: bool = True) -> None:
+        with self._lock:
+            self._models[entry.model_id] = entry
+            if make_default or self.default_model_id is None:
+                self.default_model_id = entry.model_id
+
+    def unload(self, model_id: str) -> bool:
+        with self._lock:
+            if model_id not in self._models:
+                return False
+            self._unload(model_id)
+            return True
+
+    def _unload(self, model_id: str) -> None:
+        entry = self._models.pop(model_id)
+        entry.close()
+        print(f"[model-pool] Unloaded {model_id}")
+        if self.default_model_id == model_id:
+            # Fall back to the most recently used model still resident
+            self.default_model_id = next(reversed(self._models), None)
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            used = self.memory_bytes()
+            return {
+                "default_model_id": self.default_model_id,
+                "models": [m.describe() for m in reversed(self._models.values())],
+                "memory_mb": round(used / 1024 ** 2, 1),
+                "budget_mb": round(self.budget_bytes / 1024 ** 2, 1),
+                "evictions": self._evictions,
+            }
+
+
+model_pool = ModelPool(budget_bytes=settings.AI_MODEL_POOL_MAX_MB * 1024 * 1024)
@@ -0,0 +1,270 @@
+"""
+Load-time auto-tuner (POST /models/tune).
+
+The fastest llama.cpp settings depend on the CPU, the quantisation and the
+model's shape, so they are measured rather than guessed. A tuning job loads
+the GGUF once per point of a small grid and times each load:
+
+  n_threads            threads for prompt eval and decode
+  n_batch              prompt tokens per llama_decode call
+  n_ctx                context size; larger is kept when the speed is a tie
+  use_mmap/use_mlock   how the weights are mapped and pinned
+  flash_attn           flash attention on/off
+  kv_cache_type        KV cache precision (quantised V needs flash attention)
+
+Every configuration runs in a fresh spawned process, so each peak RSS is
+its own, and a configuration that crashes llama.cpp only fails itself. The
+process evaluates a synthetic prompt and then decodes token by token. The
+winner is the one that would answer a reference request (REFERENCE_PROMPT_TOKENS
+in, REFERENCE_DECODE_TOKENS out) soonest. It is saved next to the GGUF as
+<file>.tune.json, and load_model applies it from then on.
+"""
+import json
+import multiprocessing
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+PROFILE_SUFFIX = ".tune.json"
+
+# KV cache types: GGML type id and bytes per element
+KV_CACHE_TYPES = {
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+# The request a configuration is scored on
+REFERENCE_PROMPT_TOKENS = 1024
+REFERENCE_DECODE_TOKENS = 256
+
+# Configurations this close to the fastest count as equally fast
+TIE_TOLERANCE = 0.03
+
+_BENCHMARK_TIMEOUT_SECONDS = 600.0
+
+_SYNTHETIC_TEXT = (
+    "Isolate 24-117 from the blood culture grew Klebsiella pneumoniae, resistant to "
+    "ceftriaxone and ciprofloxacin, susceptible to meropenem and amikacin. "
+)
+
+
+@dataclass
+class TuneProfile:
+    n_threads: int
+    n_batch: int
+    n_ctx: int
+    use_mmap: bool = True
+    use_mlock: bool = False
+    flash_attn: bool = False
+    kv_cache_type: str = "f16"
+
+    def llama_kwargs(self) -> dict[str, Any]:
+        """Keyword arguments for Llama()."""
+        type_id = KV_CACHE_TYPES[self.kv_cache_type][0]
+        return {
+            "n_ctx": self.n_ctx,
+            "n_batch": self.n_batch,
+            "n_ubatch": self.n_batch,
+            "n_threads": self.n_threads,
+            "n_threads_batch": self.n_threads,
+            "use_mmap": self.use_mmap,
+            "use_mlock": self.use_mlock,
+            "flash_attn": self.flash_attn,
+            "type_k": type_id,
+            "type_v": type_id,
+        }
+
+    @property
+    def kv_bytes_per_element(self) -> float:
+        return KV_CACHE_TYPES[self.kv_cache_type][1]
+
+
+@dataclass
+class TuneGrid:
+    n_threads: list[int] = field(default_factory=list)  # empty = derived from the core count
+    n_batch: list[int] = field(default_factory=lambda: [128, 512])
+    n_ctx: list[int] = field(default_factory=lambda: [4096])
+    use_mmap: list[bool] = field(default_factory=lambda: [True])
+    use_mlock: list[bool] = field(default_factory=lambda: [False, True])
+    flash_attn: list[bool] = field(default_factory=lambda: [False, True])
+    kv_cache_type: list[str] = field(default_factory=lambda: ["f16", "q8_0"])
+    prompt_tokens: int = 256
+    decode_tokens: int = 32
+
+    def profiles(self) -> list[TuneProfile]:
+        cores = os.cpu_count() or 4
+        threads = self.n_threads or sorted({max(1, cores // 2), max(1, cores - 1), cores})
+        profiles = []
+        for n_threads in threads:
+            for n_batch in self.n_batch:
+                for n_ctx in self.n_ctx:
+                    for use_mmap in self.use_mmap:
+                        for use_mlock in self.use_mlock:
+                            for flash_attn in self.flash_attn:
+                                for kv_cache_type in self.kv_cache_type:
+                                    if kv_cache_type != "f16" and not flash_attn:
+                                        continue  # llama.cpp can't quantise V without flash attention
+                                    profiles.append(TuneProfile(
+                                        n_threads, n_batch, n_ctx, use_mmap, use_mlock, flash_attn, kv_cache_type,
+                                    ))
+        return profiles
+
+
+def profile_path(gguf_path: Path) -> Path:
+    return gguf_path.with_name(gguf_path.name + PROFILE_SUFFIX)
+
+
+def load_profile(gguf_path: Path) -> Optional[TuneProfile]:
+    """The saved profile for this GGUF, or None if it was never tuned (or the file is unreadable)."""
+    path = profile_path(gguf_path)
+    if not path.exists():
+        return None
+    try:
+        profile = TuneProfile(**json.loads(path.read_text())["profile"])
+        profile.llama_kwargs()  # rejects unknown KV cache types
+        return profile
+    except Exception as e:
+        print(f"[model-tuner] Ignoring unreadable tuning profile {path.name}: {e}")
+        return None
+
+
+def read_report(gguf_path: Path) -> Optional[dict[str, Any]]:
+    path = profile_path(gguf_path)
+    try:
+        return json.loads(path.read_text()) if path.exists() else None
+    except (OSError, ValueError):
+        return None
+
+
+def delete_profile(gguf_path: Path) -> bool:
+    path = profile_path(gguf_path)
+    if not path.exists():
+        return False
+    path.unlink()
+    return True
+
+
+# ── benchmark process ──────────────────────────────────────────────────────────
+
+def _benchmark_main(conn, model_path: str, kwargs: dict, prompt_tokens: int, decode_tokens: int) -> None:
+    """Entry point of a benchmark process: load, time prompt eval and decode, report peak RSS."""
+    import resource
+
+    try:
+        from llama_cpp import Llama
+
+        started = time.perf_counter()
+        llm = Llama(model_path=model_path, n_gpu_layers=0, verbose=False, **kwargs)
+        load_seconds = time.perf_counter() - started
+
+        prompt_tokens = min(prompt_tokens, kwargs["n_ctx"] - decode_tokens - 1)
+        text = _SYNTHETIC_TEXT * (prompt_tokens // 16 + 1)
+        tokens = llm.tokenize(text.encode("utf-8"), add_bos=True)[:prompt_tokens]
+
+        # Warm up (page in the weights, build the graphs) before timing
+        llm.eval(tokens[:8])
+        llm.reset()
+
+        started = time.perf_counter()
+        llm.eval(tokens)
+        prompt_seconds = time.perf_counter() - started
+
+        # Decode cost doesn't depend on which token is fed back
+        started = time.perf_counter()
+        for i in range(decode_tokens):
+            llm.eval([tokens[i % len(tokens)]])
+        decode_seconds = time.perf_counter() - started
+
+        conn.send({
+            "load_seconds": round(load_seconds, 3),
+            "prompt_tokens_per_second": round(len(tokens) / prompt_seconds, 2),
+            "decode_tokens_per_second": round(decode_tokens / decode_seconds, 2),
+            # ru_maxrss is in KiB on Linux
+            "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        })
+        llm.close()
+    except Exception as e:
+        conn.send({"error": str(e)})
+
+
+def _run_benchmark(ctx, gguf_path: Path, profile: TuneProfile, grid: TuneGrid) -> dict[str, Any]:
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(
+        target=_benchmark_main,
+        args=(child_conn, str(gguf_path), profile.llama_kwargs(), grid.prompt_tokens, grid.decode_tokens),
+        name=f"tune-{gguf_path.stem}",
+        daemon=True,
+    )
+    process.start()
+    child_conn.close()
+    try:
+        if parent_conn.poll(_BENCHMARK_TIMEOUT_SECONDS):
+            return parent_conn.recv()
+        return {"error": f"timed out after {_BENCHMARK_TIMEOUT_SECONDS:.0f}s"}
+    except EOFError:
+        return {"error": "benchmark process crashed"}
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.kill()
+        parent_conn.close()
+
+
+def _reference_seconds(result: dict[str, Any]) -> float:
+    return (
+        REFERENCE_PROMPT_TOKENS / result["prompt_tokens_per_second"]
+        + REFERENCE_DECODE_TOKENS / result["decode_tokens_per_second"]
+    )
+
+
+def pick_best(results: list[dict[str, Any]]) -> Optional[dict[str, Any]]:
+    """Fastest configuration on the reference request; among ties, the largest context."""
+    measured = [r for r in results if "error" not in r]
+    if not measured:
+        return None
+    fastest = min(r["reference_seconds"] for r in measured)
+    ties = [r for r in measured if r["reference_seconds"] <= fastest * (1 + TIE_TOLERANCE)]
+    return min(ties, key=lambda r: (-r["profile"]["n_ctx"], r["reference_seconds"]))
+
+
+def tune_model(
+    model_id: str,
+    gguf_path: Path,
+    grid: TuneGrid,
+    on_result: Optional[Callable[[dict[str, Any], int, int], None]] = None,
+) -> dict[str, Any]:
+    """
+    Benchmark every configuration of the grid, save the best as the model's
+    profile and return the report. on_result(result, done, total) is called
+    after each configuration.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    profiles = grid.profiles()
+    results = []
+    for profile in profiles:
+        result = {"profile": asdict(profile), **_run_benchmark(ctx, gguf_path, profile, grid)}
+        if "error" not in result:
+            result["reference_seconds"] = round(_reference_seconds(result), 3)
+        results.append(result)
+        if on_result:
+            on_result(result, len(results), len(profiles))
+
+    best = pick_best(results)
+    report = {
+        "model_id": model_id,
+        "filename": gguf_path.name,
+        "tuned_at": time.time(),
+        "cpu_count": os.cpu_count(),
+        "prompt_tokens": grid.prompt_tokens,
+        "decode_tokens": grid.decode_tokens,
+        "profile": best["profile"] if best else None,
+        "results": results,
+    }
+    if best is None:
+        raise RuntimeError(f"Every configuration failed: {results[0]['error'] if results else 'empty grid'}")
+
+    profile_path(gguf_path).write_text(json.dumps(report, indent=2))
+    return report
@@ -0,0 +1,158 @@
+"""
+KV prefix-state cache for the system prompts used by the agentic pipeline.
+
+llama-cpp-python already reuses the longest common token prefix between the
+previous and the next prompt, but the agentic pipeline alternates between
+very different system prompts (the tool-calling SYSTEM_PROMPT_TEMPLATE and
+FINAL_ANSWER_SYSTEM_PROMPT), so that single slot keeps getting thrown away.
+
+This cache keeps several slots: for each distinct system prompt it snapshots
+the evaluated KV state of the rendered prefix and restores it right before
+decoding, so only the conversation tail has to be evaluated. Anything after
+VOLATILE_PROMPT_MARKER (today's date, version) is left out of the prefix, so
+the date rolling over costs a few tail tokens instead of a cold prefix.
+
+All methods must run on the model's inference thread.
+"""
+import ctypes
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from services.chat_template import ChatTemplate
+from services.tool_prompt import VOLATILE_PROMPT_MARKER
+
+# Prefixes shorter than this are cheaper to re-evaluate than to restore
+MIN_PREFIX_TOKENS = 32
+
+
+def _supports_partial_memory(llm: Any) -> bool:
+    """Recurrent/hybrid models keep a rolling state that can't be cut back to a prefix."""
+    try:
+        from llama_cpp import llama_cpp
+
+        return not (
+            llama_cpp.llama_model_is_recurrent(llm.model) or llama_cpp.llama_model_is_hybrid(llm.model)
+        )
+    except Exception:
+        return False
+
+
+@dataclass
+class _PrefixState:
+    tokens: list[int]
+    state: bytes
+
+
+class PrefixStateCache:
+    def __init__(self, llm: Any, max_bytes: int, template: ChatTemplate | None = None):
+        self.llm = llm
+        self.max_bytes = max_bytes
+        self.template = template or ChatTemplate(llm)
+        self.enabled = max_bytes > 0 and self.template.available and _supports_partial_memory(llm)
+        self._entries: OrderedDict[str, _PrefixState] = OrderedDict()
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "skipped": 0}
+
+    # ── prefix extraction ─────────────────────────────────────────────────────
+
+    def _prefix_text(self, system_message: dict) -> str | None:
+        rendered = self.template.render([system_message], add_generation_prompt=False)
+        if not rendered:
+            return None
+        cut = rendered.rfind(VOLATILE_PROMPT_MARKER)
+        return rendered[:cut] if cut > 0 else rendered
+
+    # ── llama state plumbing ──────────────────────────────────────────────────
+
+    def _snapshot(self) -> bytes:
+        ctx = self.llm.ctx
+        from llama_cpp import llama_cpp
+
+        size = llama_cpp.llama_state_seq_get_size(ctx, 0)
+        buffer = (ctypes.c_uint8 * size)()
+        written = llama_cpp.llama_state_seq_get_data(ctx, buffer, size, 0)
+        return bytes(buffer[:written])
+
+    def _restore(self, entry: _PrefixState) -> bool:
+        from llama_cpp import llama_cpp
+
+        self.llm._ctx.kv_cache_clear()
+        buffer = (ctypes.c_uint8 * len(entry.state)).from_buffer_copy(entry.state)
+        if not llama_cpp.llama_state_seq_set_data(self.llm.ctx, buffer, len(entry.state), 0):
+            self.llm.reset()
+            return False
+        n_tokens = len(entry.tokens)
+        self.llm.input_ids[:n_tokens] = entry.tokens
+        self.llm.n_tokens = n_tokens
+        return True
+
+    def _is_resident(self, tokens: list[int]) -> bool:
+        n = len(tokens)
+        return self.llm.n_tokens >= n and self.llm.input_ids[:n].tolist() == tokens
+
+    # ── public API ────────────────────────────────────────────────────────────
+
+    def prepare(self, messages: list[dict], namespace: str = "") -> None:
+        """
+        Make sure the KV cache starts with the evaluated system-prompt prefix
+        of `messages` before create_chat_completion runs. `namespace` is mixed
+        into the key (e.g. the tool-catalogue version).
+        """
+        if not self.enabled or not messages or messages[0].get("role") != "system":
+            return
+
+        prefix_text = self._prefix_text(messages[0])
+        if not prefix_text:
+            self._stats["skipped"] += 1
+            return
+
+        key = hashlib.sha256(f"{namespace}\x00{prefix_text}".encode("utf-8")).hexdigest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            if not self._is_resident(entry.tokens) and not self._restore(entry):
+                self._drop(key)
+            return
+
+        self._stats["misses"] += 1
+        tokens = self.template.tokenize(prefix_text)
+        if len(tokens) < MIN_PREFIX_TOKENS:
+            return
+
+        if not self._is_resident(tokens):
+            self.llm.reset()
+            self.llm.eval(tokens)
+
+        # Drop whatever the last completion left after the prefix
+        if not self.llm._ctx.kv_cache_seq_rm(-1, len(tokens), -1):
+            self.llm.reset()
+            return
+        self.llm.n_tokens = len(tokens)
+
+        state = self._snapshot()
+        if len(state) > self.max_bytes:
+            return
+        self._entries[key] = _PrefixState(tokens=tokens, state=state)
+        self._bytes += len(state)
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= len(entry.state)
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "enabled": self.enabled,
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,264 @@
+"""
+Per-field columns of a record list, built as the records arrive.
+
+The statistical summary of a tool result is computed from these columns.
+The MCP reader fills them while a large response streams in, from every
+record it reads - including the ones it drops - so the summary covers the
+whole list however few records are kept. For a result that arrived whole,
+the compactor fills them from the records it holds.
+
+Each scalar field is stored compactly rather than as Python objects:
+- numbers, 8 bytes each, while every value of the field is a number
+- dates, 4 bytes each (days), while every value is an ISO date string
+- category codes, 4 bytes per record, into a table of distinct labels,
+  until the field has more than MAX_LABELS distinct values
+A field holding objects or lists is not aggregated. Records are taken in
+batches of BATCH_RECORDS, one field at a time.
+"""
+from __future__ import annotations
+
+import re
+import sys
+from array import array
+from datetime import date
+from itertools import chain, repeat
+from typing import Any, Optional
+
+import numpy as np
+
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+# Distinct values tracked per field; past this it only counts as "more than"
+MAX_LABELS = 16384
+
+# Records taken into the columns at a time
+BATCH_RECORDS = 512
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def _day(value: str) -> Optional[int]:
+    """Days since 1970-01-01 for an ISO date (or date-time) string, None otherwise."""
+    if not ISO_DATE_RE.match(value):
+        return None
+    try:
+        return date.fromisoformat(value[:10]).toordinal() - _EPOCH
+    except ValueError:
+        return None
+
+
+class Column:
+    """One record field as arrays: categories as codes into labels, numbers and dates as values."""
+
+    def __init__(self, name: str, kind: str, present: int, distinct_over: int = 0):
+        self.name = name
+        self.kind = kind      # number | date | category
+        self.present = present
+        # For a category with too many values to track: the limit it passed
+        self.distinct_over = distinct_over
+        self.values: np.ndarray = np.empty(0)
+        self.index: np.ndarray = np.empty(0, dtype=np.intp)  # the record each value came from
+        self.labels: np.ndarray = np.empty(0, dtype=str)
+        self.codes: np.ndarray = np.empty(0, dtype=np.intp)  # per record; -1 where missing
+
+    def counts(self, mask: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """(labels, counts) of the records under mask, most frequent first."""
+        codes = self.codes if mask is None else self.codes[mask]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.labels))
+        order = np.argsort(-counts, kind="stable")
+        order = order[counts[order] > 0]
+        return self.labels[order], counts[order]
+
+    @property
+    def identifying(self) -> bool:
+        """Mostly distinct values (ids, names): no use for grouping."""
+        return bool(self.distinct_over) or len(self.labels) * 2 > self.present
+
+
+class _Field:
+    """What one field has held so far; each representation is dropped once a value rules it out."""
+
+    __slots__ = ("present", "index", "numbers", "days", "codes", "labels", "label_days", "nested")
+
+    def __init__(self) -> None:
+        self.present = 0
+        # Record positions of the values, once the field has been missing from
+        # a record; while it is in every record the positions are 0..present
+        self.index: Optional[array] = None
+        self.numbers: Optional[array] = array("d")
+        self.days: Optional[array] = array("i")
+        self.codes: Optional[array] = array("i")    # per record, -1 where missing
+        # Values seen, to their codes; booleans under their JSON spelling
+        self.labels: dict[Any, int] = {}
+        self.label_days: list[Optional[int]] = []   # the day of each label, while days are kept
+        self.nested = False
+
+    def extend(self, base: int, values: list) -> None:
+        """Take in the field's value in each of a run of records starting at position base."""
+        if self.nested:
+            return
+        kinds = set(map(type, values))
+        if dict in kinds or list in kinds:
+            # Nested values don't aggregate
+            self.nested = True
+            self.index = self.numbers = self.days = self.codes = None
+            self.labels = {}
+            self.label_days = []
+            return
+        # Records without the field hold None; an empty string counts as missing too
+        positions: Optional[list[int]] = None
+        if type(None) in kinds or (str in kinds and "" in values):
+            positions = [i for i, value in enumerate(values) if value is not None and value != ""]
+            values = [values[i] for i in positions]
+            kinds = set(map(type, values))
+            if not values:
+                return
+        dense = positions is None and base == self.present and self.index is None
+        self.present += len(values)
+
+        if self.numbers is not None:
+            if kinds <= {int, float}:
+                try:
+                    self.numbers.extend(values)
+                except OverflowError:
+                    self.numbers = None
+            else:
+                self.numbers = None
+        if self.days is not None and kinds != {str}:
+            self.days = None
+            self.label_days = []
+
+        # The codes give, for a date field, the day parsed once per distinct label
+        days = None
+        if self.codes is not None:
+            labels = self.labels
+            keys = values
+            if bool in kinds:
+                keys = [("true" if value else "false") if type(value) is bool else value for value in values]
+            new = [key for key in dict.fromkeys(keys) if key not in labels]
+            if len(labels) + len(new) > MAX_LABELS:
+                self.codes = None
+                self.labels = {}
+                self.label_days = []
+            else:
+                for key in new:
+                    labels[key] = len(labels)
+                codes = list(map(labels.__getitem__, keys))
+                if self.days is not None:
+                    self.label_days.extend(map(_day, new))
+                    label_days = self.label_days
+                    days = [label_days[code] for code in codes]
+                self._extend_codes(base, positions, codes)
+        if self.days is not None:
+            if days is None:
+                days = list(map(_day, values))
+            if None in days:
+                self.days = None
+                self.label_days = []
+            else:
+                self.days.extend(days)
+
+        if (self.numbers is not None or self.days is not None) and not dense:
+            if self.index is None:
+                self.index = array("i", range(self.present - len(values)))
+            self.index.extend(range(base, base + len(values)) if positions is None
+                              else [base + i for i in positions])
+
+    def _extend_codes(self, base: int, positions: Optional[list[int]], codes: list[int]) -> None:
+        if len(self.codes) < base:
+            self.codes.extend(array("i", [-1]) * (base - len(self.codes)))
+        if positions is None:
+            self.codes.extend(codes)
+            return
+        run = [-1] * (positions[-1] + 1)
+        for i, code in zip(positions, codes):
+            run[i] = code
+        self.codes.extend(run)
+
+    def _index(self) -> np.ndarray:
+        if self.index is None:
+            return np.arange(self.present, dtype=np.intp)
+        return np.frombuffer(self.index, dtype=np.int32).astype(np.intp)
+
+    def column(self, name: str, n_records: int) -> Optional[Column]:
+        if self.nested or not self.present:
+            return None
+        if self.numbers is not None:
+            column = Column(name, "number", self.present)
+            column.values = np.frombuffer(self.numbers, dtype=np.float64).copy()
+            column.index = self._index()
+            return column
+        if self.days is not None:
+            column = Column(name, "date", self.present)
+            column.values = np.frombuffer(self.days, dtype=np.int32).astype("datetime64[D]")
+            column.index = self._index()
+            return column
+        if self.codes is None:
+            column = Column(name, "category", self.present, distinct_over=MAX_LABELS)
+            column.codes = np.full(n_records, -1, dtype=np.intp)
+            return column
+        column = Column(name, "category", self.present)
+        # Labels in sorted order, as np.unique gives them
+        labels = [key if type(key) is str else str(key) for key in self.labels]
+        column.labels, remap = np.unique(np.asarray(labels), return_inverse=True)
+        codes = np.full(n_records, -1, dtype=np.intp)
+        codes[: len(self.codes)] = np.frombuffer(self.codes, dtype=np.int32)
+        present = codes >= 0
+        codes[present] = remap[codes[present]]
+        column.codes = codes
+        return column
+
+    def memory_bytes(self) -> int:
+        size = sum(
+            buffer.itemsize * len(buffer)
+            for buffer in (self.index, self.numbers, self.days, self.codes)
+            if buffer is not None
+        )
+        size += sys.getsizeof(self.labels) + sys.getsizeof(self.label_days)
+        return size + sum(sys.getsizeof(label) for label in self.labels)
+
+
+class RecordColumns:
+    """Columns of every record added, fields in order of first appearance."""
+
+    def __init__(self) -> None:
+        self.records = 0
+        self._fields: dict[str, _Field] = {}
+        # Records not yet taken into the columns; they are taken a batch at a
+        # time, one field at a time, which costs far less than value by value
+        self._pending: list[dict] = []
+
+    @classmethod
+    def of(cls, records: list) -> RecordColumns:
+        columns = cls()
+        for record in records:
+            columns.add(record)
+        return columns
+
+    def add(self, record: Any) -> None:
+        """Take in one record; anything but an object is not a record and is ignored."""
+        if type(record) is not dict:
+            return
+        self.records += 1
+        self._pending.append(record)
+        if len(self._pending) >= BATCH_RECORDS:
+            self._flush()
+
+    def _flush(self) -> None:
+        batch, self._pending = self._pending, []
+        base = self.records - len(batch)
+        fields = self._fields
+        for name in dict.fromkeys(chain.from_iterable(batch)):
+            field = fields.get(name)
+            if field is None:
+                field = fields[name] = _Field()
+            field.extend(base, list(map(dict.get, batch, repeat(name))))
+
+    def columns(self) -> list[Column]:
+        self._flush()
+        built = (field.column(name, self.records) for name, field in self._fields.items())
+        return [column for column in built if column is not None]
+
+    def memory_bytes(self) -> int:
+        self._flush()
+        return sum(field.memory_bytes() for field in self._fields.values())
@@ -1,14 +1,69 @@
+"""
+Fits a tool result into the tokens the answer prompt has left.
+
+Record lists, bare or wrapped in an object such as {"count": n, "runs":
+[...]}, are encoded column-wise: a summary line, a header row with the
+column names once, then one delimited row per record. The encoder keeps as
+many rows as fit the budget. When fewer than MIN_TABLE_ROWS would fit, it
+first drops the widest columns. The summary line says how many records
+there are, how many are shown and which columns were left out. Objects and
+plain text are kept as they are if they fit, and otherwise shortened; a
+shortened object keeps its values and only loses deeply nested structure.
+
+When the question asks for counts, breakdowns or trends and there are
+more records than a table would show, a statistical summary replaces the
+rows. It is built from one NumPy array per column (record_columns). For a
+large result these columns were filled by the MCP reader from every record
+it read, not just the records it kept; the header says when the figures
+only cover a sample of the list. The summary gives:
+- counts per group, filtered by any column value the question names
+- min, max and percentiles for numeric and date columns, with counts per
+  period for dates
+- the most common values of categorical columns
+
+Budgets are counted with the model's tokenizer when one is given, and
+estimated from the character count otherwise.
+"""
 from __future__ import annotations
 
 import json
-from typing import Any
+import re
+from typing import Any, Callable, Optional
+
+import numpy as np
 
 from core.config import settings
+from services.metrics import compactor_input_chars, compactor_output_chars
+from services.record_columns import Column, RecordColumns
+from services.tool_result import (
+    COUNT_FIELDS,
+    ENCODING_COLUMNAR,
+    ENCODING_JSON,
+    ENCODING_LINES,
+    ENCODING_SUMMARY,
+    ENCODING_VERBATIM,
+    SHAPE_EMPTY,
+    SHAPE_LIST,
+    SHAPE_RECORDS,
+    CompactView,
+    ToolResult,
+    estimate_tokens,
+)
+from services.tool_router import tokenize_words
+from services.tracing import span
 
 
 MAX_LIST_ITEMS = 8
 MAX_TEXT_LINES = 24
 
+# Smallest budget a result is ever given; below it the context fit drops history instead
+MIN_RESULT_TOKENS = 96
+# Columns are dropped, widest first, before a table shows fewer rows than this
+MIN_TABLE_ROWS = 10
+MAX_CELL_CHARS = 80
+DELIMITER = "|"
+CUT_MARKER = "\n... (cut to fit the context)"
+
 
 def _truncate_text(value: str, max_chars: int) -> str:
     value = value.strip()
@@ -18,8 +73,11 @@ def _truncate_text(value: str, max_chars: int) -> str:
 
 
 def _compact_json_value(value: Any, depth: int = 0) -> Any:
-    if depth > 2:
-        return "[truncated]"
+    # Only structure is cut this deep; values are always kept
+    if depth > 2 and isinstance(value, dict):
+        return f"[{len(value)} keys]"
+    if depth > 2 and isinstance(value, list):
+        return f"[{len(value)} items]"
 
     if isinstance(value, dict):
         compact: dict[str, Any] = {}
@@ -42,38 +100,369 @@ def _compact_json_value(value: Any, depth: int = 0) -> Any:
     return value
 
 
-def compact_tool_result(tool_name: str, result: str) -> str:
-    raw = (result or "").strip()
-    if not raw:
-        return json.dumps({"tool": tool_name, "summary": "No data returned."}, indent=2)
+def compact_tool_result(
+    result: ToolResult,
+    budget_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+    question: str = "",
+) -> CompactView:
+    """
+    The view of `result` that fits budget_tokens (capped at
+    AI_TOOL_RESULT_MAX_TOKENS; None means the cap), summarised if
+    `question` asks for aggregates. The view is kept on the result and
+    reused for the same budget and, for a summary, the same question.
+    """
+    cap = settings.AI_TOOL_RESULT_MAX_TOKENS
+    budget = cap if budget_tokens is None else max(MIN_RESULT_TOKENS, min(budget_tokens, cap))
+    summarise = _should_summarise(result, question)
+    cached = result.view(budget, question if summarise else "")
+    if cached is not None:
+        return cached
+
+    with span("compact", tool=result.tool, shape=result.shape) as attrs:
+        count = count_tokens or estimate_tokens
+        view = _summary(result, question, budget, count) if summarise else _compact(result, budget, count)
+        attrs.update(input_chars=len(result.text), output_chars=len(view.text), **view.summary())
+    compactor_input_chars.observe(len(result.text))
+    compactor_output_chars.observe(len(view.text))
+    result.keep_view(view)
+    return view
 
-    try:
-        parsed = json.loads(raw)
 
-        # Single object — return as-is, never compact
-        if isinstance(parsed, dict):
-            return raw
+def _compact(result: ToolResult, budget: int, count: Callable[[str], int]) -> CompactView:
+    if result.shape == SHAPE_EMPTY:
+        text = json.dumps({"tool": result.tool, "summary": "No data returned."}, indent=2)
+        return CompactView(text, budget, count(text))
 
-        # Array — compact if large
-        if isinstance(parsed, list):
-            if len(parsed) <= 10:
-                return raw
-            compact = {
-                "tool": tool_name,
-                "total": len(parsed),
-                "showing": 10,
-                "results": parsed[:10],
-            }
-            rendered = json.dumps(compact, indent=2, ensure_ascii=False)
-            return _truncate_text(rendered, settings.AI_TOOL_RESULT_CHAR_LIMIT)
+    if result.shape == SHAPE_RECORDS and (result.total_items > 1 or len(result.payload) < result.total_items):
+        return _columnar(result, budget, count)
 
-    except Exception:
-        pass
+    if result.shape == SHAPE_LIST and result.payload:
+        return _columnar(result, budget, count)
+
+    if result.payload is not None:
+        # Single object (or single record) — as-is while it fits
+        tokens = count(result.text)
+        if tokens <= budget:
+            return CompactView(result.text, budget, tokens)
+        text = json.dumps(_compact_json_value(result.payload), ensure_ascii=False, separators=(",", ":"))
+        text, tokens, truncated = _cut(text, budget, count)
+        return CompactView(text, budget, tokens, ENCODING_JSON, truncated=truncated)
 
     # Plain text fallback
-    lines = [line.rstrip() for line in raw.splitlines() if line.strip()]
-    compact_lines = lines[:MAX_TEXT_LINES]
-    text = "\n".join(compact_lines)
+    lines = [line.rstrip() for line in result.text.splitlines() if line.strip()]
+    text = "\n".join(lines[:MAX_TEXT_LINES])
     if len(lines) > MAX_TEXT_LINES:
         text += f"\n... ({len(lines) - MAX_TEXT_LINES} more lines omitted)"
-    return _truncate_text(text, settings.AI_TOOL_RESULT_CHAR_LIMIT)
+    text, tokens, truncated = _cut(text, budget, count)
+    encoding = ENCODING_LINES if len(lines) > MAX_TEXT_LINES or truncated else ENCODING_VERBATIM
+    return CompactView(text, budget, tokens, encoding, truncated=truncated)
+
+
+# ── columnar encoding ─────────────────────────────────────────────────────────
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        text = value
+        if "\n" in text or "\r" in text or "\t" in text:
+            text = " ".join(text.split())
+    else:
+        text = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    if DELIMITER in text:
+        text = text.replace(DELIMITER, "\\" + DELIMITER)
+    return _truncate_text(text, MAX_CELL_CHARS)
+
+
+def _columns(records: list) -> list[str]:
+    """Every key in the records, in order of first appearance."""
+    seen: dict[str, None] = {}
+    for record in records:
+        if isinstance(record, dict):
+            for key in record:
+                if key not in seen:
+                    seen[key] = None
+    return list(seen)
+
+
+def _label(result: ToolResult) -> str:
+    """The tool name, with the scalar fields of a wrapper other than its count."""
+    fields = [
+        f"{key}={_cell(value)}" for key, value in result.envelope.items()
+        if key not in COUNT_FIELDS and not isinstance(value, (dict, list))
+    ]
+    return f"{result.tool} ({', '.join(fields)})" if fields else result.tool
+
+
+def _noun(result: ToolResult) -> str:
+    if result.records_key:
+        return result.records_key
+    return "records" if result.shape == SHAPE_RECORDS else "items"
+
+
+def _summary_line(result: ToolResult, shown: int, dropped: list[str]) -> str:
+    total = result.total_items
+    line = f"# {_label(result)}: {'at least ' if result.total_is_lower_bound else ''}{total} {_noun(result)}"
+    if shown < total:
+        line += f", showing the first {shown}"
+    if dropped:
+        line += f"; columns left out: {', '.join(dropped)}"
+    return line
+
+
+def _columnar(result: ToolResult, budget: int, count: Callable[[str], int]) -> CompactView:
+    # A row costs at least two tokens, so no more than budget / 2 can ever fit
+    items = result.payload[:budget // 2]
+    if result.shape == SHAPE_RECORDS:
+        columns = _columns(items)
+
+        def to_cells(item: Any) -> list[str]:
+            if not isinstance(item, dict):
+                return [""] * len(columns)
+            return [_cell(item.get(c)) for c in columns]
+    else:
+        columns = ["value"]
+
+        def to_cells(item: Any) -> list[str]:
+            return [_cell(item)]
+
+    # Cells are encoded as rows are reached, so a long list costs only what fits
+    cells = [to_cells(item) for item in items[:MIN_TABLE_ROWS]]
+    widths = [sum(len(row[i]) for row in cells) for i in range(len(columns))]
+    target = len(cells)
+    keep = list(range(len(columns)))
+    dropped: list[str] = []
+    while True:
+        header = DELIMITER.join(columns[i] for i in keep)
+        # The summary is sized for the full total, which can only be longer than the final one
+        room = budget - count(_summary_line(result, result.total_items, dropped)) - count(header) - 2
+        lines: list[str] = []
+        for n, item in enumerate(items):
+            if n == len(cells):
+                cells.append(to_cells(item))
+            line = DELIMITER.join(cells[n][i] for i in keep)
+            room -= count(line) + 1  # and its newline
+            if room < 0:
+                break
+            lines.append(line)
+        if len(lines) >= target or len(keep) == 1:
+            break
+        # The first column is usually the identifier; it stays
+        widest = max(keep[1:], key=widths.__getitem__)
+        keep.remove(widest)
+        dropped.append(columns[widest])
+
+    shown = len(lines)
+    text = "\n".join([_summary_line(result, shown, dropped), header, *lines])
+    return CompactView(
+        text,
+        budget,
+        count(text),
+        ENCODING_COLUMNAR,
+        shown_items=shown,
+        columns=[columns[i] for i in keep],
+        dropped_columns=dropped,
+    )
+
+
+# ── statistical summary ───────────────────────────────────────────────────────
+
+# Words that ask for figures about the records rather than the records. Words that
+# also name a field, a view or a page ("summary", "total", "max", "per", "mean")
+# only count in phrases that make them aggregate.
+AGGREGATE_RE = re.compile(
+    r"\b(?:how many|counts?|number of|breakdown|broken down|group(?:ed)? by|distribution|"
+    r"trends?|over time|per (?:day|week|month|year)|most common|top \d+|average|avg|median|"
+    r"minimum|maximum|in total|total (?:number|count)|totals? (?:per|by|for each)|percent(?:age)?|"
+    r"proportion|statistics|stats|summari[sz]e)\b",
+    re.IGNORECASE,
+)
+TREND_RE = re.compile(r"\b(?:trends?|over time|per (?:day|week|month|year)|daily|weekly|monthly)\b", re.IGNORECASE)
+
+SUMMARY_TOP_K = 5
+# Groups listed for a column the question asks about
+SUMMARY_GROUPS = 12
+# Above this many distinct values a column is not used to filter
+MAX_FILTER_VALUES = 64
+MAX_PERIODS = 24
+# Column-name parts too generic to count as the question naming the column
+GENERIC_COLUMN_WORDS = {"id", "code", "at", "name", "date", "type", "value"}
+
+
+def question_wants_aggregates(question: str) -> bool:
+    return bool(question) and AGGREGATE_RE.search(question) is not None
+
+
+def _should_summarise(result: ToolResult, question: str) -> bool:
+    # Up to a table's worth of records, the rows themselves answer a count
+    return (
+        result.shape == SHAPE_RECORDS
+        and result.total_items > MIN_TABLE_ROWS
+        and question_wants_aggregates(question)
+    )
+
+
+def _stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else f"{value:.6g}"
+
+
+def _describe(column: Column, n_records: int) -> str:
+    missing = n_records - column.present
+    suffix = f" ({missing} missing)" if missing else ""
+
+    if column.kind == "number":
+        values = column.values
+        p25, p50, p75 = np.percentile(values, [25, 50, 75])
+        return (
+            f"{column.name}: min {_number(values.min())}, p25 {_number(p25)}, median {_number(p50)}, "
+            f"p75 {_number(p75)}, max {_number(values.max())}, mean {_number(values.mean())}{suffix}"
+        )
+
+    if column.kind == "date":
+        dates = np.sort(column.values)
+        label, per_period = _per_period(dates)
+        return (
+            f"{column.name}: {dates[0]} to {dates[-1]}, median {dates[len(dates) // 2]}{suffix}; "
+            f"per {label}: {per_period}"
+        )
+
+    if column.distinct_over:
+        return f"{column.name}: more than {column.distinct_over} distinct values{suffix}"
+    labels, counts = column.counts()
+    if column.identifying:
+        repeats = "no repeats" if len(labels) == column.present else f"most frequent {labels[0]} ({counts[0]})"
+        return f"{column.name}: {len(labels)} distinct values, {repeats}{suffix}"
+    top = ", ".join(f"{label} {count}" for label, count in zip(labels[:SUMMARY_TOP_K], counts[:SUMMARY_TOP_K]))
+    more = f" (+{len(labels) - SUMMARY_TOP_K} more values)" if len(labels) > SUMMARY_TOP_K else ""
+    return f"{column.name}: {len(labels)} distinct; {top}{more}{suffix}"
+
+
+def _named(column: Column, words: set[str]) -> bool:
+    """True if the question names the column ("facility" for facility_code)."""
+    return bool(({_stem(part) for part in column.name.lower().split("_")} - GENERIC_COLUMN_WORDS) & words)
+
+
+def _per_period(dates: np.ndarray) -> tuple[str, str]:
+    """Counts per day for dates spanning a month at most, per month otherwise: (period, counts)."""
+    if not len(dates):
+        return "day", "none"
+    unit, label = ("D", "day") if (dates.max() - dates.min()).astype(int) <= 31 else ("M", "month")
+    periods, counts = np.unique(dates.astype(f"datetime64[{unit}]"), return_counts=True)
+    if len(periods) > MAX_PERIODS:
+        periods, counts = periods[-MAX_PERIODS:], counts[-MAX_PERIODS:]
+        label = f"{label}, last {MAX_PERIODS}"
+    return label, ", ".join(f"{p} {c}" for p, c in zip(periods.astype(str), counts))
+
+
+def _question_lines(columns: list[Column], question: str, n_records: int) -> tuple[list[str], set[str]]:
+    """
+    Counts for what the question names: records matching any column values
+    it mentions ("failed"), grouped by any column it mentions ("per
+    facility"), and over time for a trend question. Returns the lines and
+    the names of the columns they cover.
+    """
+    words = {_stem(word) for word in tokenize_words(question)}
+    filters: list[tuple[Column, list[str]]] = []
+    mask = np.ones(n_records, dtype=bool)
+    for column in columns:
+        if column.kind != "category" or len(column.labels) > MAX_FILTER_VALUES:
+            continue
+        hits = [i for i, label in enumerate(column.labels) if _stem(label.lower()) in words]
+        if hits:
+            filters.append((column, [str(column.labels[i]) for i in hits]))
+            mask &= np.isin(column.codes, hits)
+
+    filtered = {column.name for column, _ in filters}
+    grouped = [
+        column for column in columns
+        if (column.kind == "date" or (column.kind == "category" and not column.identifying))
+        and column.name not in filtered
+        and _named(column, words)
+    ]
+
+    if TREND_RE.search(question) and not any(column.kind == "date" for column in grouped):
+        grouped += [column for column in columns if column.kind == "date"][:1]
+
+    where = " and ".join(f"{column.name} = {' or '.join(labels)}" for column, labels in filters)
+    lines = []
+    if where:
+        lines.append(f"{where}: {int(mask.sum())} records")
+    for column in grouped[:2]:
+        prefix = f"{where}, by {column.name}" if where else f"by {column.name}"
+        if column.kind == "date":
+            label, per_period = _per_period(column.values[mask[column.index]])
+            lines.append(f"{prefix} (per {label}): {per_period}")
+            continue
+        labels, counts = column.counts(mask)
+        pairs = ", ".join(f"{label} {count}" for label, count in zip(labels[:SUMMARY_GROUPS], counts[:SUMMARY_GROUPS]))
+        more = f" (+{len(labels) - SUMMARY_GROUPS} more)" if len(labels) > SUMMARY_GROUPS else ""
+        lines.append(f"{prefix}: {pairs or 'none'}{more}")
+    named = {column.name for column in columns if column.kind == "number" and _named(column, words)}
+    return lines, filtered | named | {column.name for column in grouped[:2]}
+
+
+def _coverage(result: ToolResult, n: int) -> str:
+    """Which records the statistics cover, saying so plainly when that is a sample."""
+    if n < result.total_items:
+        return f"statistics over a sample of the first {n} only"
+    if result.total_is_lower_bound:
+        return f"statistics over the {n} read before the response was cut off"
+    return "statistics over all of them"
+
+
+def _summary(result: ToolResult, question: str, budget: int, count: Callable[[str], int]) -> CompactView:
+    # Filled from every record read when the result was too big to keep whole
+    record_columns = result.columns if result.columns is not None else RecordColumns.of(result.payload)
+    n = record_columns.records
+    columns = record_columns.columns()
+    asked, covered = _question_lines(columns, question, n)
+    # Columns the question names come first
+    ordered = sorted(columns, key=lambda c: c.name not in covered)
+
+    total = f"{'at least ' if result.total_is_lower_bound else ''}{result.total_items}"
+    header = f"# {_label(result)}: {total} {_noun(result)}; {_coverage(result, n)}"
+    lines = [header, *asked, *(_describe(column, n) for column in ordered)]
+
+    kept: list[str] = []
+    room = budget
+    for line in lines:
+        room -= count(line) + 1
+        if room < 0:
+            break
+        kept.append(line)
+    text = "\n".join(kept)
+    return CompactView(
+        text,
+        budget,
+        count(text),
+        ENCODING_SUMMARY,
+        shown_items=n,
+        columns=[column.name for column in ordered],
+        truncated=len(kept) < len(lines),
+        question=question,
+    )
+
+
+def _cut(text: str, budget: int, count: Callable[[str], int]) -> tuple[str, int, bool]:
+    """Text cut down to the budget: (text, tokens, was cut)."""
+    tokens = count(text)
+    if tokens <= budget:
+        return text, tokens, False
+    chars = len(text) * budget // tokens
+    while chars > 0:
+        cut = text[:chars].rstrip() + CUT_MARKER
+        tokens = count(cut)
+        if tokens <= budget:
+            return cut, tokens, True
+        chars = chars * 9 // 10
+    return CUT_MARKER.strip(), count(CUT_MARKER.strip()), True
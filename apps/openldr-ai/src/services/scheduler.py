@@ -0,0 +1,203 @@
+"""
+Admission-controlled request scheduler for the /chat endpoints.
+
+Sits between the routers and the inference service:
+- at most AI_SCHEDULER_MAX_CONCURRENCY requests run at once
+- up to AI_SCHEDULER_MAX_QUEUE more wait in priority lanes; interactive
+  (streaming) requests are always granted a free slot before bulk ones
+- anything beyond that is rejected straight away with a Retry-After hint,
+  so a burst sheds load instead of pushing everyone's latency into minutes
+
+Runs entirely on the event loop, so no locking is needed.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any
+
+from core.config import settings
+from services.metrics import scheduler_wait_seconds
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+# Priority order - earlier lanes are served first
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+
+class SchedulerRejected(Exception):
+    """Raised when a request cannot be admitted (queue full or waited too long)."""
+
+    def __init__(self, reason: str, retry_after: int, status_code: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status_code = status_code
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Ticket:
+    """One admitted request. Use as `async with ticket:` or acquire()/release()."""
+
+    def __init__(self, scheduler: "RequestScheduler", lane: str):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.started_at: float | None = None
+        self._future: asyncio.Future | None = None
+        self._released = False
+
+    async def acquire(self) -> None:
+        await self.scheduler._acquire(self)
+
+    def release(self) -> None:
+        """Give the slot back. Safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self.scheduler._release(self)
+
+    async def __aenter__(self) -> "Ticket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+
+        self._active = 0
+        self._waiting: dict[str, deque[Ticket]] = {lane: deque() for lane in LANES}
+        self._wait_times: deque[float] = deque(maxlen=256)
+        self._service_times: deque[float] = deque(maxlen=256)
+        self._counters = {"admitted": 0, "rejected": 0, "timed_out": 0, "completed": 0}
+
+    # ── admission ─────────────────────────────────────────────────────────────
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up, for the Retry-After header."""
+        avg_service = (
+            sum(self._service_times) / len(self._service_times) if self._service_times else 5.0
+        )
+        estimate = avg_service * (self.queued() + 1) / self.max_concurrency
+        return int(min(60, max(1, math.ceil(estimate))))
+
+    def admit(self, lane: str = LANE_INTERACTIVE) -> Ticket:
+        """
+        Reserve a place for a request, or raise SchedulerRejected immediately
+        if the wait queue is already full. Never blocks.
+        """
+        if lane not in self._waiting:
+            raise ValueError(f"Unknown scheduler lane: {lane}")
+
+        if self._active >= self.max_concurrency and self.queued() >= self.max_queue:
+            self._counters["rejected"] += 1
+            raise SchedulerRejected(
+                f"Inference queue is full ({self.queued()} waiting).",
+                retry_after=self.retry_after(),
+                status_code=429,
+            )
+
+        self._counters["admitted"] += 1
+        ticket = Ticket(self, lane)
+        if self._active < self.max_concurrency and not self.queued():
+            self._grant(ticket)
+        else:
+            ticket._future = asyncio.get_running_loop().create_future()
+            self._waiting[lane].append(ticket)
+        return ticket
+
+    async def _acquire(self, ticket: Ticket) -> None:
+        if ticket.started_at is not None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket._future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(ticket)
+            self._counters["timed_out"] += 1
+            raise SchedulerRejected(
+                f"Timed out after {self.queue_timeout:.0f}s waiting for an inference slot.",
+                retry_after=self.retry_after(),
+                status_code=503,
+            )
+        except asyncio.CancelledError:
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket: Ticket) -> None:
+        if ticket.started_at is not None:
+            ticket.release()
+            return
+        ticket._released = True
+        try:
+            self._waiting[ticket.lane].remove(ticket)
+        except ValueError:
+            pass
+
+    def _grant(self, ticket: Ticket) -> None:
+        self._active += 1
+        ticket.started_at = time.monotonic()
+        self._wait_times.append(ticket.started_at - ticket.enqueued_at)
+        scheduler_wait_seconds.observe(ticket.started_at - ticket.enqueued_at, ticket.lane)
+        if ticket._future and not ticket._future.done():
+            ticket._future.set_result(None)
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket.started_at is None:
+            self._abandon(ticket)
+            return
+
+        self._active -= 1
+        self._counters["completed"] += 1
+        self._service_times.append(time.monotonic() - ticket.started_at)
+
+        for lane in LANES:
+            queue = self._waiting[lane]
+            if queue and self._active < self.max_concurrency:
+                self._grant(queue.popleft())
+                break
+
+    # ── stats ─────────────────────────────────────────────────────────────────
+
+    def snapshot(self) -> dict[str, Any]:
+        """Live queue depth and wait-time figures."""
+        now = time.monotonic()
+        waits_ms = [w * 1000 for w in self._wait_times]
+        oldest = [q[0].enqueued_at for q in self._waiting.values() if q]
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "queue_capacity": self.max_queue,
+            "queued": {lane: len(q) for lane, q in self._waiting.items()},
+            "oldest_wait_ms": round((now - min(oldest)) * 1000, 1) if oldest else 0.0,
+            "wait_ms": {
+                "p50": round(_percentile(waits_ms, 50), 1),
+                "p95": round(_percentile(waits_ms, 95), 1),
+                "max": round(max(waits_ms), 1) if waits_ms else 0.0,
+            },
+            "retry_after_s": self.retry_after(),
+            **self._counters,
+        }
+
+
+scheduler = RequestScheduler(
+    max_concurrency=settings.AI_SCHEDULER_MAX_CONCURRENCY,
+    max_queue=settings.AI_SCHEDULER_MAX_QUEUE,
+    queue_timeout=settings.AI_SCHEDULER_QUEUE_TIMEOUT_SECONDS,
+)
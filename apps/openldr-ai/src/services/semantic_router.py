@@ -0,0 +1,183 @@
+"""
+Semantic stage of the deterministic tool router.
+
+Lexical routing misses paraphrases ("which labs are failing" for a
+run-status tool), and every miss costs a model-driven pass. With
+AI_EMBEDDING_MODEL set, a small GGUF embedding model is loaded through
+llama-cpp (embedding=True) and every tool's name and description is
+embedded once per catalogue, into a row-normalised float32 matrix. A
+question is then one embedding plus one matrix-vector product. Each tool's
+cosine similarity above AI_SEMANTIC_ROUTER_MIN_SIMILARITY is rescaled from
+[min, 1] to [0, AI_SEMANTIC_ROUTER_WEIGHT] and added to its lexical BM25
+score, so a similarity just over the floor adds almost nothing.
+
+Embedding runs on the model's own executor thread, never on the event
+loop. The matrix for a new catalogue is built in the background; until it
+is ready, routing is lexical only.
+"""
+import asyncio
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from core.config import settings
+from services.inference_executor import InferenceExecutor
+from services.tool_router import question_likely_needs_tool
+
+
+def tool_text(tool: dict[str, Any]) -> str:
+    """What gets embedded for a tool: its name in words, then its description."""
+    name = (tool.get("name") or "").replace("_", " ")
+    description = (tool.get("description") or "").strip()
+    return f"{name}: {description}" if description else name
+
+
+def _pooled(embedding: Any) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    if vector.ndim == 2:
+        # A model without a pooling layer returns one vector per token
+        vector = vector.mean(axis=0)
+    return vector
+
+
+def _normalised(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class _ToolMatrix:
+    def __init__(self, tools: list[dict[str, Any]], matrix: np.ndarray, seconds: float):
+        self.tools = tools
+        self.matrix = matrix  # (n_tools, dim), unit rows
+        self.seconds = seconds
+
+
+class SemanticRouter:
+    def __init__(self, weight: float, min_similarity: float):
+        self.weight = weight
+        self.min_similarity = min_similarity
+        self.model_id: Optional[str] = None
+        self._executor: Optional[InferenceExecutor] = None
+        self._current: Optional[_ToolMatrix] = None
+        self._building: Optional[asyncio.Task] = None
+        self._building_for: Optional[list[dict[str, Any]]] = None
+        self._last_error: Optional[str] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def load(self, model_id: str, gguf_path: Path) -> None:
+        """Load the embedding model (blocking; call from a thread or at startup)."""
+        from llama_cpp import Llama
+
+        llm = Llama(
+            model_path=str(gguf_path),
+            embedding=True,
+            n_ctx=512,  # tool descriptions and questions are short
+            n_gpu_layers=0,
+            verbose=False,
+        )
+        self.close()
+        self._executor = InferenceExecutor(llm, name="embedding")
+        self.model_id = model_id
+        print(f"[semantic-router] Loaded embedding model {model_id} ({gguf_path.name})")
+
+    def close(self) -> None:
+        if self._building is not None:
+            self._building.cancel()
+        if self._executor is not None:
+            self._executor.close()
+        self._executor = None
+        self._current = None
+        self._building = None
+        self._building_for = None
+        self.model_id = None
+
+    # ── tool matrix ───────────────────────────────────────────────────────────
+
+    def prepare(self, tools: list[dict[str, Any]]) -> None:
+        """Start embedding this tool list in the background unless it's done or under way."""
+        if not self.enabled or not tools:
+            return
+        if self._current is not None and self._current.tools is tools:
+            return
+        if self._building_for is tools and self._building is not None and not self._building.done():
+            return
+        if self._building is not None:
+            self._building.cancel()
+        self._building_for = tools
+        self._building = asyncio.create_task(self._build(tools))
+
+    async def _build(self, tools: list[dict[str, Any]]) -> None:
+        texts = [tool_text(t) for t in tools]
+        started = time.perf_counter()
+
+        def embed_all(llm: Any) -> np.ndarray:
+            # One at a time: batched embed() needs a context with one sequence per input
+            return np.stack([_pooled(llm.embed(text, truncate=True)) for text in texts])
+
+        try:
+            matrix = _normalised(await self._executor.run(embed_all))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._last_error = str(e)
+            print(f"[semantic-router] Failed to embed {len(tools)} tools: {e}")
+            return
+        self._current = _ToolMatrix(tools, matrix, time.perf_counter() - started)
+        self._last_error = None
+        print(f"[semantic-router] Embedded {len(tools)} tools in {self._current.seconds:.1f}s")
+
+    # ── routing ───────────────────────────────────────────────────────────────
+
+    async def scores(self, user_text: str, tools: list[dict[str, Any]]) -> dict[int, float]:
+        """
+        Semantic score per tool index for the question (see score_similarities).
+        Empty when disabled, for questions the router would not route anyway,
+        and while this catalogue's matrix is still being built.
+        """
+        if not self.enabled or not tools or not question_likely_needs_tool(user_text):
+            return {}
+        current = self._current
+        if current is None or current.tools is not tools:
+            self.prepare(tools)
+            return {}
+
+        try:
+            query = _pooled(await self._executor.run(lambda llm: llm.embed(user_text, truncate=True)))
+        except Exception as e:
+            print(f"[semantic-router] Failed to embed the question: {e}")
+            return {}
+        return self.score_similarities(current.matrix @ _normalised(query))
+
+    def score_similarities(self, similarities: np.ndarray) -> dict[int, float]:
+        """
+        Cosine similarities at or above the minimum, mapped linearly from
+        [min_similarity, 1] onto [0, weight]; lower ones score nothing.
+        """
+        hits = np.flatnonzero(similarities >= self.min_similarity)
+        span = max(1.0 - self.min_similarity, 1e-6)
+        return {int(i): (float(similarities[i]) - self.min_similarity) / span * self.weight for i in hits}
+
+    def status(self) -> dict[str, Any]:
+        current = self._current
+        return {
+            "enabled": self.enabled,
+            "model_id": self.model_id,
+            "tools_embedded": len(current.tools) if current else 0,
+            "dimensions": int(current.matrix.shape[1]) if current else None,
+            "build_seconds": round(current.seconds, 2) if current else None,
+            "building": self._building is not None and not self._building.done(),
+            "weight": self.weight,
+            "min_similarity": self.min_similarity,
+            "last_error": self._last_error,
+        }
+
+
+semantic_router = SemanticRouter(
+    weight=settings.AI_SEMANTIC_ROUTER_WEIGHT,
+    min_similarity=settings.AI_SEMANTIC_ROUTER_MIN_SIMILARITY,
+)
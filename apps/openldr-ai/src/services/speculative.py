@@ -0,0 +1,232 @@
+"""
+Speculative decoding for the local and worker backends (AI_SPECULATIVE_MODE).
+
+Final answers mostly copy tool-result rows into markdown tables, so the next
+few tokens are usually predictable. A drafter proposes them and the model
+checks all of them in a single decode. Every accepted draft token saves one
+full forward pass, and a rejected one costs almost nothing on CPU.
+
+Two drafters are available:
+  prompt_lookup  n-gram matches against the prompt and the answer so far
+                 (llama-cpp-python's LlamaPromptLookupDecoding)
+  draft          greedy continuation from a small GGUF with the same vocabulary
+
+Llama.generate() verifies drafts itself. SpeculativeDecoder only wraps the
+drafter and counts. It can't see which draft tokens were kept, so it infers
+that from how far the sequence moved between two draft calls. A round of d
+draft tokens moves the sequence d + 1 tokens if all of them are accepted, and
+one token if none are.
+
+With a draft model, Llama asks llama.cpp for logits at every position of a
+batch, so the context's output buffer grows to n_batch x n_vocab floats. The
+model pool counts that buffer. Llama also copies every row into an
+n_ctx x n_vocab score array that is only read for logprobs, which we never
+request. release_score_buffer() replaces that array with a single shared
+row. Recurrent and hybrid models can't roll their state back to a rejected
+draft, so speculative decoding is turned off for them.
+"""
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+# Modes accepted by AI_SPECULATIVE_MODE and /models/load
+SPECULATIVE_MODES = ("off", "prompt_lookup", "draft")
+
+# Per-request results kept for /models/loaded
+RECENT_REQUESTS = 20
+
+
+def logits_buffer_bytes(n_batch: int, n_vocab: int) -> int:
+    """Size of llama.cpp's float32 output buffer when every batch position returns logits."""
+    return n_batch * n_vocab * 4
+
+
+def release_score_buffer(llm: Any) -> None:
+    """
+    Point Llama.scores at one zero row repeated n_ctx times, so it no longer
+    takes n_ctx x n_vocab floats. Llama's eval writes logits through
+    reshape(), which copies a view with zero strides, so nothing reaches
+    the row: every score stays zero. Logprobs, and the scores passed to
+    stopping criteria, are unusable after this. The sampler reads logits
+    from the llama context, so sampling is unaffected.
+    """
+    import numpy as np
+
+    row = np.zeros((1, llm.n_vocab()), dtype=np.single)
+    llm.scores = np.lib.stride_tricks.as_strided(
+        row, shape=(llm.n_ctx(), llm.n_vocab()), strides=(0, row.strides[1])
+    )
+
+
+@dataclass
+class SpeculativeConfig:
+    # Plain data so it can be handed to worker processes
+    mode: str
+    num_pred_tokens: int = 10
+    ngram_size: int = 2
+    draft_model_path: Optional[str] = None
+
+
+class DraftModelDecoding:
+    """Drafts by greedy decoding with a small Llama that shares the model's vocabulary."""
+
+    def __init__(self, llm: Any, num_pred_tokens: int):
+        self.llm = llm
+        self.num_pred_tokens = num_pred_tokens
+        self._eos = llm.token_eos()
+
+    def __call__(self, input_ids: Any, /, **kwargs: Any) -> Any:
+        import numpy as np
+
+        draft: list[int] = []
+        # generate() keeps the draft model's KV for the common prefix, so each
+        # call only evaluates the tokens accepted since the previous one
+        tokens = self.llm.generate(input_ids.tolist(), temp=0.0, repeat_penalty=1.0)
+        try:
+            for token in tokens:
+                if token == self._eos:
+                    break
+                draft.append(token)
+                if len(draft) >= self.num_pred_tokens:
+                    break
+        finally:
+            tokens.close()
+        return np.array(draft, dtype=np.intc)
+
+    def close(self) -> None:
+        self.llm.close()
+
+
+class SpeculativeStats:
+    """Acceptance totals plus the most recent requests."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.requests = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.recent: deque = deque(maxlen=RECENT_REQUESTS)
+
+    def record(self, request: dict[str, Any]) -> None:
+        self.requests += 1
+        self.drafted += request["drafted"]
+        self.accepted += request["accepted"]
+        self.recent.append(request)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "requests": self.requests,
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 3) if self.drafted else 0.0,
+            "recent": list(self.recent),
+        }
+
+
+class SpeculativeDecoder:
+    """
+    The draft_model handed to Llama. It forwards to the real drafter and
+    keeps per-request acceptance counts.
+
+    Must be used on the model's inference thread.
+    """
+
+    def __init__(self, mode: str, drafter: Any):
+        self.mode = mode
+        self.drafter = drafter
+        self.stats = SpeculativeStats(mode)
+        self.last_request: Optional[dict[str, Any]] = None
+        self.begin()
+
+    def begin(self) -> None:
+        self._rounds = 0
+        self._drafted = 0
+        self._accepted = 0
+        self._pending = 0
+        self._last_length = 0
+        self._started = time.monotonic()
+
+    def __call__(self, input_ids: Any, /, **kwargs: Any) -> Any:
+        length = len(input_ids)
+        if self._pending:
+            # The sequence moved by the accepted drafts plus one sampled token
+            accepted = min(self._pending, max(0, length - self._last_length - 1))
+            self._rounds += 1
+            self._drafted += self._pending
+            self._accepted += accepted
+
+        draft = self.drafter(input_ids)
+        self._pending = len(draft)
+        self._last_length = length
+        return draft
+
+    def end(self) -> dict[str, Any]:
+        """
+        Close the current request and return its stats. The final round is
+        never verified, so it isn't counted.
+        """
+        request = {
+            "rounds": self._rounds,
+            "drafted": self._drafted,
+            "accepted": self._accepted,
+            "acceptance_rate": round(self._accepted / self._drafted, 3) if self._drafted else 0.0,
+            "seconds": round(time.monotonic() - self._started, 3),
+        }
+        self.stats.record(request)
+        self.last_request = request
+        self.begin()
+        return request
+
+    def track_stream(self, chunks: Iterable[dict]) -> Iterable[dict]:
+        """Pass a streaming completion through and close the request when it ends."""
+        try:
+            yield from chunks
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+            self.end()
+
+    def close(self) -> None:
+        close = getattr(self.drafter, "close", None)
+        if close:
+            close()
+
+
+def build_speculative_decoder(
+    config: Optional[SpeculativeConfig],
+    n_ctx: int,
+    n_threads: int,
+) -> Optional[SpeculativeDecoder]:
+    """Create the drafter for config.mode, or None when speculative decoding is off."""
+    if config is None or config.mode == "off":
+        return None
+
+    if config.mode == "prompt_lookup":
+        from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+        drafter = LlamaPromptLookupDecoding(
+            max_ngram_size=config.ngram_size,
+            num_pred_tokens=config.num_pred_tokens,
+        )
+    elif config.mode == "draft":
+        if not config.draft_model_path:
+            raise ValueError("Speculative mode 'draft' needs a draft model (AI_SPECULATIVE_DRAFT_MODEL)")
+        from llama_cpp import Llama
+
+        draft_llm = Llama(
+            model_path=config.draft_model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_gpu_layers=0,
+            verbose=False,
+        )
+        drafter = DraftModelDecoding(draft_llm, num_pred_tokens=config.num_pred_tokens)
+    else:
+        raise ValueError(f"Unknown speculative mode '{config.mode}' (expected one of {', '.join(SPECULATIVE_MODES)})")
+
+    return SpeculativeDecoder(config.mode, drafter)
+
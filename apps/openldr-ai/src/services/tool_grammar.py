@@ -0,0 +1,143 @@
+"""
+GBNF grammar for the model-driven tool-calling passes.
+
+Small models often ignore the <tool_call> format. They wrap calls in code
+fences, emit bare JSON, misspell argument names or keep talking after the
+call. With AI_CONSTRAINED_TOOL_CALLS the MCP tool catalogue is compiled into
+a grammar that leaves the model exactly two choices:
+
+  <tool_call>{"tool": "<name>", "args": {...}}   args must match that tool's inputSchema
+  a plain answer                                 anything not starting with <tool_call or {"tool"
+
+An optional <think>...</think> block may come first. The grammar ends when
+the call's JSON object closes, so a tool call stops right there instead of
+running on to max_tokens.
+
+Compiling the grammar takes a moment for a large catalogue, so it is built
+once per catalogue version.
+"""
+import copy
+import json
+from typing import Any, Optional
+
+# Grammar rules around the per-tool JSON rules produced by SchemaConverter
+_ENVELOPE = r'''
+root ::= think? (tool-call | answer)
+think ::= "<think>" [^<]* "</think>" [ \t\n]*
+tool-call ::= "<tool_call>" [ \n]? call
+answer ::= [ \t\n]* answer-start
+any-text ::= [^\x00]*
+'''
+
+# How a tool call begins; an answer may start any other way, fences and JSON included
+TOOL_CALL_PREFIXES = ("<tool_call", '{"tool"')
+
+
+def _char_class(chars: str) -> str:
+    return "".join("\\" + c if c in "\\]^-[" else c for c in chars)
+
+
+def _answer_rules(prefixes: tuple[str, ...]) -> str:
+    """
+    Rules for answer-start: non-blank text that doesn't begin with any of
+    the prefixes. GBNF has no lookahead, so this walks the prefixes as a
+    trie; each step either leaves the prefixes or matches one more of
+    their characters, and the last character of a prefix is never matched.
+    """
+    rules: list[str] = []
+    names = iter(range(1, 1000))
+
+    def node(name: str, rests: list[str], first: bool) -> None:
+        slot = len(rules)
+        rules.append("")
+        by_char: dict[str, list[str]] = {}
+        for rest in rests:
+            by_char.setdefault(rest[0], []).append(rest[1:])
+        # The first character is also the first non-blank one
+        excluded = _char_class("".join(by_char)) + (" \\t\\n" if first else "")
+        alternatives = [f"[^{excluded}] any-text"]
+        for char, tails in by_char.items():
+            if any(not tail for tail in tails):
+                continue
+            child = f"answer-{next(names)}"
+            alternatives.append(f"{json.dumps(char)} {child}")
+            node(child, tails, False)
+        body = " | ".join(alternatives)
+        # Past the first character the answer may also just end here
+        rules[slot] = f"{name} ::= {body}" if first else f"{name} ::= ({body})?"
+
+    node("answer-start", list(prefixes), True)
+    return "\n".join(rules)
+
+
+_cache: dict[str, Any] = {"version": None, "grammar": None}
+
+
+def _args_schema(tool: dict) -> dict:
+    """A tool's inputSchema, made safe for SchemaConverter."""
+    schema = tool.get("inputSchema")
+    if not isinstance(schema, dict) or schema.get("type", "object") != "object":
+        return {"type": "object"}
+    schema = copy.deepcopy(schema)
+    schema.pop("$schema", None)
+    # Invented argument names are one of the failure modes this is here to fix
+    if "properties" in schema:
+        schema.setdefault("additionalProperties", False)
+    return schema
+
+
+def build_tool_call_gbnf(tools: list[dict]) -> Optional[str]:
+    """GBNF text for the tool list, or None if there are no tools."""
+    from llama_cpp.llama_grammar import SchemaConverter
+
+    alternatives = []
+    for tool in tools:
+        name = tool.get("name")
+        if not name:
+            continue
+        call = {
+            "type": "object",
+            "properties": {"tool": {"const": name}, "args": _args_schema(tool)},
+            "required": ["tool", "args"],
+        }
+        try:
+            # Fail per tool, so one exotic schema doesn't disable the grammar
+            SchemaConverter(prop_order={}, allow_fetch=False, dotall=False, raw_pattern=False).visit(
+                copy.deepcopy(call), "probe"
+            )
+        except Exception as e:
+            print(f"[tool-grammar] Unsupported inputSchema for {name}, accepting any args: {e}")
+            call["properties"]["args"] = {"type": "object"}
+        alternatives.append(call)
+
+    if not alternatives:
+        return None
+
+    converter = SchemaConverter(
+        prop_order={"tool": 0, "args": 1}, allow_fetch=False, dotall=False, raw_pattern=False
+    )
+    schema = converter.resolve_refs({"oneOf": alternatives}, "tools")
+    converter.visit(schema, "call")
+    return _ENVELOPE.strip() + "\n" + _answer_rules(TOOL_CALL_PREFIXES) + "\n" + converter.format_grammar()
+
+
+def tool_call_grammar(tools: list[dict], version: Any) -> Any:
+    """
+    LlamaGrammar for the current catalogue, rebuilt when the catalogue
+    version changes. None when there are no tools or compiling failed.
+    """
+    if _cache["version"] == version:
+        return _cache["grammar"]
+
+    from llama_cpp.llama_grammar import LlamaGrammar
+
+    grammar = None
+    try:
+        gbnf = build_tool_call_gbnf(tools)
+        if gbnf:
+            grammar = LlamaGrammar.from_string(gbnf, verbose=False)
+    except Exception as e:
+        print(f"[tool-grammar] Failed to build the tool-call grammar, generating unconstrained: {e}")
+    _cache.update(version=version, grammar=grammar)
+    return grammar
+
@@ -5,6 +5,17 @@ import json
 import re
 from typing import Optional
 
+from services.result_compactor import DELIMITER
+from services.tool_result import (
+    ENCODING_COLUMNAR,
+    ENCODING_SUMMARY,
+    SHAPE_FLAT,
+    SHAPE_OBJECT,
+    SHAPE_RECORDS,
+    CompactView,
+    ToolResult,
+)
+
 THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
 
 def strip_thinking(text: str) -> str:
@@ -32,6 +43,10 @@ FINAL_ANSWER_SYSTEM_PROMPT = (
 )
 
 
+# Everything from this line on changes between calls (date, version) and is
+# kept at the very end so the text before it can be reused as a KV prefix.
+VOLATILE_PROMPT_MARKER = "Today: "
+
 SYSTEM_PROMPT_TEMPLATE = """\
 You are an AI assistant embedded in OpenLDR, an open-source Laboratory \
 Information Management System for antimicrobial resistance (AMR) surveillance \
@@ -103,23 +118,9 @@ def build_system_prompt(tools_text: str, version: str = "0.1.0") -> str:
     )
 
 
-# Primary pattern: <tool_call> tags (correct format)
-TOOL_CALL_PATTERN = re.compile(
-    r"<tool_call>\s*(\{.*?\})\s*</tool_call>",
-    re.DOTALL,
-)
-
-# Fallback pattern: ```json blocks (small models often use this despite instructions)
-TOOL_CALL_MARKDOWN_PATTERN = re.compile(
-    r'```(?:json)?\s*(\{[^`]*?[\'"]tool[\'"][^`]*?\})\s*```',
-    re.DOTALL,
-)
-
-# Fallback pattern: bare JSON with "tool" key (no wrapper at all)
-TOOL_CALL_BARE_PATTERN = re.compile(
-    r'(?:^|\n)(\{\s*["\']tool["\']\s*:.*?\})(?:\s*$|\n)',
-    re.DOTALL,
-)
+TOOL_CALL_OPEN = "<tool_call>"
+TOOL_CALL_CLOSE = "</tool_call>"
+CODE_FENCE = "```"
 
 
 def _parse_tool_json(raw_json: str) -> Optional[tuple[str, dict]]:
@@ -143,68 +144,383 @@ def _parse_tool_json(raw_json: str) -> Optional[tuple[str, dict]]:
         if not tool_name:
             return None
         return tool_name, args
-    except json.JSONDecodeError:
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+def _has_tool_key(text: str, start: int) -> bool:
+    """True if text[start:] is `{`, optional whitespace, then a quoted "tool" key."""
+    i = start + 1
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return text[i:i + 6] in ('"tool"', "'tool'")
+
+
+def _object_body(body: str) -> Optional[str]:
+    """`{...}` with surrounding whitespace removed, or None if body isn't one."""
+    body = body.strip()
+    end = body.rfind("}")
+    if not body.startswith("{") or end < 0:
         return None
+    return body[:end + 1]
+
+
+def _tagged_candidates(text: str):
+    """Bodies of <tool_call>...</tool_call> blocks; the last may be unterminated (stop sequence)."""
+    pos = 0
+    while True:
+        start = text.find(TOOL_CALL_OPEN, pos)
+        if start < 0:
+            return
+        body_start = start + len(TOOL_CALL_OPEN)
+        end = text.find(TOOL_CALL_CLOSE, body_start)
+        body = _object_body(text[body_start:end if end >= 0 else len(text)])
+        if body:
+            yield body
+        if end < 0:
+            return
+        pos = end + len(TOOL_CALL_CLOSE)
+
+
+def _fenced_candidates(text: str):
+    """```json {"tool": ...} ``` blocks; the last fence may be unterminated."""
+    pos = 0
+    while True:
+        start = text.find(CODE_FENCE, pos)
+        if start < 0:
+            return
+        body_start = start + len(CODE_FENCE)
+        if text.startswith("json", body_start):
+            body_start += len("json")
+        end = text.find(CODE_FENCE, body_start)
+        body = _object_body(text[body_start:end if end >= 0 else len(text)])
+        if body and _has_tool_key(body, 0):
+            yield body
+        if end < 0:
+            return
+        pos = end + len(CODE_FENCE)
+
+
+def _bare_candidates(text: str):
+    """
+    A line starting with {"tool": ..., up to the first } that ends a line
+    or the text.
+    """
+    content_end = len(text.rstrip())
+    pos = 0
+    while True:
+        if text.startswith("{", pos) and (pos == 0 or text[pos - 1] == "\n"):
+            start = pos
+        else:
+            newline = text.find("\n{", pos)
+            if newline < 0:
+                return
+            start = newline + 1
+        if not _has_tool_key(text, start):
+            pos = start + 1
+            continue
+        end = text.find("}", start)
+        while end >= 0 and end + 1 < content_end and text[end + 1] != "\n":
+            end = text.find("}", end + 1)
+        if end < 0:
+            # No closing brace ends a line - neither can any later candidate's
+            return
+        yield text[start:end + 1]
+        pos = end + 1
 
 
 def extract_tool_call(text: str) -> Optional[tuple[str, dict]]:
     """
     Parse a tool call from model output.
-    Tries three patterns in order of preference:
-    1. <tool_call>{...}</tool_call>  (correct)
+    Tries three forms in order of preference:
+    1. <tool_call>{...}</tool_call>  (correct; the closing tag may be cut off by the stop sequence)
     2. ```json {...} ```             (small model fallback)
     3. bare {...} with "tool" key   (last resort)
+    Every form is found with plain substring scans, so the cost stays linear
+    in the length of the output.
     """
-    # Try primary format first
-    text = strip_thinking(text)  # ← add this
-    match = TOOL_CALL_PATTERN.search(text)
-    if match:
-        result = _parse_tool_json(match.group(1))
-        if result:
-            return result
+    text = strip_thinking(text)
+    for candidates in (_tagged_candidates, _fenced_candidates, _bare_candidates):
+        for raw in candidates(text):
+            result = _parse_tool_json(raw)
+            if result:
+                return result
+    return None
 
-    # Try markdown code block fallback
-    match = TOOL_CALL_MARKDOWN_PATTERN.search(text)
-    if match:
-        result = _parse_tool_json(match.group(1))
-        if result:
-            return result
 
-    # Try bare JSON fallback
-    match = TOOL_CALL_BARE_PATTERN.search(text)
-    if match:
-        result = _parse_tool_json(match.group(1))
-        if result:
-            return result
+class ToolCallDetector:
+    """
+    Classifies streamed model output as a plain answer or a tool call
+    while it is being generated, so answers can be streamed right away.
+
+    Only the opening of the output is ambiguous. A tool call starts with
+    <tool_call>, a code fence around {"tool": ...}, or a bare {"tool": ...}
+    (optionally after a <think> block). Anything else is an answer and is
+    released token by token. Inside an answer only a possible partial
+    "<tool_call>" at the very end is held back, in case a call follows the
+    prose. A tool call is held in full. `complete` turns True once its JSON
+    object has closed, so the caller can stop generating there.
+
+    The answer is cleaned the way strip_tool_call cleans a whole output:
+    <think> blocks and leading blank space are never released, and an
+    answer that opens with a code fence is held until its closing fence.
+    If nothing but blank space follows that fence, the fence is removed.
+
+    feed() returns the text that is safe to show now. finish() releases
+    whatever is still held if the output turns out not to be a call.
+    """
 
-    return None
+    # Give up classifying after this many characters and treat it as an answer
+    MAX_HEAD_CHARS = 48
+
+    def __init__(self):
+        self.text = ""
+        self.complete = False
+        self._mode = "head"  # head | think | fence | answer | tool
+        self._released = 0  # characters of self.text handed out so far
+        self._head_start = 0
+        self._tool_start = -1
+        # Brace scanner over the held tool call
+        self._scan = 0
+        self._depth = 0
+        self._quote: Optional[str] = None
+        self._escape = False
+
+    @property
+    def is_tool_call(self) -> bool:
+        return self._mode == "tool"
+
+    @property
+    def tool_call_text(self) -> Optional[str]:
+        return self.text[self._tool_start:] if self._mode == "tool" else None
+
+    @property
+    def text_before_call(self) -> str:
+        return self.text[:self._tool_start] if self._mode == "tool" else self.text
+
+    def feed(self, token: str) -> str:
+        self.text += token
+        while True:
+            mode = self._mode
+            if mode == "head":
+                self._classify_head()
+            elif mode == "think":
+                end = self.text.find("</think>", self._head_start)
+                if end >= 0:
+                    self._head_start = end + len("</think>")
+                    # The block itself is never shown
+                    self._released = self._head_start
+                    self._mode = "head"
+            elif mode == "fence":
+                self._watch_fence()
+            elif mode == "answer":
+                self._watch_answer()
+            if self._mode == mode:
+                break
+        if self._mode == "tool":
+            self._scan_object()
+        return self._release()
+
+    def finish(self) -> str:
+        """Release everything still held, cleaned of tool-call syntax if it was a failed call."""
+        held = self.text[self._released:]
+        self._released = len(self.text)
+        if self._mode in ("tool", "fence"):
+            return strip_tool_call(held)
+        if self._mode == "think":
+            # Never closed - better the thoughts than nothing at all
+            return self.text[self._head_start:].strip()
+        if self._mode == "head":
+            return held.strip()
+        return held
+
+    # ── classification ────────────────────────────────────────────────────────
+
+    def _classify_head(self) -> None:
+        head_start = self._head_start
+        while head_start < len(self.text) and self.text[head_start].isspace():
+            head_start += 1
+        head = self.text[head_start:]
+        if not head:
+            return
+        verdict = _classify_opening(head)
+        if verdict is None and len(head) > self.MAX_HEAD_CHARS:
+            verdict = "answer"
+        if verdict is None:
+            return
+        if verdict == "think":
+            self._head_start = head_start + len("<think>")
+            self._mode = "think"
+        else:
+            # Blank space ahead of the answer or call is never shown
+            self._released = max(self._released, head_start)
+            if verdict == "tool":
+                self._start_tool(head_start)
+            else:
+                self._mode = "fence" if head.startswith(CODE_FENCE) else "answer"
+
+    def _watch_fence(self) -> None:
+        """Release a fenced answer as-is once anything but blank space follows its closing fence."""
+        close = self.text.find(CODE_FENCE, self._released + len(CODE_FENCE))
+        if close >= 0 and self.text[close + len(CODE_FENCE):].strip():
+            self._mode = "answer"
+
+    def _watch_answer(self) -> None:
+        start = self.text.find(TOOL_CALL_OPEN, self._released)
+        if start >= 0:
+            self._start_tool(start)
+
+    def _start_tool(self, start: int) -> None:
+        self._mode = "tool"
+        self._tool_start = start
+        self._scan = start
+
+    def _scan_object(self) -> None:
+        """Track brace depth through strings, from the first { of the call."""
+        text = self.text
+        i = self._scan
+        if self._depth == 0:
+            brace = text.find("{", i)
+            if brace < 0:
+                self._scan = len(text)
+                return
+            i = brace
+        while i < len(text):
+            char = text[i]
+            i += 1
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+            elif char in "\"'":
+                self._quote = char
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = True
+                    break
+        self._scan = i
+
+    def _release(self) -> str:
+        if self._mode == "answer":
+            end = len(self.text) - _partial_suffix(self.text, TOOL_CALL_OPEN)
+        elif self._mode == "tool":
+            end = self._tool_start
+        else:
+            # head, think and fence hold everything
+            end = self._released
+        if end <= self._released:
+            return ""
+        out = self.text[self._released:end]
+        self._released = end
+        return out
+
+
+def _partial_suffix(text: str, marker: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of marker."""
+    for size in range(min(len(marker) - 1, len(text)), 0, -1):
+        if text.endswith(marker[:size]):
+            return size
+    return 0
+
+
+def _classify_opening(head: str) -> Optional[str]:
+    """'tool', 'think', 'answer', or None while head is still a prefix of something."""
+    for marker, verdict in ((TOOL_CALL_OPEN, "tool"), ("<think>", "think")):
+        if head.startswith(marker):
+            return verdict
+        if marker.startswith(head):
+            return None
 
+    body = head
+    if head.startswith(CODE_FENCE[:len(head)]):
+        if len(head) < len(CODE_FENCE):
+            return None
+        # ```json / ``` then whitespace, then the JSON object
+        body = head[len(CODE_FENCE):]
+        lang = 0
+        while lang < len(body) and body[lang].isalpha():
+            lang += 1
+        if lang == len(body):
+            return None
+        body = body[lang:].lstrip()
+        if not body:
+            return None
 
-def _detect_format_hint(tool_name: str, result: str) -> str:
-    """Detect the shape of tool result data and return a formatting hint."""
-    try:
-        parsed = json.loads(result)
-    except (json.JSONDecodeError, TypeError):
-        return ""
+    if not body.startswith("{"):
+        return "answer"
+    key = body[1:].lstrip()
+    if not key:
+        return None
+    for quote in "\"'":
+        expected = f"{quote}tool{quote}"
+        if key.startswith(expected):
+            return "tool"
+        if expected.startswith(key):
+            return None
+    return "answer"
+
+
+COLUMNAR_HINT = (
+    "The result is in columns: the first line counts the records, the second "
+    f"names the columns, and each line after that is one record with values separated by {DELIMITER}. "
+)
+
+
+SUMMARY_HINT = (
+    "The result is a statistical summary of the records, not the records themselves: "
+    "counts per value, ranges and percentiles. Answer from these figures and do not list records. "
+    "Use a markdown table for counts per value. "
+)
+
+
+def _detect_format_hint(result: ToolResult, view: Optional[CompactView] = None) -> str:
+    """Formatting hint for the result's shape, detected when it was parsed."""
+    if view is not None and view.encoding == ENCODING_SUMMARY:
+        hint = SUMMARY_HINT
+        if view.shown_items < result.total_items:
+            total = f"at least {result.total_items}" if result.total_is_lower_bound else result.total_items
+            hint += f"Mention the figures cover {view.shown_items} of {total} records. "
+        return hint
+
+    if view is not None and view.encoding == ENCODING_COLUMNAR:
+        hint = COLUMNAR_HINT
+        if view.dropped_columns:
+            hint += "Some columns were left out to fit; never guess their values. "
+        if result.shape == SHAPE_RECORDS:
+            hint += (
+                f"Format as a markdown table. Use these columns: {', '.join(view.columns[:8])}. "
+                f"Use `inline code` for IDs and UUIDs. Use **bold** for status values. "
+            )
+        else:
+            hint += "Format as a bullet list. "
+        if view.shown_items < result.total_items:
+            total = f"at least {result.total_items}" if result.total_is_lower_bound else result.total_items
+            hint += f"Mention showing {view.shown_items} of {total} total. "
+        return hint
 
     # Array of records → markdown table
-    if isinstance(parsed, list) and len(parsed) >= 2 and isinstance(parsed[0], dict):
-        cols = list(parsed[0].keys())[:8]
+    if result.shape == SHAPE_RECORDS and result.total_items >= 2:
+        cols = list(result.payload[0].keys())[:8]
         return (
             f"Format as a markdown table. Use these columns: {', '.join(cols)}. "
             f"Use `inline code` for IDs and UUIDs. Use **bold** for status values. "
         )
 
-    # Single dict with nested data → structured list
-    if isinstance(parsed, dict):
-        keys = list(parsed.keys())
-        # Health check style — flat key-value
-        if all(not isinstance(parsed[k], (dict, list)) for k in keys):
-            return (
-                "Format as a bullet list with **bold labels** and values. "
-                "Use a `##` heading. "
-            )
-        # Complex object with nested fields
+    # Health check style — flat key-value
+    if result.shape == SHAPE_FLAT:
+        return (
+            "Format as a bullet list with **bold labels** and values. "
+            "Use a `##` heading. "
+        )
+
+    # Complex object with nested fields
+    if result.shape == SHAPE_OBJECT:
         return (
             "Format as a structured summary with `##` heading. "
             "Use bullet lists for key-value pairs. "
@@ -212,22 +528,19 @@ def _detect_format_hint(tool_name: str, result: str) -> str:
             "For nested arrays, use a markdown table if they contain 2+ items. "
         )
 
-    # Wrapped result with total/showing
-    if isinstance(parsed, dict) and "total" in parsed and "results" in parsed:
-        return (
-            f"Format the {parsed['total']} records as a markdown table. "
-            f"Mention showing {parsed.get('showing', '?')} of {parsed['total']} total. "
-        )
-
     return ""
 
 
-def format_tool_result(tool_name: str, result: str) -> str:
-    """Strict fill-in template - leaves as little room for hallucination as possible."""
-    format_hint = _detect_format_hint(tool_name, result)
+def format_tool_result(result: ToolResult, view: Optional[CompactView] = None) -> str:
+    """
+    Strict fill-in template - leaves as little room for hallucination as possible.
+    Shows `view` (from compact_tool_result) if given, the result as returned otherwise.
+    """
+    format_hint = _detect_format_hint(result, view)
+    body = view.text if view is not None else result.text
     return (
-        f"<tool_result tool=\"{tool_name}\">\n"
-        f"{result}\n"
+        f"<tool_result tool=\"{result.tool}\">\n"
+        f"{body}\n"
         f"</tool_result>\n\n"
         f"INSTRUCTION: Answer using ONLY the data in the tool_result above.\n"
         f"{format_hint}"
@@ -239,10 +552,27 @@ def format_tool_result(tool_name: str, result: str) -> str:
 
 CODE_FENCE_PATTERN = re.compile(r"^```(?:\w+)?\n?(.*?)```$", re.DOTALL)
 
+
+def _strip_tagged(text: str) -> str:
+    """Remove every <tool_call>...</tool_call> block (an unterminated one runs to the end)."""
+    parts = []
+    pos = 0
+    while True:
+        start = text.find(TOOL_CALL_OPEN, pos)
+        if start < 0:
+            parts.append(text[pos:])
+            return "".join(parts)
+        parts.append(text[pos:start])
+        end = text.find(TOOL_CALL_CLOSE, start)
+        if end < 0:
+            return "".join(parts)
+        pos = end + len(TOOL_CALL_CLOSE)
+
+
 def strip_tool_call(text: str) -> str:
     """Remove <tool_call> block from text."""
     text = strip_thinking(text)
-    text = TOOL_CALL_PATTERN.sub("", text).strip()
+    text = _strip_tagged(text).strip()
     # Strip markdown code fences
     match = CODE_FENCE_PATTERN.match(text)
     if match:
@@ -0,0 +1,239 @@
+"""
+A tool call's result, parsed once.
+
+mcp_client turns every tools/call response into a ToolResult, and the
+result cache, the compactor and the prompt template all read from it, so
+the payload is decoded a single time however many of them look at it. The
+compactor's views are kept with the result, keyed by token budget and (for
+summaries) question. Requests sharing a cached result each find their own
+view, and one asked for under the same budget comes back already
+compacted. memory_bytes estimates what all of that holds in memory; the
+result cache sizes its entries by it.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import sys
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from services.record_columns import RecordColumns
+
+SHAPE_EMPTY = "empty"
+SHAPE_RECORDS = "records"      # a list whose items are objects, bare or wrapped ({"count": n, "runs": [...]})
+SHAPE_LIST = "list"            # any other list
+SHAPE_FLAT = "flat_object"     # an object with scalar values only
+SHAPE_OBJECT = "object"        # an object with nested values
+SHAPE_TEXT = "text"            # not a JSON array or object
+
+# Rough size of a token for estimates made without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Compacted views kept per result; the oldest goes first
+MAX_VIEWS = 4
+
+# Items of a list measured when estimating its memory; longer lists are extrapolated
+SIZE_SAMPLE_ITEMS = 64
+
+# Wrapper fields that give the full length of the record list they wrap
+COUNT_FIELDS = ("count", "total")
+
+ENCODING_VERBATIM = "verbatim"  # the text as returned
+ENCODING_COLUMNAR = "columnar"  # a summary line, a header row, then one delimited row per record
+ENCODING_JSON = "json"          # re-encoded JSON with long values shortened
+ENCODING_LINES = "lines"        # the first lines of plain text
+ENCODING_SUMMARY = "summary"    # aggregates over the records instead of the records
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _estimate_bytes(value: Any) -> int:
+    """
+    Approximate memory held by a parsed JSON value. Dict keys are left out:
+    json.loads shares one string per distinct key across a payload.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        return size + sum(_estimate_bytes(item) for item in value.values())
+    if isinstance(value, list):
+        sample = value[:SIZE_SAMPLE_ITEMS]
+        measured = sum(_estimate_bytes(item) for item in sample)
+        return size + (measured * len(value) // len(sample) if sample else 0)
+    return size
+
+
+def _view_bytes(view: CompactView) -> int:
+    return sys.getsizeof(view.text) + sys.getsizeof(view.question)
+
+
+def _truncation_marker(items: list) -> dict | None:
+    """The {"_truncated_items": n} entry the MCP reader appends to a list it cut short."""
+    last = items[-1] if items else None
+    if isinstance(last, dict) and "_truncated_items" in last and len(last) <= 2:
+        return last
+    return None
+
+
+def _wrapped_records(payload: dict) -> Optional[str]:
+    """
+    The key of the record list an object wraps, as the MCP tools return
+    {"count": n, "runs": [...]}: exactly one list, of objects, beside
+    scalar fields only.
+    """
+    key = None
+    for name, value in payload.items():
+        if isinstance(value, dict):
+            return None
+        if isinstance(value, list):
+            if key is not None:
+                return None
+            key = name
+    if key is None:
+        return None
+    items = payload[key]
+    marker = _truncation_marker(items)
+    if len(items) == (1 if marker else 0) or not isinstance(items[0], dict):
+        return None
+    return key
+
+
+@dataclass
+class ToolResult:
+    tool: str
+    text: str                          # the result as the server returned it (stripped)
+    ok: bool = True
+    payload: Any = None                # parsed JSON (for a wrapped list, the list), without truncation markers; None for text
+    shape: str = SHAPE_TEXT
+    total_items: Optional[int] = None  # list length, including records dropped while reading
+    total_is_lower_bound: bool = False # the response was cut off, so there are more
+    size_bytes: int = 0
+    records_key: Optional[str] = None  # the field a wrapped record list came from
+    envelope: dict[str, Any] = field(default_factory=dict)  # the wrapper's other fields
+    # Columns of every record the MCP reader read, kept or not; None when the payload holds them all
+    columns: Optional[RecordColumns] = field(default=None, repr=False)
+    _views: dict[tuple[int, str], CompactView] = field(default_factory=dict, repr=False)
+    _digest: Optional[str] = field(default=None, repr=False)
+    _payload_bytes: Optional[int] = field(default=None, repr=False)
+    _on_resize: Optional[Callable[[int], None]] = field(default=None, repr=False)
+
+    @classmethod
+    def from_text(cls, tool: str, text: str, ok: bool = True) -> ToolResult:
+        raw = (text or "").strip()
+        result = cls(tool=tool, text=raw, ok=ok, size_bytes=len(raw.encode("utf-8")))
+        if not raw:
+            result.shape = SHAPE_EMPTY
+            return result
+        if not ok or raw[0] not in "[{":
+            return result
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            return result
+
+        key = _wrapped_records(payload) if isinstance(payload, dict) else None
+        if key is not None:
+            result.records_key = key
+            result.envelope = {k: v for k, v in payload.items() if k != key and not k.startswith("_")}
+            payload = payload[key]
+
+        if isinstance(payload, list):
+            marker = _truncation_marker(payload)
+            if marker is not None:
+                payload = payload[:-1]
+                result.total_items = len(payload) + marker.get("_truncated_items", 0)
+                result.total_is_lower_bound = bool(marker.get("_read_limit_reached"))
+            else:
+                result.total_items = len(payload)
+            result.shape = SHAPE_RECORDS if payload and isinstance(payload[0], dict) else SHAPE_LIST
+            # A wrapper's count is the full length, even when the reader cut the list
+            for name in COUNT_FIELDS:
+                count = result.envelope.get(name)
+                if type(count) is int and count >= len(payload):
+                    result.total_items = count
+                    result.total_is_lower_bound = False
+                    break
+        elif isinstance(payload, dict):
+            nested = any(isinstance(v, (dict, list)) for v in payload.values())
+            result.shape = SHAPE_OBJECT if nested else SHAPE_FLAT
+        else:
+            return result
+        result.payload = payload
+        return result
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens of the result as returned."""
+        return estimate_tokens(self.text)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Estimated memory held by the text, the parsed payload (and record columns) and the kept views."""
+        if self._payload_bytes is None:
+            self._payload_bytes = _estimate_bytes(self.payload) + sum(
+                _estimate_bytes(value) for value in self.envelope.values()
+            )
+            if self.columns is not None:
+                self._payload_bytes += self.columns.memory_bytes()
+        return sys.getsizeof(self.text) + self._payload_bytes + sum(_view_bytes(v) for v in self._views.values())
+
+    def on_resize(self, callback: Optional[Callable[[int], None]]) -> None:
+        """Have `callback` told the change in memory_bytes whenever a view is kept or dropped."""
+        self._on_resize = callback
+
+    def view(self, budget_tokens: int, question: str = "") -> Optional[CompactView]:
+        """The view result_compactor made for this budget and question, if it is still kept."""
+        return self._views.get((budget_tokens, question))
+
+    def keep_view(self, view: CompactView) -> None:
+        key = (view.budget_tokens, view.question)
+        change = _view_bytes(view)
+        if key in self._views:
+            change -= _view_bytes(self._views.pop(key))
+        elif len(self._views) >= MAX_VIEWS:
+            change -= _view_bytes(self._views.pop(next(iter(self._views))))
+        self._views[key] = view
+        if self._on_resize is not None and change:
+            self._on_resize(change)
+
+    def digest(self) -> str:
+        """Hash of the result text, computed once; equal digests mean the same data."""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.text.encode("utf-8"), digest_size=16).hexdigest()
+        return self._digest
+
+    def summary(self) -> dict[str, Any]:
+        """What trace spans and logs record about a result."""
+        return {
+            "shape": self.shape,
+            "bytes": self.size_bytes,
+            "tokens": self.tokens,
+            "items": self.total_items,
+        }
+
+
+@dataclass
+class CompactView:
+    """What the prompt shows of a result under a token budget, and what it left out."""
+    text: str
+    budget_tokens: int
+    tokens: int = 0
+    encoding: str = ENCODING_VERBATIM
+    shown_items: Optional[int] = None  # records (or list items) shown, for lists
+    columns: list[str] = field(default_factory=list)          # columns shown, for columnar
+    dropped_columns: list[str] = field(default_factory=list)  # columns left out to fit the budget
+    truncated: bool = False            # cut off mid-text to fit the budget
+    question: str = ""                 # the question a summary was computed for
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "encoding": self.encoding,
+            "budget_tokens": self.budget_tokens,
+            "tokens": self.tokens,
+            "shown_items": self.shown_items,
+            "dropped_columns": len(self.dropped_columns),
+            "truncated": self.truncated,
+        }
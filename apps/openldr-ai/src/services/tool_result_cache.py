@@ -0,0 +1,193 @@
+"""
+TTL/LRU cache for MCP tool results on the deterministic routing path.
+
+Entries are keyed by tool name + canonicalised args. Whether a tool may be
+cached, and for how long, comes from:
+1. AI_TOOL_CACHE_TTLS overrides ("tool_name=seconds,...", 0 disables), then
+2. the tool's MCP annotations - read-only tools get AI_TOOL_CACHE_DEFAULT_TTL_SECONDS.
+Tools that are not read-only are never cached unless explicitly configured.
+
+The cache is bounded by total bytes and evicts least-recently-used entries.
+An entry counts the result's text, its parsed payload and the compacted
+views kept with it (ToolResult.memory_bytes), and grows as views are added.
+Concurrent misses for the same key share one MCP call.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from core.config import settings
+from services.tool_result import ToolResult
+
+
+@dataclass
+class _Entry:
+    value: ToolResult
+    size: int
+    expires_at: float
+
+
+def canonical_args(args: dict[str, Any] | None) -> str:
+    """Stable string form of tool args - key order and None values don't matter."""
+    cleaned = {k: v for k, v in (args or {}).items() if v is not None}
+    return json.dumps(cleaned, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _parse_ttl_overrides(raw: str) -> dict[str, float]:
+    overrides: dict[str, float] = {}
+    for part in raw.split(","):
+        name, sep, ttl = part.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            overrides[name.strip()] = float(ttl)
+        except ValueError:
+            print(f"[tool-cache] Ignoring invalid TTL override: {part!r}")
+    return overrides
+
+
+class ToolResultCache:
+    def __init__(self, max_bytes: int, default_ttl: float, ttl_overrides: dict[str, float]):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttl_overrides = ttl_overrides
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0, "uncacheable": 0}
+
+    def ttl_for(self, tool_name: str, tool: dict[str, Any] | None = None) -> float:
+        """Seconds a result of this tool may be reused; 0 means never cache."""
+        if tool_name in self.ttl_overrides:
+            return max(0.0, self.ttl_overrides[tool_name])
+        annotations = (tool or {}).get("annotations") or {}
+        if annotations.get("readOnlyHint") and not annotations.get("destructiveHint"):
+            return self.default_ttl
+        return 0.0
+
+    def _get(self, key: tuple[str, str]) -> ToolResult | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self._stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry.size
+            entry.value.on_resize(None)
+
+    def _put(self, key: tuple[str, str], value: ToolResult, ttl: float) -> None:
+        size = value.memory_bytes
+        # One huge result shouldn't wipe out everything else
+        if size > self.max_bytes // 4:
+            return
+        self._remove(key)
+        self._entries[key] = _Entry(value, size, time.monotonic() + ttl)
+        self._bytes += size
+        value.on_resize(lambda change: self._resized(key, change))
+        self._evict()
+
+    def _resized(self, key: tuple[str, str], change: int) -> None:
+        """A cached result kept or dropped a compacted view."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.size += change
+        self._bytes += change
+        if entry.size > self.max_bytes // 4:
+            self._remove(key)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    async def get_or_call(
+        self,
+        tool_name: str,
+        args: dict[str, Any] | None,
+        call: Callable[[], Awaitable[ToolResult]],
+        tool: dict[str, Any] | None = None,
+    ) -> tuple[ToolResult, bool]:
+        """
+        Return (result, from_cache). `call` performs the real MCP request;
+        only successful results are stored. A caller that joins an identical
+        call already in flight shares its live result, so from_cache is False.
+        A stored result keeps its compacted views, so a hit skips compaction
+        as well.
+        """
+        ttl = self.ttl_for(tool_name, tool)
+        if ttl <= 0:
+            self._stats["uncacheable"] += 1
+            return await call(), False
+
+        key = (tool_name, canonical_args(args))
+        cached = self._get(key)
+        if cached is not None:
+            self._stats["hits"] += 1
+            return cached, True
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending), False
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The request we were piggybacking on went away - make our own call
+                return await call(), False
+
+        self._stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await call()
+            if result.ok:
+                self._put(key, result, ttl)
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't leave "exception never retrieved" noise
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self) -> None:
+        for entry in self._entries.values():
+            entry.value.on_resize(None)
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+tool_result_cache = ToolResultCache(
+    max_bytes=settings.AI_TOOL_CACHE_MAX_MB * 1024 * 1024,
+    default_ttl=settings.AI_TOOL_CACHE_DEFAULT_TTL_SECONDS,
+    ttl_overrides=_parse_ttl_overrides(settings.AI_TOOL_CACHE_TTLS),
+)
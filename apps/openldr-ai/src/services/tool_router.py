@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import math
 import re
 from dataclasses import dataclass
 from datetime import date, timedelta
@@ -92,166 +93,388 @@ def question_likely_needs_tool(user_text: str) -> bool:
     return any(ch.isdigit() for ch in user_text)
 
 
-def _score_tool(tool: dict[str, Any], user_text: str) -> float:
-    question_words = tokenize_words(user_text)
-    name_words = tokenize_words(tool.get("name", "").replace("_", " "))
-    desc_words = tokenize_words(tool.get("description", ""))
-    param_words = tokenize_words(" ".join((tool.get("inputSchema", {}) or {}).get("properties", {}).keys()))
+# Field weights: a question word in the tool name counts twice as much as
+# one in the description, which counts more than a parameter name
+NAME_WEIGHT = 3.0
+DESCRIPTION_WEIGHT = 1.5
+PARAMETER_WEIGHT = 1.0
 
-    score = 0.0
-    score += len(question_words & name_words) * 3.0
-    score += len(question_words & desc_words) * 1.5
-    score += len(question_words & param_words) * 1.0
+# BM25 term-frequency saturation and length normalisation
+BM25_K1 = 1.2
+BM25_B = 0.75
 
-    if any(token in tool.get("name", "").lower() for token in ["search", "find", "list"]) and any(
-        token in user_text.lower() for token in ["show", "list", "find"]
-    ):
-        score += 1.5
-    if "count" in user_text.lower() and "count" in tool.get("name", "").lower():
-        score += 2.0
-    if "status" in user_text.lower() and "status" in tool.get("name", "").lower():
-        score += 2.0
+# Bonuses when the question's intent matches the kind of tool, on the same
+# scale as a BM25 term (a rare term in a tool's name scores about 1.6)
+LIST_BONUS = 0.75
+COUNT_BONUS = 1.0
+STATUS_BONUS = 1.0
 
-    return score
+# Below this score the question goes to the model-driven fallback
+MIN_SCORE = 1.25
 
 
-def _extract_string_param(user_text: str, param_name: str) -> str | None:
-    lowered = user_text.lower()
-    pname = param_name.lower()
-
-    # UUID-type params: if param name contains "id" and text has a UUID, extract it
-    if "id" in pname:
-        uuids = UUID_RE.findall(user_text)
-        if uuids:
-            # If user wrote "with id <uuid>" or just pasted a UUID
-            return uuids[0]
-
-    quoted = re.findall(r'"([^"]+)"|\'([^\']+)\'', user_text)
-    flattened = [a or b for a, b in quoted if (a or b)]
-    if flattened and any(tag in pname for tag in ["id", "name", "code", "status", "type"]):
-        return flattened[0]
-
-    # Try matching full param name
-    patterns = [
-        rf"{re.escape(pname)}\s+(?:is|=|:)?\s*([a-zA-Z0-9_\-]+)",
-        rf"(?:for|with)\s+{re.escape(pname)}\s+([a-zA-Z0-9_\-]+)",
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, lowered)
-        if match:
-            return match.group(1)
-
-    # Try matching short form: "id" for "projectId", "code" for "facilityCode"
-    short_aliases = {"id": "id", "code": "code", "name": "name", "status": "status", "type": "type"}
-    for alias, tag in short_aliases.items():
-        if tag in pname:
-            match = re.search(rf"(?:with|for|of)\s+{re.escape(alias)}\s+([a-zA-Z0-9_\-]+)", lowered)
-            if match:
-                return match.group(1)
-
-    if pname in {"query", "search", "term", "text"}:
-        return user_text.strip()
-
-    return None
-
-
-def _extract_date_value(user_text: str, param_name: str) -> str | None:
-    lowered = user_text.lower()
-    explicit_dates = DATE_RE.findall(user_text)
-    today = date.today()
-
-    if explicit_dates:
-        if param_name.lower() in {"from_date", "start_date", "date_from", "start"}:
-            return explicit_dates[0]
-        if param_name.lower() in {"to_date", "end_date", "date_to", "end"}:
-            return explicit_dates[-1]
-        return explicit_dates[0]
-
-    if "today" in lowered:
-        return today.isoformat()
-    if "yesterday" in lowered:
-        return (today - timedelta(days=1)).isoformat()
-    if "this week" in lowered and param_name.lower() in {"from_date", "start_date", "date_from", "start"}:
-        return (today - timedelta(days=today.weekday())).isoformat()
-    if "this week" in lowered and param_name.lower() in {"to_date", "end_date", "date_to", "end"}:
-        return today.isoformat()
-
-    return None
-
-
-def _extract_integer_value(user_text: str, param_name: str) -> int | None:
-    lowered = user_text.lower()
-    pname = param_name.lower()
-
-    if pname == "limit":
-        patterns = [r"(?:last|latest|top|first)\s+(\d+)", rf"{re.escape(pname)}\s*(?:is|=|:)?\s*(\d+)"]
-        for pattern in patterns:
-            match = re.search(pattern, lowered)
-            if match:
-                return int(match.group(1))
-
-    match = re.search(rf"{re.escape(pname)}\s*(?:is|=|:)?\s*(\d+)", lowered)
-    if match:
-        return int(match.group(1))
-
-    ints = [int(x) for x in INTEGER_RE.findall(user_text)]
-    if len(ints) == 1 and pname in {"limit", "page", "offset", "count", "days"}:
-        return ints[0]
-    return None
-
-
-def _extract_boolean_value(user_text: str, param_name: str) -> bool | None:
-    lowered = user_text.lower()
-    pname = param_name.lower()
-    for token in BOOLEAN_TRUE:
-        if f"{pname} {token}" in lowered or f"{pname} is {token}" in lowered:
-            return True
-    for token in BOOLEAN_FALSE:
-        if f"{pname} {token}" in lowered or f"{pname} is {token}" in lowered:
-            return False
-    return None
-
-
-def extract_args_from_text(user_text: str, tool: dict[str, Any]) -> tuple[dict[str, Any], list[str]]:
-    schema = tool.get("inputSchema", {}) or {}
-    props = schema.get("properties", {}) or {}
-    required = schema.get("required", []) or []
+@dataclass
+class _IndexedTool:
+    tool: dict[str, Any]
+    list_like: bool   # name contains search/find/list
+    counts: bool      # name contains count
+    status: bool      # name contains status
+
+
+def _idf(n_tools: int, df: int) -> float:
+    return math.log(1 + (n_tools - df + 0.5) / (df + 0.5))
+
+
+class ToolIndex:
+    """
+    Inverted index over a tool catalogue, built once per catalogue.
+
+    Each tool is a document whose terms are its name, description and
+    parameter names, weighted per field. Postings hold the tool's complete
+    BM25 contribution for the term, so scoring a question is a sum over the
+    postings of its terms, and tools sharing no term with it are never
+    touched. IDF is taken relative to a term found in a single tool: a rare
+    term scores the same in a catalogue of 3 tools as in one of 500, and a
+    term every tool has scores close to nothing.
+
+    The argument plan of every tool (ArgPlan) is compiled alongside.
+    """
+
+    def __init__(self, tools: list[dict[str, Any]]):
+        self.tools = tools
+        self.entries: list[_IndexedTool] = []
+        self._plans: dict[int, ArgPlan] = {}
+        weighted_tfs: list[dict[str, float]] = []
+        lengths: list[float] = []
+
+        for tool in tools:
+            name = tool.get("name", "")
+            params = (tool.get("inputSchema", {}) or {}).get("properties", {}) or {}
+            tf: dict[str, float] = {}
+            for words, weight in (
+                (tokenize_words(name.replace("_", " ")), NAME_WEIGHT),
+                (tokenize_words(tool.get("description", "") or ""), DESCRIPTION_WEIGHT),
+                (tokenize_words(" ".join(params.keys())), PARAMETER_WEIGHT),
+            ):
+                for word in words:
+                    tf[word] = tf.get(word, 0.0) + weight
+            lowered = name.lower()
+            self.entries.append(_IndexedTool(
+                tool=tool,
+                list_like=any(token in lowered for token in ("search", "find", "list")),
+                counts="count" in lowered,
+                status="status" in lowered,
+            ))
+            self._plans[id(tool)] = ArgPlan(tool)
+            weighted_tfs.append(tf)
+            lengths.append(sum(tf.values()))
+
+        n_tools = len(tools)
+        avg_length = (sum(lengths) / n_tools) if n_tools else 1.0
+        df: dict[str, int] = {}
+        for tf in weighted_tfs:
+            for term in tf:
+                df[term] = df.get(term, 0) + 1
+
+        rare_idf = _idf(n_tools, 1) if n_tools else 1.0
+        self.postings: dict[str, list[tuple[int, float]]] = {}
+        for i, tf in enumerate(weighted_tfs):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[i] / (avg_length or 1.0))
+            for term, weight in tf.items():
+                saturated = weight * (BM25_K1 + 1) / (weight + norm)
+                self.postings.setdefault(term, []).append((i, _idf(n_tools, df[term]) / rare_idf * saturated))
+
+    def score(
+        self, user_text: str, semantic: dict[int, float] | None = None,
+    ) -> list[tuple[dict[str, Any], float]]:
+        """
+        Tools sharing at least one term with the question, or with a semantic
+        score for it (tool index -> score, added to the lexical one), best
+        first; ties keep catalogue order.
+        """
+        scores: dict[int, float] = dict(semantic or {})
+        for term in tokenize_words(user_text):
+            for i, weight in self.postings.get(term, ()):
+                scores[i] = scores.get(i, 0.0) + weight
+        if not scores:
+            return []
+
+        lowered = user_text.lower()
+        wants_list = any(token in lowered for token in ("show", "list", "find"))
+        wants_count = "count" in lowered
+        wants_status = "status" in lowered
+        for i in scores:
+            entry = self.entries[i]
+            if wants_list and entry.list_like:
+                scores[i] += LIST_BONUS
+            if wants_count and entry.counts:
+                scores[i] += COUNT_BONUS
+            if wants_status and entry.status:
+                scores[i] += STATUS_BONUS
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(self.entries[i].tool, score) for i, score in ranked]
+
+    def arg_plan(self, tool: dict[str, Any]) -> ArgPlan:
+        """The argument plan compiled for this tool when the index was built."""
+        plan = self._plans.get(id(tool))
+        return plan if plan is not None else ArgPlan(tool)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "tools": len(self.tools),
+            "terms": len(self.postings),
+            "params": sum(len(plan.params) for plan in self._plans.values()),
+        }
+
+
+# The index for the last catalogue seen; the catalogue keeps handing out the
+# same list object until its contents change
+_index_cache: dict[str, Any] = {"tools": None, "index": None}
+
+
+def tool_index(tools: list[dict[str, Any]]) -> ToolIndex:
+    """The index for this tool list, built on first use and reused while the list is unchanged."""
+    if _index_cache["tools"] is not tools:
+        _index_cache.update(tools=tools, index=ToolIndex(tools))
+    return _index_cache["index"]
+
+
+START_PARAMS = {"from_date", "start_date", "date_from", "start"}
+END_PARAMS = {"to_date", "end_date", "date_to", "end"}
+# String params whose value may be given in quotes or as "with/for/of <tag> <value>"
+STRING_TAGS = ("id", "name", "code", "status", "type")
+FREE_TEXT_PARAMS = {"query", "search", "term", "text"}
+# Integer params that take the only number in the question when nothing names them
+BARE_INTEGER_PARAMS = {"limit", "page", "offset", "count", "days"}
+
+QUOTED_RE = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+LIMIT_RE = re.compile(r"(?:last|latest|top|first)\s+(\d+)")
+BOOLEAN_WORDS = {**{w: True for w in BOOLEAN_TRUE}, **{w: False for w in BOOLEAN_FALSE}}
+_BOOLEAN_ALTERNATION = "|".join(sorted(BOOLEAN_WORDS, key=len, reverse=True))
+_ALIAS_PATTERNS = {
+    tag: re.compile(rf"(?:with|for|of)\s+{tag}\s+([a-zA-Z0-9_\-]+)") for tag in STRING_TAGS
+}
 
-    args: dict[str, Any] = {}
-    missing_required: list[str] = []
 
-    for param_name, pinfo in props.items():
-        ptype = (pinfo.get("type") or "string").lower()
-        value = None
+class _Query:
+    """What the argument plans look for in a question, found once per question."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lowered = text.lower()
+        self.uuids = UUID_RE.findall(text)
+        self.quoted = [a or b for a, b in QUOTED_RE.findall(text) if (a or b)]
+        self.dates = DATE_RE.findall(text)
+        self.integers = [int(x) for x in INTEGER_RE.findall(text)]
+        self.today = date.today()
+
+
+def _enum_variants(value: str) -> set[str]:
+    lowered = value.lower()
+    return {lowered, lowered.replace("_", " "), lowered.replace("-", " ")}
+
+
+class _ParamPlan:
+    """
+    How to fill one parameter: its kind (enum, integer, number, boolean, date
+    or string), the patterns that find its value, and what to use when the
+    question doesn't give one.
+    """
+
+    def __init__(self, name: str, schema: dict[str, Any], required: bool):
+        self.name = name
+        self.required = required
+        pname = name.lower()
+        ptype = (schema.get("type") or "string")
+        ptype = (ptype[0] if isinstance(ptype, list) and ptype else ptype).lower()
+        fmt = (schema.get("format") or "").lower()
+        escaped = re.escape(pname)
+
+        self.enum: list[Any] | None = schema.get("enum") or None
+        self.minimum = schema.get("minimum")
+        self.maximum = schema.get("maximum")
+        # Used only for a required parameter the question doesn't fill
+        self.fallback = schema.get("default")
+        if self.fallback is None and self.enum and len(self.enum) == 1:
+            self.fallback = self.enum[0]
+
+        if self.enum and any(isinstance(v, str) for v in self.enum):
+            self.kind = "enum"
+            self.enum_lookup: dict[str, Any] = {}
+            for value in self.enum:
+                if isinstance(value, str) and value:
+                    for variant in _enum_variants(value):
+                        self.enum_lookup.setdefault(variant, value)
+            alternation = "|".join(re.escape(v) for v in sorted(self.enum_lookup, key=len, reverse=True))
+            value_re = rf"(?<![a-z0-9])({alternation})(?![a-z0-9])"
+            self.named_re = re.compile(rf"{escaped}\s*(?:is|=|:)?\s*{value_re}")
+            self.anywhere_re = re.compile(value_re)
+            return
 
         if ptype in {"integer", "number"}:
-            value = _extract_integer_value(user_text, param_name)
-        elif ptype == "boolean":
-            value = _extract_boolean_value(user_text, param_name)
+            self.kind = ptype
+            number = r"(\d+(?:\.\d+)?)" if ptype == "number" else r"(\d+)"
+            self.patterns = ((LIMIT_RE,) if pname == "limit" else ()) + (
+                re.compile(rf"{escaped}\s*(?:is|=|:)?\s*{number}"),
+            )
+            self.bare = pname in BARE_INTEGER_PARAMS
+            return
+
+        if ptype == "boolean":
+            self.kind = "boolean"
+            self.boolean_re = re.compile(rf"{escaped}\s+(?:is\s+)?({_BOOLEAN_ALTERNATION})\b")
+            return
+
+        # Strings, and dates given as strings
+        self.kind = "string"
+        self.date_format = fmt if fmt in {"date", "date-time"} else None
+        self.is_date = self.date_format is not None or "date" in pname or pname in {"start", "end"}
+        self.date_role = "start" if pname in START_PARAMS else "end" if pname in END_PARAMS else None
+        self.uuid_only = fmt == "uuid"
+        self.takes_uuid = self.uuid_only or "id" in pname
+        self.takes_quoted = any(tag in pname for tag in STRING_TAGS)
+        self.free_text = pname in FREE_TEXT_PARAMS
+        self.patterns = (
+            re.compile(rf"{escaped}\s+(?:is|=|:)?\s*([a-zA-Z0-9_\-]+)"),
+            re.compile(rf"(?:for|with)\s+{escaped}\s+([a-zA-Z0-9_\-]+)"),
+        )
+        # Short forms: "with id X" for projectId, "for code X" for facilityCode
+        self.alias_patterns = tuple(pattern for tag, pattern in _ALIAS_PATTERNS.items() if tag in pname)
+
+    def extract(self, query: _Query) -> Any:
+        if self.kind == "enum":
+            return self._enum(query)
+        if self.kind in {"integer", "number"}:
+            value = self._number(query)
+        elif self.kind == "boolean":
+            match = self.boolean_re.search(query.lowered)
+            value = BOOLEAN_WORDS[match.group(1)] if match else None
         else:
-            if "date" in param_name.lower() or param_name.lower() in {"start", "end"}:
-                value = _extract_date_value(user_text, param_name)
-            if value is None:
-                value = _extract_string_param(user_text, param_name)
+            value = self._date(query) if self.is_date else None
+            if value is None and not self.date_format:
+                value = self._string(query)
+        if value is not None and self.enum and value not in self.enum:
+            return None
+        return value
+
+    def _enum(self, query: _Query) -> Any:
+        match = self.named_re.search(query.lowered)
+        if match:
+            return self.enum_lookup[match.group(1)]
+        for quoted in query.quoted:
+            if quoted.lower() in self.enum_lookup:
+                return self.enum_lookup[quoted.lower()]
+        match = self.anywhere_re.search(query.lowered)
+        return self.enum_lookup[match.group(1)] if match else None
+
+    def _number(self, query: _Query) -> int | float | None:
+        value: int | float | None = None
+        for pattern in self.patterns:
+            match = pattern.search(query.lowered)
+            if match:
+                text = match.group(1)
+                value = float(text) if "." in text else int(text)
+                break
+        if value is None and self.bare and len(query.integers) == 1:
+            value = query.integers[0]
+        if value is None:
+            return None
+        if self.minimum is not None and value < self.minimum:
+            value = self.minimum
+        if self.maximum is not None and value > self.maximum:
+            value = self.maximum
+        return value
+
+    def _date(self, query: _Query) -> str | None:
+        day: str | None = None
+        if query.dates:
+            day = query.dates[-1] if self.date_role == "end" else query.dates[0]
+        elif "today" in query.lowered:
+            day = query.today.isoformat()
+        elif "yesterday" in query.lowered:
+            day = (query.today - timedelta(days=1)).isoformat()
+        elif "this week" in query.lowered and self.date_role == "start":
+            day = (query.today - timedelta(days=query.today.weekday())).isoformat()
+        elif "this month" in query.lowered and self.date_role == "start":
+            day = query.today.replace(day=1).isoformat()
+        elif ("this week" in query.lowered or "this month" in query.lowered) and self.date_role == "end":
+            day = query.today.isoformat()
+        if day is None or self.date_format != "date-time":
+            return day
+        return f"{day}T23:59:59Z" if self.date_role == "end" else f"{day}T00:00:00Z"
+
+    def _string(self, query: _Query) -> str | None:
+        if self.takes_uuid and query.uuids:
+            return query.uuids[0]
+        if self.uuid_only:
+            return None
+        if self.takes_quoted and query.quoted:
+            return query.quoted[0]
+        for pattern in self.patterns:
+            match = pattern.search(query.lowered)
+            if match:
+                return match.group(1)
+        for pattern in self.alias_patterns:
+            match = pattern.search(query.lowered)
+            if match:
+                return match.group(1)
+        if self.free_text:
+            return query.text.strip()
+        return None
+
+
+class ArgPlan:
+    """
+    Argument extraction for one tool, compiled from its inputSchema: the
+    patterns for every parameter, enum lookup tables, date handling by
+    format and range role, numeric bounds, and the default (or only enum
+    value) that fills a required parameter the question leaves out. The
+    question itself is scanned once, however many parameters there are.
+    """
+
+    def __init__(self, tool: dict[str, Any]):
+        schema = tool.get("inputSchema", {}) or {}
+        props = schema.get("properties", {}) or {}
+        required = set(schema.get("required", []) or [])
+        self.params = [_ParamPlan(name, pinfo or {}, name in required) for name, pinfo in props.items()]
+
+    def extract(self, user_text: str) -> tuple[dict[str, Any], list[str]]:
+        query = _Query(user_text)
+        args: dict[str, Any] = {}
+        missing_required: list[str] = []
+        for param in self.params:
+            value = param.extract(query)
+            if value is None and param.required:
+                value = param.fallback
+            if value is not None:
+                args[param.name] = value
+            elif param.required:
+                missing_required.append(param.name)
+        return args, missing_required
 
-        if value is not None:
-            args[param_name] = value
-        elif param_name in required:
-            missing_required.append(param_name)
 
-    return args, missing_required
+def extract_args_from_text(user_text: str, tool: dict[str, Any]) -> tuple[dict[str, Any], list[str]]:
+    """Arguments for a tool outside the catalogue's index; the router uses the index's compiled plans."""
+    return ArgPlan(tool).extract(user_text)
 
 
-def select_tool_for_query(user_text: str, tools: list[dict[str, Any]]) -> ToolSelection:
+def select_tool_for_query(
+    user_text: str,
+    tools: list[dict[str, Any]],
+    semantic: dict[int, float] | None = None,
+) -> ToolSelection:
     if not tools or not question_likely_needs_tool(user_text):
         return ToolSelection(False, reason="Question does not strongly look like a live-data request.")
 
-    scored = sorted(((tool, _score_tool(tool, user_text)) for tool in tools), key=lambda item: item[1], reverse=True)
-    if not scored or scored[0][1] < 2.0:
+    index = tool_index(tools)
+    scored = index.score(user_text, semantic)
+    if not scored or scored[0][1] < MIN_SCORE:
         return ToolSelection(False, reason="No MCP tool matched the question strongly enough.")
 
     best_tool, confidence = scored[0]
-    args, missing_required = extract_args_from_text(user_text, best_tool)
+    confidence = round(confidence, 3)
+    args, missing_required = index.arg_plan(best_tool).extract(user_text)
 
     if missing_required:
         return ToolSelection(
@@ -0,0 +1,235 @@
+"""
+Per-request span tracing for the /chat endpoints.
+
+A Trace is started by the router for each chat request and made current
+for the code that serves it (a context variable, so concurrent requests
+never see each other's). Services open spans around the steps worth timing
+- MCP handshakes and tool calls, compaction, context fitting, prompt eval
+and decode - and the spans are no-ops when no trace is current.
+
+Finished traces go into a ring buffer of the last AI_TRACE_BUFFER_SIZE
+(GET /debug/traces). A request with "timings": true also gets its trace as
+a final SSE event. With AI_TRACE_OTLP_ENDPOINT set, and the OpenTelemetry
+SDK plus OTLP HTTP exporter installed, every trace is exported to that
+collector as well.
+"""
+import contextvars
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from core.config import settings
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("openldr_ai_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name: str, **attrs: Any):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.spans: list[dict[str, Any]] = []
+        # Indexes of the open spans, innermost last; a span's parent is the one
+        # open when it started
+        self._open: list[int] = []
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+        """Time the block as a span; the yielded dict takes attributes known only at the end."""
+        index = self._start(name, attrs)
+        self._open.append(index)
+        try:
+            yield attrs
+        except GeneratorExit:
+            raise  # an async generator closed early by its consumer
+        except BaseException as e:
+            attrs.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            if index in self._open:
+                self._open.remove(index)
+            self.spans[index]["end"] = time.perf_counter()
+
+    def record(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        """Add a span that already happened (perf_counter start and end)."""
+        index = self._start(name, attrs, start)
+        self.spans[index]["end"] = end
+
+    def _start(self, name: str, attrs: dict[str, Any], start: Optional[float] = None) -> int:
+        self.spans.append({
+            "name": name,
+            "parent": self._open[-1] if self._open else None,
+            "start": time.perf_counter() if start is None else start,
+            "end": None,
+            "attrs": attrs,
+        })
+        return len(self.spans) - 1
+
+    def finish(self) -> None:
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def _ms(self, t: Optional[float]) -> Optional[float]:
+        return None if t is None else round((t - self._t0) * 1000, 2)
+
+    def to_dict(self) -> dict[str, Any]:
+        end = self.finished or time.perf_counter()
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_ms": self._ms(end),
+            "attrs": self.attrs,
+            "spans": [
+                {
+                    "id": i,
+                    "name": s["name"],
+                    "parent": s["parent"],
+                    "start_ms": self._ms(s["start"]),
+                    "duration_ms": round(((s["end"] or end) - s["start"]) * 1000, 2),
+                    **s["attrs"],
+                }
+                for i, s in enumerate(self.spans)
+            ],
+        }
+
+    def unix_ns(self, t: float) -> int:
+        return int((self.started_at + (t - self._t0)) * 1e9)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def activate(trace: Optional[Trace]) -> None:
+    """Make `trace` current for the rest of this task (None clears it)."""
+    _current.set(trace)
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+    """A span on the current trace, or a no-op outside a traced request."""
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+def record(name: str, start: float, end: float, **attrs: Any) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.record(name, start, end, **attrs)
+
+
+# ── ring buffer ───────────────────────────────────────────────────────────────
+
+class TraceBuffer:
+    def __init__(self, size: int):
+        self._traces: deque[Trace] = deque(maxlen=max(1, size))
+        self.enabled = size > 0
+
+    def add(self, trace: Trace) -> None:
+        if self.enabled:
+            self._traces.append(trace)
+
+    def recent(self, limit: int = 20) -> list[dict[str, Any]]:
+        """Newest first."""
+        return [t.to_dict() for t in list(reversed(self._traces))[:limit]]
+
+    def get(self, trace_id: str) -> Optional[dict[str, Any]]:
+        return next((t.to_dict() for t in self._traces if t.trace_id == trace_id), None)
+
+    def clear(self) -> None:
+        self._traces.clear()
+
+
+trace_buffer = TraceBuffer(settings.AI_TRACE_BUFFER_SIZE)
+
+
+# ── OpenTelemetry export (optional) ──────────────────────────────────────────
+
+_otel_tracer: Any = None
+_otel_unavailable = False
+
+
+def _get_otel_tracer() -> Any:
+    global _otel_tracer, _otel_unavailable
+    if _otel_tracer is not None or _otel_unavailable:
+        return _otel_tracer
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        _otel_unavailable = True
+        print("[tracing] AI_TRACE_OTLP_ENDPOINT is set but the OpenTelemetry SDK/OTLP exporter "
+              "isn't installed; traces stay local")
+        return None
+
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.AI_APP_NAME}))
+    endpoint = settings.AI_TRACE_OTLP_ENDPOINT.rstrip("/")
+    if not endpoint.endswith("/v1/traces"):
+        endpoint += "/v1/traces"
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    # A private provider: the service doesn't claim the global one
+    _otel_tracer = provider.get_tracer("openldr-ai")
+    return _otel_tracer
+
+
+def _otel_value(value: Any) -> Any:
+    return value if isinstance(value, (str, bool, int, float)) else str(value)
+
+
+def _export_otel(trace: Trace) -> None:
+    tracer = _get_otel_tracer()
+    if tracer is None:
+        return
+    from opentelemetry import trace as otel_trace
+
+    end = trace.finished or time.perf_counter()
+    root = tracer.start_span(
+        trace.name,
+        start_time=trace.unix_ns(trace._t0),
+        attributes={
+            "openldr.trace_id": trace.trace_id,
+            **{k: _otel_value(v) for k, v in trace.attrs.items() if v is not None},
+        },
+    )
+    exported = []
+    for s in trace.spans:
+        parent = root if s["parent"] is None else exported[s["parent"]]
+        child = tracer.start_span(
+            s["name"],
+            context=otel_trace.set_span_in_context(parent),
+            start_time=trace.unix_ns(s["start"]),
+            attributes={k: _otel_value(v) for k, v in s["attrs"].items() if v is not None},
+        )
+        exported.append(child)
+    for s, child in zip(trace.spans, exported):
+        child.end(end_time=trace.unix_ns(s["end"] or end))
+    root.end(end_time=trace.unix_ns(end))
+
+
+def start_trace(name: str, **attrs: Any) -> Trace:
+    return Trace(name, **attrs)
+
+
+def finish_trace(trace: Trace) -> None:
+    """Close the trace, keep it in the ring buffer and export it if a collector is configured."""
+    if trace.finished is not None:
+        return
+    trace.finish()
+    trace_buffer.add(trace)
+    if settings.AI_TRACE_OTLP_ENDPOINT:
+        try:
+            _export_otel(trace)
+        except Exception as e:
+            print(f"[tracing] OpenTelemetry export failed: {e}")
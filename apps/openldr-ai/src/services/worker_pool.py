@@ -0,0 +1,422 @@
+"""
+Multi-process inference worker pool (AI_INFERENCE_BACKEND=workers).
+
+A single Llama instance decodes one request at a time, and the ggml thread
+pool stops scaling long before 32 cores. In worker mode every model is
+served by AI_INFERENCE_WORKERS processes instead; each one opens the same
+GGUF file (memory-mapped, so the weights are shared through the page cache)
+with its own slice of the cores and its own KV cache and prefix cache.
+
+The API process talks to workers over a multiprocessing Pipe:
+  parent -> worker  ("chat", request_id, {messages, namespace, stream, kwargs})
+                    ("cancel", request_id, None) / ("shutdown", None, None)
+  worker -> parent  ("ready", None, {pid}) once the model is loaded
+                    ("token", request_id, text) ... ("done", request_id, speculative)
+                    ("result", request_id, response) for non-streaming calls
+                    ("error", request_id, message)
+
+A reader thread per worker routes replies to the waiting request through a
+queue of AI_INFERENCE_QUEUE_SIZE entries. A full queue holds the reader, so
+a slow client pauses its worker instead of piling tokens up in the API
+process. When a caller goes away the worker is told to skip or stop the
+request. When a worker dies its in-flight requests fail with an error and
+the worker is restarted.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Optional
+
+from core.config import settings
+from services.speculative import (
+    SpeculativeConfig,
+    SpeculativeStats,
+    build_speculative_decoder,
+    release_score_buffer,
+)
+
+_READY_TIMEOUT_SECONDS = 300.0
+_RESTART_BACKOFF_SECONDS = 1.0
+
+
+# ── worker process ─────────────────────────────────────────────────────────────
+
+def _worker_main(
+    conn,
+    model_path: str,
+    n_ctx: int,
+    n_threads: int,
+    prefix_cache_bytes: int,
+    speculative: Optional[SpeculativeConfig] = None,
+    llama_kwargs: Optional[dict] = None,
+) -> None:
+    """Entry point of a worker process: load the model, then serve requests."""
+    try:
+        from llama_cpp import Llama
+
+        from services.inference_executor import iter_content_tokens, run_chat_completion
+        from services.prefix_cache import PrefixStateCache
+
+        decoder = build_speculative_decoder(speculative, n_ctx=n_ctx, n_threads=n_threads)
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_gpu_layers=0,
+            draft_model=decoder,
+            verbose=False,
+            **(llama_kwargs or {}),
+        )
+        if decoder is not None:
+            release_score_buffer(llm)
+        prefix_cache = PrefixStateCache(llm, max_bytes=prefix_cache_bytes)
+    except Exception as e:
+        conn.send(("error", None, f"Worker failed to load model: {e}"))
+        return
+
+    conn.send(("ready", None, {"pid": os.getpid()}))
+
+    pending: deque = deque()
+    cancelled: set = set()
+
+    def drain() -> None:
+        """Pick up messages that arrived while we were decoding."""
+        while conn.poll():
+            message = conn.recv()
+            if message[0] == "cancel":
+                cancelled.add(message[1])
+            else:
+                pending.append(message)
+
+    while True:
+        message = pending.popleft() if pending else conn.recv()
+        kind, request_id, payload = message
+        if kind == "shutdown":
+            return
+        if kind == "cancel":
+            cancelled.add(request_id)
+            continue
+        if kind != "chat":
+            continue
+        # A caller may have gone away while this request was queued in the pipe
+        drain()
+        if request_id in cancelled:
+            cancelled.discard(request_id)
+            continue
+
+        try:
+            completion = run_chat_completion(
+                llm,
+                prefix_cache,
+                payload["messages"],
+                payload["namespace"],
+                stream=payload["stream"],
+                **payload["kwargs"],
+            )
+            if not payload["stream"]:
+                conn.send(("result", request_id, completion))
+                continue
+
+            tokens = iter_content_tokens(completion)
+            try:
+                for token in tokens:
+                    conn.send(("token", request_id, token))
+                    drain()
+                    if request_id in cancelled:
+                        break
+            finally:
+                tokens.close()
+            conn.send(("done", request_id, decoder.last_request if decoder else None))
+        except Exception as e:
+            conn.send(("error", request_id, str(e)))
+        finally:
+            cancelled.discard(request_id)
+
+
+# ── parent side ────────────────────────────────────────────────────────────────
+
+class _Request:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.AI_INFERENCE_QUEUE_SIZE))
+        self.abandoned = threading.Event()
+
+    def deliver(self, kind: str, payload: Any) -> None:
+        # Called from a reader thread. Blocks it while the queue is full, so
+        # the worker's pipe fills and its decoding pauses (backpressure), but
+        # re-checks for abandonment so a slow client that leaves never hangs it.
+        future = asyncio.run_coroutine_threadsafe(self.queue.put((kind, payload)), self.loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return
+            except TimeoutError:
+                if self.abandoned.is_set() or self.loop.is_closed():
+                    future.cancel()
+                    return
+            except Exception:
+                return
+
+
+class _Worker:
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.ready = threading.Event()
+        # Set once the worker is either ready or gone, so start() never waits out a dead one
+        self.settled = threading.Event()
+        self.error: Optional[str] = None
+        self.inflight: dict[int, _Request] = {}
+        self.send_lock = threading.Lock()
+        self.restarts = 0
+        self.served = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, message: tuple) -> None:
+        with self.send_lock:
+            self.conn.send(message)
+
+
+class WorkerPool:
+    """Dispatches chat completions for one model across worker processes."""
+
+    def __init__(
+        self,
+        model_path: str,
+        n_ctx: int,
+        workers: int,
+        threads_per_worker: int,
+        prefix_cache_bytes: int = 0,
+        name: str = "llama",
+        speculative: Optional[SpeculativeConfig] = None,
+        llama_kwargs: Optional[dict] = None,
+    ):
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.prefix_cache_bytes = prefix_cache_bytes
+        self.name = name
+        self.speculative = speculative
+        # Further Llama() settings (batch size, mmap/mlock, flash attention, KV types)
+        self.llama_kwargs = llama_kwargs or {}
+        self._speculative_stats = SpeculativeStats(speculative.mode) if speculative else None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [_Worker(i) for i in range(max(1, workers))]
+        self._ids = itertools.count(1)
+        self._closed = False
+
+    # ── lifecycle ─────────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        """Spawn every worker and wait until they have loaded the model."""
+        for worker in self._workers:
+            self._spawn(worker)
+        deadline = time.monotonic() + _READY_TIMEOUT_SECONDS
+        for worker in self._workers:
+            worker.settled.wait(timeout=max(0.0, deadline - time.monotonic()))
+        failed = [w.error or "timed out loading model" for w in self._workers if not w.ready.is_set()]
+        if failed:
+            self.close()
+            raise RuntimeError(f"Inference workers failed to start: {failed[0]}")
+
+    def _spawn(self, worker: _Worker) -> None:
+        parent_conn, child_conn = self._ctx.Pipe()
+        worker.ready.clear()
+        worker.settled.clear()
+        worker.error = None
+        worker.conn = parent_conn
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                self.model_path,
+                self.n_ctx,
+                self.threads_per_worker,
+                self.prefix_cache_bytes,
+                self.speculative,
+                self.llama_kwargs,
+            ),
+            name=f"inference-{self.name}-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+        threading.Thread(
+            target=self._read_loop,
+            args=(worker, parent_conn),
+            name=f"inference-{self.name}-{worker.index}-reader",
+            daemon=True,
+        ).start()
+
+    def _read_loop(self, worker: _Worker, conn) -> None:
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if kind == "ready":
+                worker.ready.set()
+                worker.settled.set()
+                continue
+            if kind == "error" and request_id is None:
+                worker.error = payload
+                continue
+
+            request = worker.inflight.get(request_id)
+            if request is None:
+                continue
+            if kind in ("done", "result", "error"):
+                worker.inflight.pop(request_id, None)
+                worker.served += 1
+                self._record_speculative(kind, payload)
+            request.deliver(kind, payload)
+
+        self._on_worker_exit(worker, conn)
+
+    def _record_speculative(self, kind: str, payload: Any) -> None:
+        if self._speculative_stats is None:
+            return
+        if kind == "done":
+            request = payload
+        elif kind == "result":
+            request = payload.get("speculative")
+        else:
+            return
+        if request:
+            self._speculative_stats.record(request)
+
+    def _on_worker_exit(self, worker: _Worker, conn) -> None:
+        if worker.conn is not conn:
+            return
+        worker.settled.set()
+        for request in list(worker.inflight.values()):
+            request.deliver("error", "Inference worker exited unexpectedly")
+        worker.inflight.clear()
+        if self._closed:
+            return
+        if not worker.ready.is_set():
+            # Never loaded the model - restarting would just fail the same way
+            worker.error = worker.error or "Worker exited while loading the model"
+            return
+
+        exitcode = worker.process.exitcode if worker.process else None
+        print(f"[worker-pool] {self.name} worker {worker.index} exited (code {exitcode}), restarting")
+        worker.restarts += 1
+        time.sleep(_RESTART_BACKOFF_SECONDS)
+        if not self._closed:
+            self._spawn(worker)
+
+    def close(self) -> None:
+        """Stop every worker; requests still running are failed."""
+        self._closed = True
+        for worker in self._workers:
+            if not worker.alive:
+                continue
+            try:
+                worker.send(("shutdown", None, None))
+            except (OSError, ValueError):
+                pass
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    # Same shutdown hook as InferenceExecutor
+    shutdown = close
+
+    # ── dispatch ──────────────────────────────────────────────────────────────
+
+    def _pick_worker(self) -> _Worker:
+        candidates = [w for w in self._workers if w.alive and w.ready.is_set()]
+        if not candidates:
+            candidates = [w for w in self._workers if w.alive]
+        if not candidates:
+            raise RuntimeError("No inference workers available")
+        return min(candidates, key=lambda w: len(w.inflight))
+
+    def _submit(self, messages: list[dict], namespace: str, stream: bool, kwargs: dict) -> tuple[_Worker, int, _Request]:
+        worker = self._pick_worker()
+        request_id = next(self._ids)
+        request = _Request(asyncio.get_running_loop())
+        worker.inflight[request_id] = request
+        payload = {"messages": messages, "namespace": namespace, "stream": stream, "kwargs": kwargs}
+        try:
+            worker.send(("chat", request_id, payload))
+        except (OSError, ValueError) as e:
+            worker.inflight.pop(request_id, None)
+            raise RuntimeError(f"Inference worker unavailable: {e}")
+        return worker, request_id, request
+
+    def _abandon(self, worker: _Worker, request_id: int, request: _Request) -> None:
+        """The caller went away: stop routing replies and let the worker skip or stop the request."""
+        request.abandoned.set()
+        worker.inflight.pop(request_id, None)
+        try:
+            worker.send(("cancel", request_id, None))
+        except (OSError, ValueError):
+            pass
+
+    async def complete(self, messages: list[dict], namespace: str = "", **kwargs: Any) -> dict:
+        worker, request_id, request = self._submit(messages, namespace, False, kwargs)
+        try:
+            kind, payload = await request.queue.get()
+        except BaseException:
+            self._abandon(worker, request_id, request)
+            raise
+        if kind == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    async def stream_tokens(
+        self, messages: list[dict], namespace: str = "", **kwargs: Any
+    ) -> AsyncGenerator[str, None]:
+        worker, request_id, request = self._submit(messages, namespace, True, kwargs)
+        finished = False
+        try:
+            while True:
+                kind, payload = await request.queue.get()
+                if kind == "token":
+                    yield payload
+                elif kind == "error":
+                    finished = True
+                    raise RuntimeError(payload)
+                else:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                # Client went away - let the worker stop decoding
+                self._abandon(worker, request_id, request)
+
+    def stats(self) -> dict[str, Any]:
+        stats = {
+            "backend": "workers",
+            "threads_per_worker": self.threads_per_worker,
+            "workers": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid if w.process else None,
+                    "alive": w.alive,
+                    "ready": w.ready.is_set(),
+                    "inflight": len(w.inflight),
+                    "served": w.served,
+                    "restarts": w.restarts,
+                }
+                for w in self._workers
+            ],
+        }
+        if self._speculative_stats is not None:
+            stats["speculative"] = self._speculative_stats.snapshot()
+        return stats
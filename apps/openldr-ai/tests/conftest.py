@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The service runs from src/ (see the Dockerfile), so its modules import as top-level packages
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
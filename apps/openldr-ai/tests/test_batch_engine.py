@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import pytest
+
+from core.config import settings
+
+# The engine needs a real GGUF with a chat template; point AI_TEST_GGUF at one
+GGUF = os.environ.get("AI_TEST_GGUF")
+pytestmark = pytest.mark.skipif(not GGUF, reason="AI_TEST_GGUF is not set")
+
+MESSAGES = [{"role": "user", "content": "Count to one hundred."}]
+
+
+def test_client_that_stops_reading_does_not_hold_up_the_batch(monkeypatch):
+    from services.batch_engine import BatchEngine
+
+    monkeypatch.setattr(settings, "AI_INFERENCE_QUEUE_SIZE", 4)
+    engine = BatchEngine(GGUF, n_ctx_per_sequence=512, n_sequences=2, n_batch=64)
+
+    async def scenario():
+        stalled = engine.stream_tokens(MESSAGES, max_tokens=200, temperature=0.7, seed=1)
+        await stalled.__anext__()
+        # Never read from `stalled` again while another request runs to the end
+        chunks = [chunk async for chunk in engine.stream_tokens(MESSAGES, max_tokens=50, temperature=0.7, seed=2)]
+        assert chunks
+
+        (sequence,) = [slot.sequence for slot in engine._slots if slot.sequence is not None]
+        assert sequence.backed_up
+        assert sequence.pushed - sequence.taken <= settings.AI_INFERENCE_QUEUE_SIZE
+        assert engine.stats()["held_back"] == 1
+
+        # Draining the queue lets it decode again
+        for _ in range(settings.AI_INFERENCE_QUEUE_SIZE + 1):
+            await asyncio.wait_for(stalled.__anext__(), timeout=10)
+        await stalled.aclose()
+        while engine.stats()["active"]:
+            await asyncio.sleep(0.01)
+
+    try:
+        asyncio.run(asyncio.wait_for(scenario(), timeout=60))
+    finally:
+        engine.close()
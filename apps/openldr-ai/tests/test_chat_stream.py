@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from starlette.requests import ClientDisconnect
+
+from routers import chat
+from services.scheduler import scheduler
+from services.tracing import start_trace, trace_buffer
+
+
+def test_disconnect_before_first_chunk_finishes_trace_and_releases_slot():
+    async def scenario():
+        trace = start_trace("chat.stream")
+        ticket = await chat._acquire_slot(chat.LANE_INTERACTIVE, trace)
+        body = chat._sse_generator(ticket, [], 16, 0.2, trace=trace)
+        response = chat._SSEResponse(body, ticket, trace)
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            # The client is already gone when the headers go out
+            raise OSError("connection reset")
+
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with pytest.raises(ClientDisconnect):
+            await response(scope, receive, send)
+        return trace, ticket
+
+    trace, ticket = asyncio.run(scenario())
+    assert trace.finished is not None
+    assert trace_buffer.get(trace.trace_id) is not None
+    assert ticket._released
+    assert scheduler.snapshot()["active"] == 0
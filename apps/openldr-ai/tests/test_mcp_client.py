@@ -0,0 +1,22 @@
+import asyncio
+
+from services import mcp_client
+from services.mcp_client import CatalogueSnapshot, tool_catalogue
+from services.metrics import mcp_tool_calls_total
+
+
+def test_tool_metrics_label_unknown_tool_names(monkeypatch):
+    async def call_once(tool_name, arguments, reader):
+        return '{"ok": true}', "ok"
+
+    monkeypatch.setattr(mcp_client, "_call_tool_once", call_once)
+    monkeypatch.setattr(tool_catalogue, "_snapshot", CatalogueSnapshot(1, [{"name": "get_facilities"}]))
+    known = mcp_tool_calls_total.value("get_facilities", "ok")
+    unknown = mcp_tool_calls_total.value("unknown", "ok")
+
+    asyncio.run(mcp_client._call_tool("get_facilities", {}))
+    asyncio.run(mcp_client._call_tool("made_up_tool", {}))
+
+    assert mcp_tool_calls_total.value("get_facilities", "ok") == known + 1
+    assert mcp_tool_calls_total.value("unknown", "ok") == unknown + 1
+    assert mcp_tool_calls_total.value("made_up_tool", "ok") == 0
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from services.mcp_stream import VERBATIM_CHARS, ToolResponseReader
+from services.result_compactor import compact_tool_result
+from services.tool_result import ToolResult
+
+QUESTION = "how many results by interpretation?"
+RECORDS = [
+    {"id": i, "facility": f"Facility {i % 7}", "interpretation": "R" if i % 4 == 0 else "S", "mic": i % 32}
+    for i in range(10_000)
+]
+
+
+class _Response:
+    """The part of httpx.Response the reader uses, carrying a tools/call reply over SSE."""
+
+    headers = {"content-type": "text/event-stream"}
+
+    def __init__(self, text: str):
+        message = {"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}]}}
+        self.body = f"event: message\ndata: {json.dumps(message)}\n\n".encode("utf-8")
+
+    async def aiter_bytes(self):
+        for i in range(0, len(self.body), 64 * 1024):
+            yield self.body[i:i + 64 * 1024]
+
+
+def _read(text: str, **limits) -> ToolResult:
+    reader = ToolResponseReader(max_bytes=64 * 1024 * 1024, **limits)
+    response = asyncio.run(reader.read(_Response(text)))
+    result = ToolResult.from_text("get_results", response["content"][0]["text"])
+    result.columns = reader.record_columns(result.records_key)
+    return result
+
+
+def test_summary_covers_records_dropped_while_reading():
+    text = json.dumps({"results": RECORDS})
+    assert len(text) > VERBATIM_CHARS
+    result = _read(text, keep_records=100)
+
+    assert len(result.payload) < len(RECORDS)
+    assert result.total_items == result.columns.records == len(RECORDS)
+    summary = compact_tool_result(result, question=QUESTION).text
+    assert "10000 results; statistics over all of them" in summary
+    assert "R 2500" in summary and "S 7500" in summary
+
+
+def test_kept_records_have_their_own_byte_budget():
+    text = json.dumps(RECORDS)
+    assert len(text) > VERBATIM_CHARS
+    assert len(_read(text, keep_records=len(RECORDS)).payload) == len(RECORDS)
+    assert len(_read(text, keep_records=len(RECORDS), keep_chars=64 * 1024).payload) < len(RECORDS)
+
+
+def test_summary_says_when_it_covers_a_sample():
+    result = ToolResult.from_text("get_results", json.dumps({"total": 50_000, "results": RECORDS[:200]}))
+    summary = compact_tool_result(result, question=QUESTION).text
+    assert summary.splitlines()[0] == "# get_results: 50000 results; statistics over a sample of the first 200 only"
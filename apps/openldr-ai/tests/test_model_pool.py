@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.config import settings
+from routers import chat
+from services.model_pool import ModelPool, ResidentModel, model_pool
+
+MB = 1024 * 1024
+
+
+class _Executor:
+    def close(self) -> None:
+        pass
+
+
+def _resident(model_id: str, mb: int) -> ResidentModel:
+    return ResidentModel(
+        model_id=model_id, filename=None, llm=None, executor=_Executor(), prefix_cache=None,
+        n_ctx=4096, weights_bytes=mb * MB, kv_bytes=0,
+    )
+
+
+def test_make_room_keeps_the_default_model():
+    pool = ModelPool(budget_bytes=300 * MB)
+    pool.add(_resident("default", 200))
+    pool.add(_resident("other", 50), make_default=False)
+
+    assert pool.make_room(100 * MB, keep_default=True) == ["other"]
+    assert pool.is_resident("default")
+
+    with pytest.raises(MemoryError):
+        pool.make_room(150 * MB, keep_default=True)
+    assert pool.default_model_id == "default"
+
+    # A model loaded as the new default may replace it
+    assert pool.make_room(150 * MB) == ["default"]
+
+
+def test_request_for_a_non_resident_model_is_rejected(monkeypatch):
+    loads = []
+    monkeypatch.setattr(chat, "load_model", lambda *args, **kwargs: loads.append(args) or (True, None))
+    monkeypatch.setattr(settings, "AI_LOAD_MODELS_ON_DEMAND", False)
+    monkeypatch.setattr(model_pool, "default_model_id", None)
+    model_pool.add(_resident("default", 100))
+    try:
+        with pytest.raises(HTTPException) as rejected:
+            asyncio.run(chat._ensure_model("not-loaded"))
+        assert rejected.value.status_code == 409
+        assert loads == []
+        assert model_pool.default_model_id == "default"
+        assert model_pool.is_resident("default")
+    finally:
+        model_pool.unload("default")
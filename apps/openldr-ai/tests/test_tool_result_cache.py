@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from services.tool_result import CompactView, ToolResult
+from services.tool_result_cache import ToolResultCache
+
+READ_ONLY = {"annotations": {"readOnlyHint": True}}
+RECORDS = json.dumps([{"id": i, "status": "failed", "facility": f"Facility {i % 7}"} for i in range(2000)])
+
+
+def _cache_result(cache: ToolResultCache, text: str, args: dict) -> ToolResult:
+    async def call():
+        return ToolResult.from_text("get_runs", text)
+
+    result, _ = asyncio.run(cache.get_or_call("get_runs", args, call, READ_ONLY))
+    return result
+
+
+def test_entries_count_the_parsed_payload():
+    cache = ToolResultCache(max_bytes=64 * 1024 * 1024, default_ttl=60, ttl_overrides={})
+    result = _cache_result(cache, RECORDS, {})
+    # Parsed records take several times the memory of their JSON text
+    assert cache.stats()["bytes"] == result.memory_bytes
+    assert result.memory_bytes > 3 * result.size_bytes
+
+
+def test_kept_views_grow_the_entry_and_can_evict():
+    size = ToolResult.from_text("get_runs", RECORDS).memory_bytes
+    cache = ToolResultCache(max_bytes=int(size * 5.1), default_ttl=60, ttl_overrides={})
+    results = [_cache_result(cache, RECORDS, {"page": page}) for page in range(5)]
+    before = cache.stats()["bytes"]
+
+    results[-1].keep_view(CompactView("x" * 1000, budget_tokens=2000))
+    assert cache.stats()["bytes"] > before + 1000
+    assert cache.stats()["entries"] == 5
+
+    # Views past what the budget holds push out the least recently used entry
+    results[-1].keep_view(CompactView("y" * int(size * 0.2), budget_tokens=4000))
+    assert cache.stats()["entries"] == 4
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+    assert cache.stats()["bytes"] == sum(result.memory_bytes for result in results[1:])
@@ -0,0 +1,84 @@
+from datetime import date
+
+import numpy as np
+
+from services.semantic_router import SemanticRouter
+from services.tool_router import extract_args_from_text, question_likely_needs_tool, select_tool_for_query
+
+TOOLS = [
+    {
+        "name": "get_instrument_runs",
+        "description": "Instrument run status by facility.",
+        "inputSchema": {"type": "object", "properties": {}},
+    },
+    {
+        "name": "get_patients",
+        "description": "Patient demographics.",
+        "inputSchema": {"type": "object", "properties": {}},
+    },
+]
+# Shares no word with either tool
+QUESTION = "Which labs are failing today?"
+
+
+def test_similarity_just_over_the_floor_does_not_route():
+    assert question_likely_needs_tool(QUESTION)
+    router = SemanticRouter(weight=2.5, min_similarity=0.5)
+
+    weak = router.score_similarities(np.array([0.51, 0.1], dtype=np.float32))
+    assert not select_tool_for_query(QUESTION, TOOLS, weak).should_call_tool
+
+    strong = router.score_similarities(np.array([0.9, 0.1], dtype=np.float32))
+    selection = select_tool_for_query(QUESTION, TOOLS, strong)
+    assert selection.should_call_tool
+    assert selection.tool_name == "get_instrument_runs"
+
+
+def test_semantic_score_is_rescaled_from_the_floor():
+    router = SemanticRouter(weight=2.5, min_similarity=0.5)
+    scores = router.score_similarities(np.array([0.5, 0.75, 1.0, 0.49], dtype=np.float32))
+    assert set(scores) == {0, 1, 2}
+    assert scores[0] == 0.0
+    assert abs(scores[1] - 1.25) < 1e-6
+    assert abs(scores[2] - 2.5) < 1e-6
+
+
+def _tool(**properties):
+    return {"name": "t", "inputSchema": {"type": "object", "properties": properties}}
+
+
+def test_this_month_fills_a_date_range():
+    today = date.today()
+    tool = _tool(from_date={"type": "string"}, to_date={"type": "string"})
+    args, _ = extract_args_from_text("How many runs failed this month?", tool)
+    assert args == {"from_date": today.replace(day=1).isoformat(), "to_date": today.isoformat()}
+
+    tool = _tool(
+        start_date={"type": "string", "format": "date-time"},
+        end_date={"type": "string", "format": "date-time"},
+    )
+    args, _ = extract_args_from_text("Uploads this month", tool)
+    assert args == {
+        "start_date": f"{today.replace(day=1).isoformat()}T00:00:00Z",
+        "end_date": f"{today.isoformat()}T23:59:59Z",
+    }
+
+    # A date parameter with no range role has no meaning for "this month"
+    args, _ = extract_args_from_text("Uploads this month", _tool(date={"type": "string", "format": "date"}))
+    assert args == {}
+
+
+def test_number_parameters_take_decimals():
+    tool = _tool(threshold={"type": "number"}, limit={"type": "integer"})
+    args, _ = extract_args_from_text("Results with threshold 2.5, limit 10", tool)
+    assert args == {"threshold": 2.5, "limit": 10}
+
+    args, _ = extract_args_from_text("Results with threshold 3", tool)
+    assert args["threshold"] == 3 and isinstance(args["threshold"], int)
+
+    # Integer parameters still stop at the decimal point
+    args, _ = extract_args_from_text("limit 7.5", _tool(limit={"type": "integer"}))
+    assert args == {"limit": 7}
+
+    args, _ = extract_args_from_text("threshold 12.75", _tool(threshold={"type": "number", "maximum": 10}))
+    assert args == {"threshold": 10}